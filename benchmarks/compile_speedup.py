@@ -0,0 +1,74 @@
+"""Compare compiled workflows against recursive `Action.__call__`. Exits with non zero code if compiled
+workflow is slower
+
+Usage:
+    python benchmarks/compile_speedup.py [-n ITEMS] [-r REPEAT]
+"""
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'flow'))
+
+from flow import FieldsTransform, GetField, Lambda, Root  # noqa: E402
+
+
+def records_workflow():
+    return GetField('entries')\
+        .for_each(Lambda(dict))\
+        .then(FieldsTransform({'title': str.strip, 'tags': Lambda(len)}))\
+        .then(GetField('title'))\
+        .then(Lambda(str.upper)).root
+
+
+def records_data(items):
+    return {'entries': [{'title': ' title {} '.format(i), 'tags': ['a', 'b']} for i in range(items)]}
+
+
+def chain_workflow(length):
+    workflow = Root()
+    last = workflow
+    for _ in range(length):
+        last = last.then(GetField('value')).then(Lambda(lambda x: {'value': x}))
+    return workflow
+
+
+def measure(name, workflow, data, repeat):
+    compiled = workflow.compile()
+    if workflow(data) != compiled(data):
+        raise RuntimeError('{}: compiled workflow returns different result'.format(name))
+    recursive_times = []
+    compiled_times = []
+    # runs are interleaved, so load spikes of the machine affect both workflows alike
+    for _ in range(repeat):
+        recursive_times.append(timeit.timeit(lambda: workflow(data), number=1))
+        compiled_times.append(timeit.timeit(lambda: compiled(data), number=1))
+    recursive_time = min(recursive_times)
+    compiled_time = min(compiled_times)
+    speedup = recursive_time / compiled_time
+    print('{:<24} {:>12.6f} {:>12.6f} {:>9.2f}x'.format(name, recursive_time, compiled_time, speedup))
+    return speedup
+
+
+def main():
+    parser = argparse.ArgumentParser(description='compiled vs recursive workflow execution',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-n', '--items', type=int, default=100000, help='number of records')
+    parser.add_argument('-r', '--repeat', type=int, default=5, help='number of measurements, best one is reported')
+    settings = parser.parse_args()
+
+    print('{:<24} {:>12} {:>12} {:>10}'.format('workflow', 'recursive, s', 'compiled, s', 'speedup'))
+    speedups = [measure('records x {}'.format(settings.items), records_workflow(), records_data(settings.items),
+                        settings.repeat)]
+    # recursive path can't go deeper than recursion limit
+    length = sys.getrecursionlimit() // 8
+    speedups.append(measure('chain of {} actions'.format(length * 2), chain_workflow(length), {'value': 1},
+                            settings.repeat * 100))
+    if min(speedups) < 1:
+        print('Compiled workflow is slower than recursive one')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,247 @@
+"""Benchmark suite for flow and rss_app ingestion path
+
+Every benchmark is run several times and the best time is reported. Results are saved as JSON,
+so they can be compared with a stored baseline to catch performance regressions.
+
+Usage:
+    python benchmarks/run.py -o results.json
+    python benchmarks/run.py --quick --compare benchmarks/baseline.json --threshold 0.2
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+
+_root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(_root, 'flow'))
+sys.path.insert(0, os.path.join(_root, 'rss_app'))
+
+from flow import FieldsTransform, GetField, Lambda, Root  # noqa: E402
+
+_fixtures = os.path.join(_root, 'rss_app', 'rss_app', 'tests', 'data')
+
+
+def synthetic_feed(entries, authors=50, tags=200):
+    """Build RSS document with `entries` items out of `habr_part*.xml` fixtures
+
+    Every item gets unique guid, authors and tags are taken from pools of `authors` and `tags` names,
+    so ingestion does realistic mix of lookups and inserts.
+    """
+    templates = []
+    for filename in sorted(os.listdir(_fixtures)):
+        if filename.startswith('habr_part') and filename.endswith('.xml'):
+            with open(os.path.join(_fixtures, filename), encoding='utf-8') as f:
+                document = f.read()
+            templates.extend(re.findall(r'<item>.*?</item>', document, re.S))
+    head = document[:document.index('<item>')]
+    tail = document[document.rindex('</item>') + len('</item>'):]
+
+    items = []
+    for i in range(entries):
+        item = templates[i % len(templates)]
+        item = re.sub(r'<guid([^>]*)>[^<]*</guid>', r'<guid\1>https://example.com/post/{}/</guid>'.format(i), item)
+        item = re.sub(r'<dc:creator>[^<]*</dc:creator>', '<dc:creator>author{}</dc:creator>'.format(i % authors), item)
+        item = re.sub(r'<category>.*?</category>',
+                      lambda match, counter=iter(range(i, i + 100)): '<category>tag{}</category>'.format(
+                          next(counter) % tags),
+                      item)
+        items.append(item)
+    return head + '\n'.join(items) + tail
+
+
+def chain_workflow(length):
+    """Chain of `length` actions passing dict through"""
+    workflow = Root()
+    last = workflow
+    for _ in range(length // 2):
+        last = last.then(GetField('value')).then(Lambda(lambda x: {'value': x}))
+    return workflow
+
+
+def wide_workflow(width):
+    """FieldsTransform of `width` fields for each record"""
+    return Root().for_each(FieldsTransform({'f{}'.format(i): Lambda(abs) for i in range(width)})).root
+
+
+def bench_flow(settings, report):
+    for items in settings.items:
+        data = list(range(items))
+        workflow = Root().for_each(Lambda(abs)).root
+        report('for_each.recursive.{}'.format(items), lambda: workflow(data), items)
+        compiled = workflow.compile()
+        report('for_each.compiled.{}'.format(items), lambda: compiled(data), items)
+        streaming = Root().for_each(Lambda(abs), stream=True).root
+        report('for_each.stream.{}'.format(items), lambda: sum(1 for _ in streaming(data)), items)
+
+    # deep chains are limited by recursion limit unless compiled
+    length = sys.getrecursionlimit() // 4
+    workflow = chain_workflow(length)
+    report('chain.recursive.{}'.format(length), lambda: workflow({'value': 1}), length, number=100)
+    compiled = chain_workflow(length * 10).compile()
+    report('chain.compiled.{}'.format(length * 10), lambda: compiled({'value': 1}), length * 10, number=10)
+
+    width = 100
+    records = [{'f{}'.format(i): -i for i in range(width)} for _ in range(max(settings.items) // width)]
+    workflow = wide_workflow(width)
+    report('wide.recursive.{}x{}'.format(len(records), width), lambda: workflow(records), len(records) * width)
+    compiled = workflow.compile()
+    report('wide.compiled.{}x{}'.format(len(records), width), lambda: compiled(records), len(records) * width)
+
+
+def bench_rss(settings, report):
+    import feedparser
+    from flow import ORMSessionSQLAlchemy
+    from rss_app.feeds import store_stream
+    from rss_app.model import Base
+    from rss_app.workflow import feed_extractor
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+
+    for entries in settings.entries:
+        document = synthetic_feed(entries)
+        report('feed.parse.{}'.format(entries), lambda: feedparser.parse(document), entries)
+        parsed = feedparser.parse(document)
+
+        def ingest(url):
+            engine = create_engine(url)
+            Base.metadata.create_all(engine)
+            session = sessionmaker(bind=engine)()
+            # workflow changes entries in place, so every run gets fresh copy
+            with ORMSessionSQLAlchemy(session):
+                feed_extractor({'entries': [entry.copy() for entry in parsed['entries']]})
+            session.close()
+            engine.dispose()
+
+        report('ingest.memory.{}'.format(entries), lambda: ingest('sqlite:///:memory:'), entries)
+
+        with tempfile.TemporaryDirectory() as directory:
+            counter = iter(range(1000000))
+
+            def ingest_disk():
+                ingest('sqlite:///{}'.format(os.path.join(directory, 'db{}.sqlite'.format(next(counter)))))
+
+            report('ingest.disk.{}'.format(entries), ingest_disk, entries)
+
+        def ingest_stream(pipeline):
+            engine = create_engine('sqlite:///:memory:')
+            Base.metadata.create_all(engine)
+            session = sessionmaker(bind=engine)()
+            store_stream(io.BytesIO(document.encode('utf-8')), session, batch_size=100, pipeline=pipeline)
+            session.close()
+            engine.dispose()
+
+        # incremental parsing of the next batches overlaps with storing of the current one in pipeline mode
+        report('ingest.stream.{}'.format(entries), lambda: ingest_stream(False), entries)
+        report('ingest.pipeline.{}'.format(entries), lambda: ingest_stream(True), entries)
+
+
+def import_time(module):
+    """Return cumulative import time of `module` in seconds, parsed from `python -X importtime` output
+    of fresh interpreter"""
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([os.path.join(_root, 'flow'), os.path.join(_root, 'rss_app')]))
+    output = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module], env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=True).stderr.decode('utf-8')
+    for line in output.splitlines():
+        # import time: self [us] | cumulative | imported package
+        parts = line.split('|')
+        if len(parts) == 3 and parts[2].strip() == module:
+            return int(parts[1]) / 1e6
+    raise ValueError("no import time of '{}' in output".format(module))
+
+
+def bench_import(settings, report):
+    # startup of CLI commands like `rss_app -h`, heavy dependencies should be imported on first use
+    for module in ['flow', 'flow.plot', 'rss_app.main']:
+        report('import.{}'.format(module), lambda: import_time(module), 1, timed=True)
+
+
+def compare(results, baseline, threshold):
+    """Return list of lines describing benchmarks slower than `baseline` by more than `threshold`"""
+    regressions = []
+    for name, result in sorted(results.items()):
+        base = baseline.get(name)
+        if base is None:
+            continue
+        ratio = result['seconds'] / base['seconds']
+        if ratio > 1 + threshold:
+            regressions.append('{}: {:.6f}s vs {:.6f}s in baseline ({:+.1f}%)'.format(
+                name, result['seconds'], base['seconds'], (ratio - 1) * 100))
+    return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='flow and rss_app benchmarks',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--items', type=int, nargs='+', default=[100000, 1000000],
+                        help='number of items for for_each benchmarks')
+    parser.add_argument('--entries', type=int, nargs='+', default=[100, 1000],
+                        help='number of entries in synthetic feeds')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='number of runs, the best one is reported')
+    parser.add_argument('--quick', action='store_true', help='small sizes for smoke runs')
+    parser.add_argument('-k', '--filter', type=str, default='', help='run only benchmarks matching regexp')
+    parser.add_argument('--skip-rss', action='store_true', help="don't run rss_app benchmarks")
+    parser.add_argument('-o', '--output', type=str, default='', help='path to save results as JSON')
+    parser.add_argument('--compare', type=str, default='', help='path to baseline JSON to compare with')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='relative slowdown against baseline reported as regression')
+    settings = parser.parse_args()
+    if settings.quick:
+        settings.items = [10000]
+        settings.entries = [50]
+    return settings
+
+
+def main():
+    settings = parse_args()
+    results = {}
+    name_filter = re.compile(settings.filter)
+
+    def report(name, func, items, number=1, timed=False):
+        """Report the best time of `func` runs, if `timed` is True `func` measures and returns time itself"""
+        if not name_filter.search(name):
+            return
+        if timed:
+            seconds = min(func() for _ in range(settings.repeat))
+        else:
+            seconds = min(timeit.repeat(func, number=number, repeat=settings.repeat)) / number
+        results[name] = {'seconds': seconds, 'items': items, 'items_per_second': items / seconds if seconds else None}
+        print('{:<36} {:>12.6f} s {:>14.0f} items/s'.format(name, seconds, items / seconds if seconds else 0))
+        sys.stdout.flush()
+
+    bench_import(settings, report)
+    bench_flow(settings, report)
+    if not settings.skip_rss:
+        bench_rss(settings, report)
+
+    if settings.output:
+        meta = {
+            'timestamp': int(time.time()),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'repeat': settings.repeat,
+        }
+        with open(settings.output, 'w') as f:
+            json.dump({'meta': meta, 'results': results}, f, indent=2, sort_keys=True)
+        print("Results are saved to '{}'".format(settings.output))
+
+    if settings.compare:
+        with open(settings.compare) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, settings.threshold)
+        if regressions:
+            print('Regressions against {}:'.format(settings.compare))
+            for line in regressions:
+                print('  ' + line)
+            sys.exit(1)
+        print('No regressions against {}'.format(settings.compare))
+
+
+if __name__ == '__main__':
+    main()
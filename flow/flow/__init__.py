@@ -1,4 +1,57 @@
-from .session import *
-from .action import *
+import importlib
 
 __version__ = '0.1.0'
+
+# public name -> submodule defining it. Submodules are imported on the first access of their names,
+# so `import flow` is cheap and asyncio, concurrent.futures and others are loaded only when they are used
+_lazy_names = {
+    'LRUCache': 'cache',
+    'ORMSessionBase': 'session',
+    'ORMSessionSQLAlchemy': 'session',
+    'current_session': 'session',
+    'ProcessExecutor': 'executor',
+    'SerialExecutor': 'executor',
+    'ThreadExecutor': 'executor',
+    'make_executor': 'executor',
+    'Action': 'action',
+    'AsyncAction': 'action',
+    'Cache': 'action',
+    'Debug': 'action',
+    'FieldsTransform': 'action',
+    'GetField': 'action',
+    'Lambda': 'action',
+    'ModelObjectCreate': 'action',
+    'Project': 'action',
+    'Root': 'action',
+    'CompiledWorkflow': 'compiler',
+    'Step': 'compiler',
+    'NodeStats': 'profile',
+    'Profiler': 'profile',
+    'node_label': 'profile',
+    'DeadLetter': 'errors',
+    'DeadLetterFile': 'errors',
+    'DeadLetterList': 'errors',
+    'DeadLetterStore': 'errors',
+    'ErrorPolicy': 'errors',
+    'Pipeline': 'pipeline',
+    'Stage': 'pipeline',
+    'custom_fields_functions': 'analysis',
+    'prune_fields': 'analysis',
+    'required_fields': 'analysis',
+}
+
+__all__ = sorted(_lazy_names)
+
+
+def __getattr__(name):
+    module_name = _lazy_names.get(name)
+    if module_name is None:
+        raise AttributeError("module '{}' has no attribute '{}'".format(__name__, name))
+    value = getattr(importlib.import_module('.' + module_name, __name__), name)
+    # the next access doesn't go through `__getattr__`
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
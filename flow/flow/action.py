@@ -1,6 +1,17 @@
 from abc import ABC, abstractmethod
+import asyncio
+import contextlib
+import functools
+import inspect
+import itertools
+from operator import itemgetter
 import threading
-from .session import _thread_local_storage
+import time
+from . import profile
+from .cache import LRUCache
+from .errors import _Failure, _failed_node, _format_failure, _make_error_policy
+from .executor import make_executor
+from .session import current_session
 
 
 class Action(ABC):
@@ -11,12 +22,25 @@ class Action(ABC):
     method to perform actions. Actions can be chained by `then` and/or
     `for_each` methods.
 
+    Workflows can be run from asyncio coroutines by `acall` method. Child classes
+    can define `ado` coroutine to do asynchronous work (see `AsyncAction`).
+
     Attributes
     ----------
     next_action : Action
         action to be called next, could be None
     for_each : Action
         action to be called on each element of data, could be None. Data must be iterable.
+    for_each_executor : executor object
+        executor used to call `for_each` action on elements, None means serial execution
+    for_each_concurrency : int
+        max number of elements processed concurrently by `acall`, None means no limit
+    for_each_stream : bool
+        if True `for_each` results are passed to next action as generator instead of list
+    for_each_chunk_size : int
+        if not None `for_each` results are passed to next action as generator of lists of `for_each_chunk_size` elements
+    for_each_errors : ErrorPolicy
+        how elements failed by `for_each` action are handled, None means the exception is propagated
     root : Action
         root stores a pointer to root action of a workflow
     """
@@ -24,6 +48,11 @@ class Action(ABC):
     def __init__(self):
         self.next_action = None
         self.for_each_action = None
+        self.for_each_executor = None
+        self.for_each_concurrency = None
+        self.for_each_stream = False
+        self.for_each_chunk_size = None
+        self.for_each_errors = None
         self.root = self
 
     def then(self, action):
@@ -32,9 +61,56 @@ class Action(ABC):
         action.root = self.root
         return action
 
-    def for_each(self, action):
-        """Attach `action` as for_each action"""
+    def for_each(self, action, executor=None, max_workers=None, concurrency=None, stream=False, chunk_size=None,
+                 errors=None):
+        """Attach `action` as for_each action
+
+        Parameters
+        ----------
+        action : Action - action to be called on each element of data
+        executor : string or executor object - how elements are processed: 'serial' (default), 'thread' or 'process'
+            (see `flow.executor`). Order of results is kept in any case
+        max_workers : int - max number of parallel workers for 'thread' and 'process' executors
+        concurrency : int - max number of elements processed concurrently when workflow is run by `acall`.
+            Elements are fanned out by `asyncio.gather`, `executor` isn't used in this case
+        stream : bool - process elements lazily: next action gets generator of results, so elements are processed
+            as next action consumes them and memory doesn't grow with data size. Generator should be consumed
+            within ORMSessionBase context. `acall` doesn't support streaming and always passes lists
+        chunk_size : int - streaming mode where next action gets generator of lists of `chunk_size` results
+            (the last one could be shorter). Implies `stream`
+        errors : ErrorPolicy or str - how elements failed by `action` are handled: 'raise' (default), 'skip' or
+            'retry' (see `flow.errors.ErrorPolicy`). Failed elements are dropped from results and recorded to
+            dead letters of the policy. If `action` processes elements at once (overrides `map` or defines
+            `do_batch`) and the policy copies elements, copies of all elements are processed at once and if some
+            element fails, elements are processed again one by one to find failed ones
+
+        Order of processing: if every action of the `action` chain defines `do_batch` (see `Action.map`), elements
+        are processed stage by stage, each action of the chain is done on all elements before the next action
+        (fields of `FieldsTransform` are transformed field by field, nested `for_each` actions get elements of all
+        items at once). Otherwise each element passes the whole chain before the next element. Compiled workflows
+        keep the same order, so actions with side effects see the same sequence of calls either way
+
+        Example
+        -------
+        Store huge list of books by chunks of 1000 with constant memory, each chunk is searched in DB by one query:
+        >>> store_chunk = Root().for_each(ModelObjectCreate(Book, unique=['name'], batch=True)).root
+        >>> books = GetField('books')
+        >>> books.for_each(FieldsTransform({'name': str.upper}), chunk_size=1000)
+        >>> books.then(Root().for_each(store_chunk, stream=True).root)
+        >>> for chunk in books(data):
+        >>>     pass
+        """
+        if concurrency is not None and concurrency < 1:
+            raise ValueError('concurrency should be > 0 (got: {})'.format(concurrency))
+        if chunk_size is not None and chunk_size < 1:
+            raise ValueError('chunk_size should be > 0 (got: {})'.format(chunk_size))
         self.for_each_action = action
+        self.for_each_executor = make_executor(executor, max_workers) if executor is not None else None
+        self.for_each_concurrency = concurrency
+        self.for_each_stream = stream or chunk_size is not None
+        self.for_each_chunk_size = chunk_size
+        errors = _make_error_policy(errors)
+        self.for_each_errors = errors if errors is not None and errors.mode != 'raise' else None
         action.root = self.root
         return action
 
@@ -64,18 +140,343 @@ class Action(ABC):
         any
             return value of the action
         """
-        ret = self.do(data)
+        if profile._active is not None:
+            return profile._active.call(self, data)
+        return self._continue(self.do(data))
+
+    def do_batch(self, items):
+        """Optional batch version of `do`: perform the action on each element of `items` list at once.
+
+        Actions overriding it are called by `map` with all elements when every action of the chain started from
+        the action defines `do_batch`, so per element dispatch cost is paid once per chain instead of once per element
+
+        Parameters
+        ----------
+        items : list - arguments to action
+
+        Returns
+        -------
+        list
+            return values of the action for each element
+        """
+        return [self.do(item) for item in items]
+
+    def map(self, items, executor=None):
+        """Call action on each element of `items`. Used to perform `for_each` actions.
+
+        Child actions can override it to process all elements at once (see `ModelObjectCreate`).
+        If all actions of the chain define `do_batch`, elements are processed stage by stage by `do_batch` calls
+
+        Parameters
+        ----------
+        items : iterable - elements to call action on
+        executor : executor object - executor to call action with, None means serial execution
+
+        Returns
+        -------
+        list
+            return values of the action for each element
+        """
+        if executor is None:
+            if self._batch_chain():
+                return self._call_batch(list(items))
+            return [self(item) for item in items]
+        return executor.map(self, items)
+
+    def imap(self, items, executor=None):
+        """Lazy version of `map`. Used to perform `for_each` actions in streaming mode.
+
+        Returns
+        -------
+        generator
+            return values of the action for each element
+        """
+        if executor is None:
+            return (self(item) for item in items)
+        return executor.imap(self, items)
+
+    def compile(self):
+        """Compile workflow started from this action into `CompiledWorkflow`.
+
+        Compiled workflow is run by iterative interpreter, so it is faster and isn't limited by recursion depth.
+        Workflow shouldn't be changed after compilation.
+        """
+        from .compiler import CompiledWorkflow
+        return CompiledWorkflow(self)
+
+    def _batch_chain(self):
+        """Whether every action of the chain defines `do_batch` and doesn't override `__call__`"""
+        action = self
+        while action is not None:
+            if not _defines_batch(type(action)) or type(action).__call__ is not Action.__call__:
+                return False
+            action = action.next_action
+        return True
+
+    def _call_batch(self, items):
+        """Batch version of `__call__` for chains checked by `_batch_chain`"""
+        action = self
+        while action is not None:
+            if profile._active is not None:
+                items = profile._active.batch(action, action._do_batch, items, 'batch')
+            else:
+                items = action._do_batch(items)
+            action = action.next_action
+        return items
+
+    def _do_batch(self, items):
+        """Perform `do_batch` and registered `for_each` action on `items`, batch version of `do` and `_for_each`"""
+        items = self.do_batch(items)
+        if self.for_each_action is not None:
+            items = self._for_each_batch(items)
+        return items
+
+    def _for_each_batch(self, items):
+        """Perform registered `for_each` action on elements of every item of `items`. Elements of all items are
+        processed by one `map` call unless `for_each` is parallel, streaming or error handling"""
+        if self.for_each_executor is None and not self.for_each_stream and self.for_each_errors is None:
+            return _flat_map(self.for_each_action.map, items)
+        return [self._for_each(item) for item in items]
+
+    def _continue(self, ret):
+        """Perform registered `for_each` and `next` actions on `ret` returned by `do`"""
         if self.for_each_action is not None:
-            ret2 = []
-            for item in ret:
-                ret2.append(self.for_each_action(item))
-            ret = ret2
+            ret = self._for_each(ret)
 
         if self.next_action is not None:
             return self.next_action(ret)
         else:
             return ret
 
+    def _for_each(self, ret):
+        """Perform registered `for_each` action on elements of `ret`"""
+        if self.for_each_errors is not None:
+            if self.for_each_stream:
+                ret = _guarded_imap(self.for_each_action, ret, self.for_each_errors, self.for_each_executor)
+                if self.for_each_chunk_size is not None:
+                    ret = _chunks(ret, self.for_each_chunk_size)
+                return ret
+            return _guarded_map(self.for_each_action, ret, self.for_each_errors, self.for_each_executor)
+        if self.for_each_stream:
+            ret = self.for_each_action.imap(ret, self.for_each_executor)
+            if self.for_each_chunk_size is not None:
+                ret = _chunks(ret, self.for_each_chunk_size)
+            return ret
+        return self.for_each_action.map(ret, self.for_each_executor)
+
+    async def ado(self, data):
+        """Asynchronous version of `do`. By default it calls `do`, so sync and async actions can be mixed in one chain
+
+        Parameters
+        ----------
+        data : any - argument to action
+
+        Returns
+        -------
+        any
+            return value of the action
+        """
+        return self.do(data)
+
+    async def acall(self, data):
+        """Asynchronous version of `__call__`. Should be awaited from coroutine to perform all registered actions
+
+        ORM session is taken from `contextvars`, so many workflows with different sessions can be run by one event loop.
+
+        Parameters
+        ----------
+        data : any - argument to action
+
+        Returns
+        -------
+        any
+            return value of the action
+        """
+        return await self._acontinue(await self.ado(data))
+
+    async def amap(self, items, concurrency=None):
+        """Asynchronous version of `map`. Elements of `items` are processed concurrently by `asyncio.gather`
+
+        If some elements fail, the exception of the first failed element (in `items` order) is raised
+        and the rest are cancelled.
+
+        Parameters
+        ----------
+        items : iterable - elements to call action on
+        concurrency : int - max number of elements processed concurrently, None means no limit
+
+        Returns
+        -------
+        list
+            return values of the action for each element
+        """
+        return await _gather(self.acall, items, concurrency)
+
+    async def _acontinue(self, ret):
+        """Asynchronous version of `_continue`"""
+        if self.for_each_errors is not None:
+            ret = await _aguarded_map(self.for_each_action, ret, self.for_each_errors, self.for_each_concurrency)
+        elif self.for_each_action is not None:
+            ret = await self.for_each_action.amap(ret, self.for_each_concurrency)
+
+        if self.next_action is not None:
+            return await self.next_action.acall(ret)
+        else:
+            return ret
+
+
+class AsyncAction(Action):
+    """AsyncAction base class for actions doing asynchronous work (network calls and so on)
+
+    Child classes must define `ado` coroutine instead of `do`. AsyncAction can be chained
+    with usual actions, such workflows should be run by `acall`:
+        > await GetField('urls').for_each(MyFetchAction(), concurrency=100).root.acall(data)
+    """
+
+    @abstractmethod
+    async def ado(self, data):
+        """All async actions should expose `ado` coroutine to do actual work"""
+
+    def do(self, data):
+        """Run `ado` in a new event loop. Can't be used within running event loop, use `acall` there"""
+        return asyncio.run(self.ado(data))
+
+
+def _flat_map(func, lists):
+    """Call `func` on elements of all `lists` at once and split its results back to lists of the same lengths"""
+    lists = [list(elements) for elements in lists]
+    results = iter(func([element for elements in lists for element in elements]))
+    return [list(itertools.islice(results, len(elements))) for elements in lists]
+
+
+def _chunks(items, chunk_size):
+    """Split iterable `items` into lists of `chunk_size` elements lazily"""
+    iterator = iter(items)
+    while True:
+        chunk = list(itertools.islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class _Guarded:
+    """Callable performing `action` on one element according to `ErrorPolicy`, returns `_Failure` if it fails.
+    It's picklable if the action and the policy are, so it's passed to executors"""
+    def __init__(self, action, policy, savepoints):
+        self.action = action
+        self.policy = policy
+        self.savepoints = savepoints
+
+    def __call__(self, item):
+        policy = self.policy
+        for attempt in range(policy.retries + 1):
+            if attempt:
+                time.sleep(policy.delay(attempt))
+            data = item if policy.copy is None else policy.copy(item)
+            try:
+                with self._savepoint():
+                    return self.action.map([data])[0]
+            except policy.exceptions as e:
+                exception = e
+        return _failure(item, exception, self.action)
+
+    def batch(self, items):
+        """Perform action on all `items` at once, if it fails they are processed one by one. Batch is tried on
+        copies only, since elements changed in place by the failed batch can't be processed again"""
+        if len(items) > 1 and self.policy.copy is not None:
+            data = [self.policy.copy(item) for item in items]
+            try:
+                with self._savepoint():
+                    return self.action.map(data)
+            except self.policy.exceptions:
+                pass
+        return [self(item) for item in items]
+
+    def _savepoint(self):
+        session = current_session() if self.savepoints else None
+        return session.savepoint() if session is not None else contextlib.nullcontext()
+
+
+@functools.lru_cache(maxsize=None)
+def _defines_batch(cls):
+    """Whether `do_batch` of action class `cls` does what its `do` does: `do_batch` should be defined by the class
+    defining `do` or by its subclass, so subclasses overriding only `do` are performed element by element"""
+    def owner(name):
+        return next(base for base in cls.__mro__ if name in base.__dict__)
+
+    batch_owner = owner('do_batch')
+    return batch_owner is not Action and issubclass(batch_owner, owner('do'))
+
+
+def _failure(item, exception, action):
+    error, traceback = _format_failure(exception)
+    return _Failure(item, _failed_node(exception, action), error, traceback)
+
+
+def _guarded_map(action, items, policy, executor=None):
+    """Perform `action` on each element of `items` handling failures by `policy`. Failed elements are recorded
+    to dead letters of `policy` and dropped from results"""
+    guarded = _Guarded(action, policy, policy.savepoints and executor is None)
+    if executor is not None:
+        results = executor.map(guarded, items)
+    elif type(action).map is not Action.map or action._batch_chain():
+        results = guarded.batch(list(items))
+    else:
+        results = [guarded(item) for item in items]
+    return list(_drop_failures(results, policy))
+
+
+def _guarded_imap(action, items, policy, executor=None):
+    """Lazy version of `_guarded_map`"""
+    guarded = _Guarded(action, policy, policy.savepoints and executor is None)
+    results = (guarded(item) for item in items) if executor is None else executor.imap(guarded, items)
+    return _drop_failures(results, policy)
+
+
+async def _aguarded_map(action, items, policy, concurrency=None):
+    """Asynchronous version of `_guarded_map`, elements aren't processed within savepoints"""
+    async def call(item):
+        for attempt in range(policy.retries + 1):
+            if attempt:
+                await asyncio.sleep(policy.delay(attempt))
+            data = item if policy.copy is None else policy.copy(item)
+            try:
+                return (await action.amap([data]))[0]
+            except policy.exceptions as e:
+                exception = e
+        return _failure(item, exception, action)
+
+    return list(_drop_failures(await _gather(call, items, concurrency), policy))
+
+
+def _drop_failures(results, policy):
+    for result in results:
+        if isinstance(result, _Failure):
+            policy.record(result)
+        else:
+            yield result
+
+
+async def _gather(func, items, concurrency=None):
+    """Await `func` on each element of `items` concurrently keeping results order, at most `concurrency` at once"""
+    semaphore = asyncio.Semaphore(concurrency) if concurrency is not None else None
+
+    async def call(item):
+        if semaphore is None:
+            return await func(item)
+        async with semaphore:
+            return await func(item)
+
+    tasks = [asyncio.ensure_future(call(item)) for item in items]
+    try:
+        # awaiting in order makes raised exception independent of timings
+        return [await task for task in tasks]
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
 
 class Root(Action):
     """Action that do nothing. Useful as first action:
@@ -84,6 +485,9 @@ class Root(Action):
     def do(self, data):
         return data
 
+    def do_batch(self, items):
+        return items
+
 
 class Debug(Action):
     """Debug prints its argument without transformations"""
@@ -106,6 +510,9 @@ class GetField(Action):
     def do(self, data):
         return data[self.field]
 
+    def do_batch(self, items):
+        return list(map(itemgetter(self.field), items))
+
 
 class FieldsTransform(Action):
     """Perform actions on particular data fields and put result back"""
@@ -137,6 +544,19 @@ class FieldsTransform(Action):
             data[key] = transformation(data[key])
         return data
 
+    def do_batch(self, items):
+        # every field is transformed as a column, so field actions could process it at once
+        for key, transformation in self.transformations.items():
+            column = transformation.map([data[key] for data in items])
+            for data, value in zip(items, column):
+                data[key] = value
+        return items
+
+    async def ado(self, data):
+        for key, transformation in self.transformations.items():
+            data[key] = await transformation.acall(data[key])
+        return data
+
     def sub_actions(self):
         return [(k, v) for k, v in self.transformations.items()]
 
@@ -144,29 +564,162 @@ class FieldsTransform(Action):
 class Lambda(Action):
     """Wraps any callable object as Action"""
 
-    def __init__(self, func):
+    def __init__(self, func, vectorized=False):
+        """
+        Parameters
+        ----------
+        func : callable - function to call on data
+        vectorized : bool - `func` takes NumPy array as well as single value, like NumPy ufuncs do.
+            Then `do_batch` calls `func` once on array of all elements, numeric fields are processed without
+            per element Python calls. Requires NumPy
+
+        Example
+        -------
+        >>> Root().for_each(FieldsTransform({'price': Lambda(numpy.log1p, vectorized=True)}))
+        """
         super(Lambda, self).__init__()
         if not callable(func):
             raise ValueError("expected func to be callable object, got type '{}'".format(type(func)))
         self.func = func
+        self.vectorized = vectorized
 
     def do(self, data):
         return self.func(data)
 
+    def do_batch(self, items):
+        if self.vectorized and items:
+            import numpy
+            return self.func(numpy.asarray(items)).tolist()
+        return list(map(self.func, items))
+
+    async def ado(self, data):
+        ret = self.func(data)
+        # coroutine functions can be wrapped as well
+        if inspect.isawaitable(ret):
+            ret = await ret
+        return ret
+
+
+class Project(Action):
+    """Project keeps only given fields of dict data as a new compact dict. Missing fields are skipped,
+    data of other types is passed as is
+
+    It's inserted by `flow.analysis.prune_fields` in front of actions reading only a few fields of large records.
+    """
+
+    def __init__(self, fields):
+        """
+        Parameters
+        ----------
+        fields : list - fields to keep
+        """
+        super(Project, self).__init__()
+        self.fields = list(fields)
+
+    def do(self, data):
+        if not isinstance(data, dict):
+            return data
+        return {field: data[field] for field in self.fields if field in data}
+
+    def do_batch(self, items):
+        return [self.do(data) for data in items]
+
+
+# marks cache miss
+_MISSING = object()
+
+
+class Cache(Action):
+    """Cache memoizes results of wrapped action chain
+
+    Results are stored in `LRUCache` by key of data, so the chain is called once for repeated data until the result
+    is evicted or expired. The same result object is returned for repeated data, so it shouldn't be changed
+    by next actions. Cache is thread safe, but the chain could be called concurrently for the same missed key.
+    """
+
+    def __init__(self, action, key=None, maxsize=1024, ttl=None):
+        """
+        Parameters
+        ----------
+        action : Action object or any callable - chain to memoize, should be pure
+        key : callable - returns hashable key of data, None means data itself is the key
+        maxsize : int - max number of cached results, least recently used are evicted first
+        ttl : float - time to live of results in seconds, None means results don't expire
+
+        Example
+        -------
+        >>> FieldsTransform({'author': Cache(Lambda(normalize_name), maxsize=10000),
+                             'tags': Cache(Lambda(resolve_synonyms), key=tuple, ttl=3600)})
+        """
+        super(Cache, self).__init__()
+        if issubclass(type(action), Action):
+            self.action = action
+        elif callable(action):
+            self.action = Lambda(action)
+        else:
+            raise ValueError('unexpected type of action (got {})'.format(type(action)))
+        self.key = key
+        self.cache = LRUCache(maxsize=maxsize, ttl=ttl)
+
+    def do(self, data):
+        key = data if self.key is None else self.key(data)
+        ret = self.cache.get(key, _MISSING)
+        if ret is _MISSING:
+            ret = self.action(data)
+            self.cache.put(key, ret)
+        return ret
+
+    def do_batch(self, items):
+        keys = items if self.key is None else [self.key(data) for data in items]
+        results = [self.cache.get(key, _MISSING) for key in keys]
+        # missed keys are computed once by one batch
+        missed = {}
+        for key, data, ret in zip(keys, items, results):
+            if ret is _MISSING and key not in missed:
+                missed[key] = data
+        if missed:
+            for key, ret in zip(missed, self.action.map(list(missed.values()))):
+                self.cache.put(key, ret)
+                missed[key] = ret
+            results = [missed[key] if ret is _MISSING else ret for key, ret in zip(keys, results)]
+        return results
+
+    async def ado(self, data):
+        key = data if self.key is None else self.key(data)
+        ret = self.cache.get(key, _MISSING)
+        if ret is _MISSING:
+            ret = await self.action.acall(data)
+            self.cache.put(key, ret)
+        return ret
+
+    def stats(self):
+        """Return dict with cache size and hits/misses counters"""
+        return self.cache.stats()
+
+    def sub_actions(self):
+        return [('cached', self.action)]
+
 
 class ModelObjectCreate(Action):
     """ModelObjectCreate fills ORM model object and add it to current session"""
 
-    def __init__(self, orm_model, fields=None, unique=None, fields_map=None):
+    def __init__(self, orm_model, fields=None, unique=None, fields_map=None, batch=False, bulk=False):
         """
         Parameters
         ----------
         orm_model : class - class of the model to fill
         fields : list - orm_model attributes to set.
             If `fields` is None than all data fields will be added to `orm_model` instance
-        fields_map : dict - key: orm_model field, value: data field. `fields_map` is used when orm and data fields differ.
+        fields_map : dict - key: orm_model field, value: data field. `fields_map` is used when orm and data fields
+            differ.
         unique : list - orm_model fields to ne unique in DB. If mode object with such fields alreade exist in DB then
             it will be changed instead of creating duplicate
+        batch : bool or int - used along with `unique`. When action is called as `for_each` action, the unique keys
+            of all elements are searched in DB at once by `get_or_create_many` instead of one query per element.
+            In streaming mode keys are searched by chunks of `batch` elements (1000 if `batch` is True)
+        bulk : bool - used along with `unique`. When action is called as `for_each` action, objects of all elements
+            are written by session `bulk_upsert` (INSERT ... ON CONFLICT for SQLAlchemy) instead of ORM object by
+            object processing. Returned objects are loaded back from DB. Implies `batch`
 
         Example
         -------
@@ -180,6 +733,8 @@ class ModelObjectCreate(Action):
         self.unique = unique
         self.fields_map = fields_map if fields_map is not None else {}
         self.fields = fields
+        self.batch = batch
+        self.bulk = bulk
 
     def do(self, data):
         """Perform actual mapping of data fields into orm model.
@@ -195,24 +750,94 @@ class ModelObjectCreate(Action):
         ------
         filledt `orm_model` instance alredy added to the session
         """
-        fields = self.fields
-        session = getattr(_thread_local_storage, 'session', None)
+        session = self._session()
+        data, fields = self._prepare(data)
+
+        # session could be shared by parallel for_each workers
+        with session.lock:
+            if self.unique is not None:
+                obj, _ = session.get_or_create_cached(self.orm_model, **self._unique_kwargs(data))
+            else:
+                obj = self.orm_model()
+                session.add(obj)
+            obj = self._fill(obj, data, fields)
+            session.track()
+            return obj
+
+    def map(self, items, executor=None):
+        """Batched `for_each` processing: all unique keys of `items` are resolved by one `get_or_create_many` call.
+
+        Batched processing is done in calling thread, `executor` is used by not batched actions only.
+        """
+        if not (self.batch or self.bulk) or self.unique is None:
+            return super(ModelObjectCreate, self).map(items, executor)
+        return [self._continue(obj) for obj in self._fill_batch(items)]
+
+    async def amap(self, items, concurrency=None):
+        if not (self.batch or self.bulk) or self.unique is None:
+            return await super(ModelObjectCreate, self).amap(items, concurrency)
+        return await _gather(self._acontinue, self._fill_batch(items), concurrency)
+
+    def imap(self, items, executor=None):
+        if not (self.batch or self.bulk) or self.unique is None:
+            return super(ModelObjectCreate, self).imap(items, executor)
+        chunk_size = 1000 if isinstance(self.batch, bool) else self.batch
+        return (self._continue(obj) for chunk in _chunks(items, chunk_size) for obj in self._fill_batch(chunk))
+
+    def _fill_batch(self, items):
+        if profile._active is not None:
+            return profile._active.batch(self, self._write_batch, items, 'bulk' if self.bulk else 'batch')
+        return self._write_batch(items)
+
+    def _write_batch(self, items):
+        session = self._session()
+        with session.lock:
+            prepared = [self._prepare(data) for data in items]
+            if self.bulk:
+                rows = [self._row(data, fields) for data, fields in prepared]
+                objects = session.bulk_upsert(self.orm_model, rows, self.unique)
+            else:
+                found = session.get_or_create_many(self.orm_model,
+                                                   [self._unique_kwargs(data) for data, _ in prepared])
+                objects = [self._fill(obj, data, fields) for (data, fields), (obj, _) in zip(prepared, found)]
+            session.track(len(objects))
+            return objects
+
+    def _session(self):
+        session = current_session()
         if session is None:
             raise RuntimeError("expected session object in threading.local(). "
                                "Do you forget to wrap call with ORMSessionBase context?")
+        return session
+
+    def _prepare(self, data):
+        """Return `data` as dict along with fields to be set"""
+        fields = self.fields
         if fields is None:
             fields = list(data.keys())
         if not isinstance(data, dict):
             if len(fields) != 1:
                 raise ValueError('got single value data ({}), but fields has {} elements'.format(data, len(fields)))
             data = {fields[0]: data}
+        return data, fields
 
-        if self.unique is not None:
-            obj, _ = session.get_or_create(self.orm_model,
-                                           **{field: data[self.fields_map.get(field, field)] for field in self.unique})
-        else:
-            obj = self.orm_model()
-            session.add(obj)
+    def _unique_kwargs(self, data):
+        return {field: data[self.fields_map.get(field, field)] for field in self.unique}
+
+    def _row(self, data, fields):
+        """Return dict of `orm_model` fields values"""
+        row = {}
+        for field in fields:
+            data_key = self.fields_map.get(field, field)
+            if data_key not in data:
+                raise KeyError("data doesn't have key '{}' (got: {})".format(data_key, data))
+            row[field] = data[data_key]
+        for field in self.unique:
+            if field not in row:
+                row[field] = data[self.fields_map.get(field, field)]
+        return row
+
+    def _fill(self, obj, data, fields):
         for field in fields:
             if not hasattr(obj, field):
                 raise ValueError("model {} doesn't have attribute {}".format(self.orm_model.__name__, field))
@@ -0,0 +1,104 @@
+from .action import Action, Project
+
+
+def required_fields(action):
+    """
+    Return set of fields of dict data read by chain of actions started from `action`,
+    None if it can't be figured out (for example chain has `Lambda` getting whole data).
+
+    Fields read by action are taken from `custom_fields_functions` by action class name.
+    Actions without function there are treated as reading whole data. Chain returning data itself
+    (e.g. ending with `FieldsTransform`) is unknown as well, since its result could be read by anyone.
+
+    Example
+    -------
+    >>> required_fields(FieldsTransform({'name': str.upper}).then(GetField('name')).root)
+    {'name'}
+    """
+    if action is None:
+        # data is returned
+        return None
+    fields_func = custom_fields_functions.get(type(action).__name__)
+    if fields_func is None:
+        return None
+    return fields_func(action, lambda: required_fields(action.next_action))
+
+
+def prune_fields(action):
+    """
+    Insert `Project` action in front of every `for_each` chain reading known subset of fields,
+    so only those fields of each element travel through the chain as compact dict.
+
+    Workflow is changed in place and returned. Calling it again doesn't insert projections twice.
+
+    Parameters
+    ----------
+    action : Action - root action of the workflow
+
+    Example
+    -------
+    > workflow = prune_fields(GetField('entries').for_each(RenameFields({'a': 'b'})).then(GetField('b')).root)
+    """
+    root = action
+    seen = set()
+    stack = [action]
+    while stack:
+        action = stack.pop()
+        if action is None or id(action) in seen:
+            continue
+        seen.add(id(action))
+        child = action.for_each_action
+        # actions overriding `map` process all elements at once, so they should stay `for_each` actions
+        if child is not None and type(child) is not Project and type(child).map is Action.map:
+            fields = required_fields(child)
+            if fields is not None:
+                project = Project(sorted(fields))
+                project.next_action = child
+                project.root = action.root
+                action.for_each_action = project
+        stack.append(action.next_action)
+        stack.append(child)
+        sub_actions = getattr(action, 'sub_actions', None)
+        if sub_actions is not None:
+            stack.extend(sub_action for _, sub_action in sub_actions())
+    return root
+
+
+# Below are functions returning fields read by particular Actions. They take action and
+# callable returning fields read by the next actions (None if unknown)
+def _fields_pass_through(action, next_fields):
+    if action.for_each_action is not None:
+        # elements of data are iterated
+        return None
+    return next_fields()
+
+
+def _fields_GetField(action, next_fields):
+    return {action.field}
+
+
+def _fields_FieldsTransform(action, next_fields):
+    fields = _fields_pass_through(action, next_fields)
+    if fields is None:
+        return None
+    return fields | set(action.transformations)
+
+
+def _fields_Project(action, next_fields):
+    return set(action.fields)
+
+
+def _fields_ModelObjectCreate(action, next_fields):
+    if action.fields is None:
+        return None
+    return {action.fields_map.get(field, field) for field in list(action.fields) + list(action.unique or [])}
+
+
+# expandable list of functions returning fields read by Action
+custom_fields_functions = {
+    'Root': _fields_pass_through,
+    'GetField': _fields_GetField,
+    'FieldsTransform': _fields_FieldsTransform,
+    'Project': _fields_Project,
+    'ModelObjectCreate': _fields_ModelObjectCreate,
+}
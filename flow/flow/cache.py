@@ -0,0 +1,93 @@
+from collections import OrderedDict
+import threading
+import time
+
+
+class LRUCache:
+    """LRUCache is a bounded mapping with least recently used eviction policy
+
+    It is thread safe and counts hits and misses of `get` calls. Optionally entries expire `ttl` seconds after
+    they are stored.
+
+    Example
+    -------
+    Share cache of `get_or_create` results between ORM sessions:
+    > cache = LRUCache(maxsize=10000)
+    > with ORMSessionSQLAlchemy(session, cache=cache):
+    >     workflow(data)
+    > print(cache.hits, cache.misses)
+    """
+    def __init__(self, maxsize=1024, ttl=None, clock=time.monotonic):
+        """
+        Parameters
+        ----------
+        maxsize : int - max number of stored entries. Least recently used entries are evicted first
+        ttl : float - time to live of entries in seconds, None means entries don't expire
+        clock : callable - returns current time in seconds, used with `ttl`
+        """
+        if maxsize < 1:
+            raise ValueError('maxsize should be > 0 (got: {})'.format(maxsize))
+        if ttl is not None and ttl <= 0:
+            raise ValueError('ttl should be > 0 (got: {})'.format(ttl))
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.RLock()
+
+    def get(self, key, default=None):
+        """Return value stored by `key` or `default` if there is no such key"""
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            if self.ttl is not None:
+                # entries with ttl are stored as (value, expiration time) pairs
+                value, expires = value
+                if expires <= self.clock():
+                    del self._data[key]
+                    self.misses += 1
+                    return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """Store `value` by `key` evicting least recently used entry if cache is full"""
+        with self._lock:
+            self._data[key] = value if self.ttl is None else (value, self.clock() + self.ttl)
+            self._data.move_to_end(key)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        """Remove `key` from cache and return its value or `default` if there is no such key"""
+        with self._lock:
+            if key not in self._data:
+                return default
+            value = self._data.pop(key)
+            return value if self.ttl is None else value[0]
+
+    def clear(self):
+        """Remove all entries. Hits and misses counters are kept"""
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        """Return dict with cache size and hits/misses counters"""
+        with self._lock:
+            return {'size': len(self._data), 'maxsize': self.maxsize, 'hits': self.hits, 'misses': self.misses}
+
+    def __contains__(self, key):
+        with self._lock:
+            if self.ttl is None:
+                return key in self._data
+            entry = self._data.get(key)
+            return entry is not None and entry[1] > self.clock()
+
+    def __len__(self):
+        return len(self._data)
@@ -0,0 +1,336 @@
+import functools
+from operator import itemgetter
+from . import profile
+from .action import Action, FieldsTransform, GetField, Lambda, Root, _flat_map
+
+# marks exhausted for_each elements
+_END = object()
+
+
+class Step:
+    """Step of compiled workflow plan
+
+    Attributes
+    ----------
+    func : callable - does the work of one or several fused actions
+    for_each : list of Step - plan to be run on each element of `func` result, could be None
+    actions : list of Action - actions performed by the step
+    """
+    __slots__ = ('func', 'for_each', 'actions')
+
+    def __init__(self, func, for_each, actions):
+        self.func = func
+        self.for_each = for_each
+        self.actions = actions
+
+    def __repr__(self):
+        names = ' + '.join(type(action).__name__ for action in self.actions)
+        return '<Step({}{})>'.format(names, ', for_each' if self.for_each is not None else '')
+
+
+class CompiledWorkflow:
+    """CompiledWorkflow is a workflow flattened into explicit execution plan
+
+    Plan is a list of `Step`, `for_each` actions become nested plans. The plan is run by iterative interpreter,
+    so there is no Python frame and `__call__` wrapper per action and deep chains don't hit recursion limit.
+    Adjacent `Lambda`, `GetField` and `Root` actions are fused into one step.
+
+    Actions with parallel, streaming or error handling `for_each`, or actions overriding `__call__` or `map`, are run
+    as usual within a step, so compiled workflow returns the same results as the original one. `for_each` chains
+    of actions defining `do_batch` are run stage by stage as well, in the same order as `Action.map` does.
+
+    Example
+    -------
+    > workflow = GetField('entries').for_each(RenameFields({'updated_parsed': 'published_parsed'})).root
+    > compiled = workflow.compile()
+    > compiled(document)
+    """
+    def __init__(self, action):
+        """
+        Parameters
+        ----------
+        action : Action - first action of the workflow, usually `root`
+        """
+        self.action = action
+        self.plan = _compile_chain(action)
+
+    def __call__(self, data):
+        return _execute(self.plan, data)
+
+    def describe(self):
+        """Return plan as list of strings, nested plans are indented"""
+        lines = []
+        stack = [(self.plan, 0)]
+        while stack:
+            plan, indent = stack.pop()
+            for i, step in enumerate(plan):
+                lines.append('  ' * indent + repr(step))
+                if step.for_each is not None:
+                    stack.append((plan[i + 1:], indent))
+                    stack.append((step.for_each, indent + 1))
+                    break
+        return lines
+
+
+def _compile_chain(action):
+    """Compile chain of actions linked by `next_action` into list of steps"""
+    steps = []
+    fused = []
+    while action is not None:
+        for_each = _compile_for_each(action)
+        if _is_fusable(action) and (for_each is not None or action.for_each_action is None):
+            fused.append(action)
+            if for_each is not None:
+                steps.append(_fuse(fused, for_each))
+                fused = []
+        else:
+            if fused:
+                steps.append(_fuse(fused, None))
+                fused = []
+            if type(action).__call__ is not Action.__call__:
+                # action controls its `next` and `for_each` actions itself
+                steps.append(Step(action, None, [action]))
+                return steps
+            steps.append(_compile_action(action, for_each))
+        action = action.next_action
+    if fused:
+        steps.append(_fuse(fused, None))
+    return steps
+
+
+def _compile_action(action, for_each):
+    func = action.do
+    if type(action) is FieldsTransform and action.transformations:
+        func = _compile_fields_transform(action)
+
+    if for_each is None and action.for_each_action is not None:
+        # `for_each` is done by compiled batch chain or by action itself (parallel, streaming or error handling)
+        batch = _compile_batch_for_each(action)
+        func = _compose([func, batch if batch is not None else action._for_each])
+    return Step(func, for_each, [action])
+
+
+def _compile_for_each(action):
+    """Return plan for `for_each` action if it can be run by interpreter, None otherwise"""
+    child = action.for_each_action
+    if child is None or action.for_each_executor is not None or action.for_each_stream or \
+            action.for_each_errors is not None:
+        return None
+    if type(child).map is not Action.map:
+        return None
+    if child._batch_chain():
+        # batch chain is run stage by stage, it's faster than per element interpretation (see `_compile_batch`)
+        return None
+    return _compile_chain(child)
+
+
+def _compile_batch_for_each(action):
+    """Return callable performing `for_each` action on list of elements by compiled batch chain,
+    None if `for_each` should be done by the action itself"""
+    child = action.for_each_action
+    if action.for_each_executor is not None or action.for_each_stream or action.for_each_errors is not None or \
+            type(child).map is not Action.map or not child._batch_chain():
+        return None
+    return _compile_batch(child)
+
+
+def _compile_batch(action):
+    """Compile chain of actions defining `do_batch` into callable processing list of elements stage by stage"""
+    # list of (actions, func), actions of a stage are profiled as one node, nested `for_each` stages aren't
+    stages = []
+    # per element functions of adjacent stages are applied by `map` calls of one stage
+    funcs, fused = [], []
+    while action is not None:
+        if type(action) is Root:
+            pass
+        elif type(action) is GetField:
+            funcs.append(itemgetter(action.field))
+            fused.append(action)
+        elif type(action) is Lambda and not action.vectorized:
+            funcs.append(action.func)
+            fused.append(action)
+        else:
+            if funcs:
+                stages.append((fused, _map_func(funcs)))
+                funcs, fused = [], []
+            if type(action) is FieldsTransform and action.transformations:
+                stages.append(_compile_batch_fields_transform(action))
+            else:
+                stages.append(([action], action.do_batch))
+        if action.for_each_action is not None:
+            # elements of all items are processed at once like `Action._for_each_batch` does
+            if funcs:
+                stages.append((fused, _map_func(funcs)))
+                funcs, fused = [], []
+            batch = _compile_batch_for_each(action)
+            stages.append(([], functools.partial(_flat_map, batch) if batch is not None else action._for_each_batch))
+        action = action.next_action
+    if funcs:
+        stages.append((fused, _map_func(funcs)))
+
+    def run_batch(items):
+        items = list(items)
+        profiler = profile._active
+        for actions, stage in stages:
+            if profiler is not None and actions:
+                items = profiler.batch(actions[0], stage, items, 'batch', actions[1:])
+            else:
+                items = stage(items)
+        return items
+
+    return run_batch
+
+
+def _compile_batch_fields_transform(action):
+    """Return (actions, func) stage of batch chain, plain functions of fields are inlined into the stage"""
+    transformations = list(action.transformations.items())
+    if all(_is_plain_lambda(transformation) for _, transformation in transformations):
+        # columns are transformed in place, there is no columns to gather and scatter
+        funcs = [(key, transformation.func) for key, transformation in transformations]
+
+        def transform_in_place(items):
+            for key, func in funcs:
+                for data in items:
+                    data[key] = func(data[key])
+            return items
+
+        return [action] + [transformation for _, transformation in transformations], transform_in_place
+
+    columns = []
+    for key, transformation in transformations:
+        if type(transformation).map is Action.map and transformation._batch_chain():
+            columns.append((key, _compile_batch(transformation)))
+        else:
+            columns.append((key, transformation.map))
+
+    def transform_columns(items):
+        # every field is transformed as a column like `FieldsTransform.do_batch` does
+        for key, func in columns:
+            for data, value in zip(items, func([data[key] for data in items])):
+                data[key] = value
+        return items
+
+    return [action], transform_columns
+
+
+def _is_plain_lambda(action):
+    return type(action) is Lambda and not action.vectorized and action.next_action is None and \
+        action.for_each_action is None
+
+
+def _map_func(funcs):
+    def map_func(items):
+        # every function is done on all elements before the next one, like `Action.map` batch path does
+        for func in funcs:
+            items = list(map(func, items))
+        return items
+
+    return map_func
+
+
+def _compile_fields_transform(action):
+    transformations = [(key, _plan_func(_compile_chain(transformation)))
+                       for key, transformation in action.transformations.items()]
+
+    def transform(data):
+        for key, transformation in transformations:
+            data[key] = transformation(data[key])
+        return data
+
+    return transform
+
+
+def _plan_func(plan):
+    """Return callable running `plan`"""
+    if len(plan) == 1 and plan[0].for_each is None:
+        return plan[0].func
+    return lambda data: _execute(plan, data)
+
+
+def _is_fusable(action):
+    return type(action) in (Root, GetField, Lambda)
+
+
+def _fuse(actions, for_each):
+    funcs = []
+    for action in actions:
+        if type(action) is GetField:
+            funcs.append(itemgetter(action.field))
+        elif type(action) is Lambda:
+            funcs.append(action.func)
+    return Step(_compose(funcs), for_each, actions)
+
+
+def _identity(data):
+    return data
+
+
+def _compose(funcs):
+    if not funcs:
+        return _identity
+    if len(funcs) == 1:
+        return funcs[0]
+    if len(funcs) == 2:
+        first, second = funcs
+
+        def fused2(data):
+            return second(first(data))
+
+        return fused2
+
+    def fused(data):
+        for func in funcs:
+            data = func(data)
+        return data
+
+    return fused
+
+
+class _Loop:
+    """State of `for_each` loop being executed"""
+    __slots__ = ('items', 'plan', 'results', 'steps', 'pc')
+
+    def __init__(self, items, plan, steps, pc):
+        self.items = items
+        self.plan = plan
+        self.results = []
+        # where to continue when loop is done
+        self.steps = steps
+        self.pc = pc
+
+
+def _execute(plan, data):
+    """Run compiled `plan` on `data` without recursion, steps are profiled by active profiler if any"""
+    profiler = profile._active
+    loops = []
+    steps, pc, value = plan, 0, data
+    while True:
+        if pc < len(steps):
+            step = steps[pc]
+            value = step.func(value) if profiler is None else profiler.step(step, value)
+            pc += 1
+            if step.for_each is None:
+                continue
+            if len(step.for_each) == 1 and step.for_each[0].for_each is None:
+                # flat loop doesn't need interpreter
+                if profiler is None:
+                    func = step.for_each[0].func
+                    value = [func(item) for item in value]
+                else:
+                    value = [profiler.step(step.for_each[0], item) for item in value]
+                continue
+            loops.append(_Loop(iter(value), step.for_each, steps, pc))
+        elif loops:
+            # current element of innermost loop is done
+            loops[-1].results.append(value)
+        else:
+            return value
+
+        # take next element of innermost loop
+        loop = loops[-1]
+        item = next(loop.items, _END)
+        if item is _END:
+            loops.pop()
+            steps, pc, value = loop.steps, loop.pc, loop.results
+        else:
+            steps, pc, value = loop.plan, 0, item
@@ -0,0 +1,222 @@
+from abc import ABC, abstractmethod
+import os
+import pickle
+import threading
+import time
+import traceback
+
+
+class ErrorPolicy:
+    """ErrorPolicy tells how `for_each` handles elements which raise
+
+    Modes:
+        'raise' - the exception is propagated and the whole `for_each` fails (default behavior of `for_each`)
+        'skip' - failed element is recorded to `dead_letters` and dropped from results
+        'retry' - failed element is retried `retries` times with exponential backoff, then it's skipped as above
+
+    With `savepoints` every element is processed within savepoint of current ORM session (see
+    `ORMSessionBase.savepoint`), so DB changes of failed elements are discarded and the good ones are kept.
+
+    Example
+    -------
+    Store books skipping broken ones, they could be stored later:
+    > dead_letters = DeadLetterList()
+    > store = ModelObjectCreate(Book, fields=['name', 'author'], unique=['name'])
+    > workflow = GetField('books').for_each(store, errors=ErrorPolicy('skip', dead_letters=dead_letters)).root
+    > with ORMSessionSQLAlchemy(session):
+    >     workflow(data)
+    >     fixed = dead_letters.replay(store)
+    """
+    modes = ('raise', 'skip', 'retry')
+
+    def __init__(self, mode='skip', retries=None, backoff=0.1, dead_letters=None, savepoints=False, copy=None,
+                 exceptions=(Exception,)):
+        """
+        Parameters
+        ----------
+        mode : str - 'raise', 'skip' or 'retry'
+        retries : int - max number of retries in 'retry' mode, 3 if None
+        backoff : float - delay before the first retry in seconds, it's doubled for every next retry
+        dead_letters : DeadLetterStore - where failed elements are recorded, None means they are dropped silently
+        savepoints : bool - process every element within savepoint of current ORM session. Elements processed
+            by executors aren't run within savepoints
+        copy : callable - makes copy of element which is processed instead of it, so actions changing elements
+            in place don't spoil retries and dead letters. None means elements are processed as is and one by
+            one: batched `for_each` actions are run on all elements at once only if elements are copied
+        exceptions : tuple - exception types which are handled, others are always propagated
+        """
+        if mode not in self.modes:
+            raise ValueError('mode should be one of {} (got: {})'.format(self.modes, mode))
+        if retries is None:
+            retries = 3 if mode == 'retry' else 0
+        if retries < 0:
+            raise ValueError('retries should be >= 0 (got: {})'.format(retries))
+        if retries and mode != 'retry':
+            raise ValueError("retries are supported by 'retry' mode only (got: {})".format(mode))
+        self.mode = mode
+        self.retries = retries
+        self.backoff = backoff
+        self.dead_letters = dead_letters
+        self.savepoints = savepoints
+        self.copy = copy
+        self.exceptions = exceptions
+
+    def __getstate__(self):
+        # failed elements are recorded by calling process, dead letters aren't sent to process workers
+        state = self.__dict__.copy()
+        state['dead_letters'] = None
+        return state
+
+    def delay(self, attempt):
+        """Return seconds to wait before retry `attempt` (1 is the first retry)"""
+        return self.backoff * 2 ** (attempt - 1)
+
+    def record(self, failure):
+        """Record failure of element to dead letters"""
+        if self.dead_letters is not None:
+            self.dead_letters.put(DeadLetter(failure.item, failure.node, failure.error, failure.traceback))
+
+
+class _Failure:
+    """Result of element which failed according to `ErrorPolicy`. It's picklable, so it's returned by process
+    workers as well"""
+    __slots__ = ('item', 'node', 'error', 'traceback')
+
+    def __init__(self, item, node, error, traceback):
+        self.item = item
+        self.node = node
+        self.error = error
+        self.traceback = traceback
+
+    def __getstate__(self):
+        return (self.item, self.node, self.error, self.traceback)
+
+    def __setstate__(self, state):
+        self.item, self.node, self.error, self.traceback = state
+
+
+def _make_error_policy(errors):
+    """Return `ErrorPolicy` by policy or mode name, None means 'raise'"""
+    if errors is None or isinstance(errors, ErrorPolicy):
+        return errors
+    return ErrorPolicy(errors)
+
+
+def _failed_node(exception, default):
+    """Return description of the innermost action in `exception` traceback, `default` action if there is none"""
+    from .action import Action
+    from .profile import node_label
+
+    action = default
+    tb = exception.__traceback__
+    while tb is not None:
+        candidate = tb.tb_frame.f_locals.get('self')
+        if isinstance(candidate, Action):
+            action = candidate
+        tb = tb.tb_next
+    return node_label(action)
+
+
+class DeadLetter:
+    """Element failed by `for_each` with description of the failure
+
+    Attributes
+    ----------
+    item : any - failed element, as it was passed to `for_each` action
+    node : str - description of action which raised (see `profile.node_label`)
+    error : str - exception type and message
+    traceback : str - formatted traceback
+    time : float - unix time of the failure
+    """
+    def __init__(self, item, node, error, traceback, created=None):
+        self.item = item
+        self.node = node
+        self.error = error
+        self.traceback = traceback
+        self.time = time.time() if created is None else created
+
+    def __repr__(self):
+        return '<DeadLetter({}, {})>'.format(self.node, self.error)
+
+
+class DeadLetterStore(ABC):
+    """DeadLetterStore base class keeps elements failed by `for_each` with `ErrorPolicy`, so they could be replayed"""
+
+    @abstractmethod
+    def put(self, letter):
+        """Store `DeadLetter`"""
+
+    @abstractmethod
+    def pop_all(self):
+        """Remove all stored dead letters and return them as list"""
+
+    def replay(self, action, policy=None):
+        """
+        Run `action` on items of all stored dead letters, items failing again are stored back.
+        Returns list of results of succeeded items
+
+        Parameters
+        ----------
+        action : Action - action to be called on each item
+        policy : ErrorPolicy - how failures are handled, 'skip' to this store if None
+        """
+        from .action import _guarded_map
+
+        policy = ErrorPolicy('skip', dead_letters=self) if policy is None else policy
+        return _guarded_map(action, [letter.item for letter in self.pop_all()], policy)
+
+
+class DeadLetterList(DeadLetterStore):
+    """In-memory dead letters store, thread safe"""
+    def __init__(self):
+        self.letters = []
+        self._lock = threading.Lock()
+
+    def put(self, letter):
+        with self._lock:
+            self.letters.append(letter)
+
+    def pop_all(self):
+        with self._lock:
+            letters, self.letters = self.letters, []
+        return letters
+
+    def __len__(self):
+        return len(self.letters)
+
+
+class DeadLetterFile(DeadLetterStore):
+    """Dead letters store appending letters to file by pickle, so items should be picklable"""
+    def __init__(self, path):
+        """
+        Parameters
+        ----------
+        path : str - path of the file, it's created on the first `put`
+        """
+        self.path = path
+        self._lock = threading.Lock()
+
+    def put(self, letter):
+        record = (letter.item, letter.node, letter.error, letter.traceback, letter.time)
+        with self._lock, open(self.path, 'ab') as f:
+            pickle.dump(record, f)
+
+    def pop_all(self):
+        with self._lock:
+            if not os.path.exists(self.path):
+                return []
+            letters = []
+            with open(self.path, 'rb') as f:
+                while True:
+                    try:
+                        letters.append(DeadLetter(*pickle.load(f)))
+                    except EOFError:
+                        break
+            os.remove(self.path)
+        return letters
+
+
+def _format_failure(exception):
+    """Return (error, traceback) strings of `exception`"""
+    error = '{}: {}'.format(type(exception).__name__, exception)
+    return error, ''.join(traceback.format_exception(type(exception), exception, exception.__traceback__))
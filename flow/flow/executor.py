@@ -0,0 +1,172 @@
+from collections import deque
+from concurrent import futures
+import os
+import threading
+from .session import _thread_local_storage, current_session
+
+
+class SerialExecutor:
+    """SerialExecutor calls function on items one by one in current thread. Default `for_each` policy"""
+
+    def map(self, func, items):
+        """
+        Call `func` on each element of `items`
+
+        Parameters
+        ----------
+        func : callable
+        items : iterable
+
+        Returns
+        -------
+        list
+            results in the same order as `items`
+        """
+        return [func(item) for item in items]
+
+    def imap(self, func, items):
+        """
+        Lazy version of `map`. Returns generator of results, `items` are consumed as results are requested
+        """
+        for item in items:
+            yield func(item)
+
+    def shutdown(self):
+        """Release executor resources"""
+
+
+class ThreadExecutor(SerialExecutor):
+    """ThreadExecutor calls function on items in a pool of threads
+
+    ORM session of calling thread is passed to workers, so `ModelObjectCreate` works inside parallel branches.
+    Session calls are serialized by session lock. Useful for I/O bound work (HTTP lookups and so on).
+    """
+    pool_class = futures.ThreadPoolExecutor
+
+    def __init__(self, max_workers=None):
+        """
+        Parameters
+        ----------
+        max_workers : int - max number of workers, if None then default of `concurrent.futures` is used
+        """
+        if max_workers is not None and max_workers < 1:
+            raise ValueError('max_workers should be > 0 (got: {})'.format(max_workers))
+        self.max_workers = max_workers
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    def map(self, func, items):
+        """
+        Call `func` on each element of `items` in parallel
+
+        If some calls fail, pending calls are cancelled, running ones are waited for and
+        the exception of the first failed element (in `items` order) is raised.
+
+        Returns
+        -------
+        list
+            results in the same order as `items`
+        """
+        pool = self._get_pool()
+        submitted = [self._submit(pool, func, item) for item in items]
+        try:
+            return [future.result() for future in submitted]
+        except BaseException:
+            for future in submitted:
+                future.cancel()
+            futures.wait(submitted)
+            raise
+
+    def imap(self, func, items):
+        """
+        Lazy version of `map`. At most 2 * `max_workers` elements are submitted ahead of consumer,
+        so memory doesn't grow with number of `items`
+        """
+        pool = self._get_pool()
+        limit = 2 * (self.max_workers or os.cpu_count() or 1)
+        window = deque()
+        try:
+            for item in items:
+                window.append(self._submit(pool, func, item))
+                if len(window) >= limit:
+                    yield window.popleft().result()
+            while window:
+                yield window.popleft().result()
+        finally:
+            # error or consumer stopped iteration
+            for future in window:
+                future.cancel()
+            futures.wait(window)
+
+    def shutdown(self):
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
+
+    def _submit(self, pool, func, item):
+        return pool.submit(_call_with_session, func, current_session(), item)
+
+    def _get_pool(self):
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = self.pool_class(max_workers=self.max_workers)
+            return self._pool
+
+    def __getstate__(self):
+        # executors could be pickled along with actions sent to process pool
+        return {'max_workers': self.max_workers}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+
+class ProcessExecutor(ThreadExecutor):
+    """ProcessExecutor calls function on items in a pool of processes
+
+    Useful for CPU bound work. Function and items must be picklable, so actions can't contain lambdas.
+    ORM session isn't available in worker processes, therefore `ModelObjectCreate` can't be used there.
+    """
+    pool_class = futures.ProcessPoolExecutor
+
+    def _submit(self, pool, func, item):
+        return pool.submit(func, item)
+
+
+def make_executor(executor=None, max_workers=None):
+    """
+    Create executor by policy name
+
+    Parameters
+    ----------
+    executor : string or executor object - one of 'serial', 'thread', 'process'.
+        None means 'serial'. Objects with `map(func, items)` method are returned as is
+    max_workers : int - max number of workers for 'thread' and 'process' policies
+
+    Returns
+    -------
+    executor object
+    """
+    if executor is None or executor == 'serial':
+        return SerialExecutor()
+    elif executor == 'thread':
+        return ThreadExecutor(max_workers)
+    elif executor == 'process':
+        return ProcessExecutor(max_workers)
+    elif hasattr(executor, 'map'):
+        return executor
+    raise ValueError("unexpected executor (got {}), expected one of 'serial', 'thread', 'process'".format(executor))
+
+
+def _call_with_session(func, session, item):
+    """Call `func` in worker thread with ORM session of the calling thread"""
+    previous = getattr(_thread_local_storage, 'session', None)
+    if session is not None:
+        _thread_local_storage.session = session
+    try:
+        return func(item)
+    finally:
+        if previous is None:
+            _thread_local_storage.__dict__.pop('session', None)
+        else:
+            _thread_local_storage.session = previous
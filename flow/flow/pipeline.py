@@ -0,0 +1,275 @@
+from concurrent import futures
+import queue
+import threading
+import time
+from .executor import _call_with_session
+from .profile import node_label
+from .session import current_session
+
+# marks end of stream in stage queues
+_END = object()
+# returned by waiting on queue when pipeline is stopped
+_STOPPED = object()
+# seconds between checks of pipeline stop while waiting on queue
+_POLL_INTERVAL = 0.05
+
+
+class Stage:
+    """Stage of `Pipeline`: callable (usually workflow root action) run by its own workers
+
+    Stage gets elements from its bounded input queue and puts results to the input queue of the next stage.
+    """
+    executors = ('thread', 'process')
+
+    def __init__(self, action, workers=1, executor='thread', maxsize=None, name=None):
+        """
+        Parameters
+        ----------
+        action : callable - called on each element, usually root action of a workflow
+        workers : int - number of elements processed by the stage in parallel
+        executor : string - 'thread' runs `action` in worker threads with ORM session of the thread running the
+            pipeline, 'process' runs it in a pool of `workers` processes, so `action` and elements must be picklable
+        maxsize : int - capacity of the input queue, default of the pipeline if None
+        name : str - name of the stage in statistics, made of `action` if None
+        """
+        if workers < 1:
+            raise ValueError('workers should be > 0 (got: {})'.format(workers))
+        if executor not in self.executors:
+            raise ValueError('executor should be one of {} (got: {})'.format(self.executors, executor))
+        if maxsize is not None and maxsize < 1:
+            raise ValueError('maxsize should be > 0 (got: {})'.format(maxsize))
+        self.action = action
+        self.workers = workers
+        self.executor = executor
+        self.maxsize = maxsize
+        self.name = name if name is not None else _stage_name(action)
+
+
+class Pipeline:
+    """Pipeline runs stages concurrently, each one in its own workers, connected by bounded queues
+
+    Workflow runs its actions in sequence, so CPU bound transformations of one input and DB writes of another
+    never overlap. Pipeline splits the work into stages: while the last stage stores the first input, the
+    previous ones already process the next inputs. Queues are bounded, so fast stages wait for slow ones
+    (backpressure) and memory held by elements in flight doesn't grow with number of inputs.
+
+    Inputs are read by a separate thread. Results are yielded by `run` in the calling thread, so the final step
+    which must run in the calling thread (DB writes within ORMSessionBase context and so on) could be done by
+    the consumer. The first exception of any stage (or of inputs iteration) stops all stages and is raised by
+    `run`. Stopping consumption of `run` results stops the stages as well.
+
+    Results order is kept when every stage has one worker, otherwise results are yielded as they are ready.
+
+    Example
+    -------
+    Parse next feeds while the current one is stored:
+    > pipeline = Pipeline([Stage(fetch, workers=4), Stage(record_extractor, executor='process', workers=2)])
+    > with ORMSessionSQLAlchemy(session):
+    >     for records in pipeline.run(urls):
+    >         record_loader(records)
+    > print(pipeline.stats())
+    """
+    def __init__(self, stages, maxsize=2):
+        """
+        Parameters
+        ----------
+        stages : list - `Stage` objects or callables, which are run as `Stage(callable)`
+        maxsize : int - default capacity of stage queues and capacity of results queue
+        """
+        if not stages:
+            raise ValueError('pipeline should have at least one stage')
+        if maxsize < 1:
+            raise ValueError('maxsize should be > 0 (got: {})'.format(maxsize))
+        self.stages = [stage if isinstance(stage, Stage) else Stage(stage) for stage in stages]
+        self.maxsize = maxsize
+        self._run = None
+
+    def __call__(self, inputs):
+        """Run pipeline on `inputs` and return list of results"""
+        return list(self.run(inputs))
+
+    def run(self, inputs):
+        """
+        Run pipeline on `inputs`
+
+        Parameters
+        ----------
+        inputs : iterable - elements passed to the first stage, it's consumed by a separate thread
+
+        Returns
+        -------
+        generator
+            results of the last stage
+        """
+        run = self._run = _PipelineRun(self, inputs)
+        try:
+            run.start()
+            yield from run.results()
+        finally:
+            run.stop()
+
+    def stats(self):
+        """Return list of statistics of stages of the current (or the last) run, dict per stage:
+        `name`, `workers`, `items` - processed elements, `queue` - current number of elements in the input queue,
+        `max_queue` - max observed one, `maxsize` - capacity of the input queue, `busy_time` - seconds spent by
+        workers in the stage action, `blocked_time` - seconds spent waiting for room in the next queue"""
+        if self._run is None:
+            return [_StageRun(stage, self.maxsize).stats() for stage in self.stages]
+        return [state.stats() for state in self._run.states]
+
+
+class _StageRun:
+    """State of stage in one pipeline run"""
+    def __init__(self, stage, maxsize):
+        self.stage = stage
+        self.maxsize = stage.maxsize or maxsize
+        self.queue = queue.Queue(self.maxsize)
+        self.items = 0
+        self.max_queue = 0
+        self.busy_time = 0.0
+        self.blocked_time = 0.0
+        # number of workers which haven't got end of stream yet
+        self.live = stage.workers
+        self.pool = None
+
+    def stats(self):
+        return {
+            'name': self.stage.name,
+            'workers': self.stage.workers,
+            'items': self.items,
+            'queue': self.queue.qsize(),
+            'max_queue': self.max_queue,
+            'maxsize': self.maxsize,
+            'busy_time': self.busy_time,
+            'blocked_time': self.blocked_time,
+        }
+
+
+class _PipelineRun:
+    """Threads and queues of one `Pipeline.run`"""
+    def __init__(self, pipeline, inputs):
+        self.inputs = inputs
+        self.states = [_StageRun(stage, pipeline.maxsize) for stage in pipeline.stages]
+        self.output = queue.Queue(pipeline.maxsize)
+        # ORM session of the thread running the pipeline is passed to thread stages
+        self.session = current_session()
+        self.error = None
+        self.threads = []
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+
+    def start(self):
+        for state in self.states:
+            if state.stage.executor == 'process':
+                state.pool = futures.ProcessPoolExecutor(max_workers=state.stage.workers)
+        self._start_thread(self._feed, 'feeder')
+        for i, state in enumerate(self.states):
+            for worker in range(state.stage.workers):
+                self._start_thread(self._work, '{}-{}'.format(state.stage.name, worker), i)
+
+    def results(self):
+        while True:
+            item = self._get(self.output)
+            if self.error is not None:
+                raise self.error
+            if item is _END:
+                return
+            yield item
+
+    def stop(self):
+        self._stopped.set()
+        for thread in self.threads:
+            thread.join()
+        for state in self.states:
+            if state.pool is not None:
+                state.pool.shutdown(cancel_futures=True)
+
+    def _start_thread(self, target, name, *args):
+        thread = threading.Thread(target=target, args=args, name='pipeline-{}'.format(name), daemon=True)
+        self.threads.append(thread)
+        thread.start()
+
+    def _feed(self):
+        first = self.states[0]
+        try:
+            for item in self.inputs:
+                if not self._put(first, item, None):
+                    return
+        except Exception as exception:
+            self._fail(exception)
+            return
+        for _ in range(first.stage.workers):
+            self._put(first, _END, None)
+
+    def _work(self, index):
+        state = self.states[index]
+        following = self.states[index + 1] if index + 1 < len(self.states) else None
+        try:
+            while True:
+                item = self._get(state.queue)
+                if item is _STOPPED:
+                    return
+                if item is _END:
+                    with self._lock:
+                        state.live -= 1
+                        last = state.live == 0
+                    if last:
+                        # the last worker of the stage passes end of stream further
+                        for _ in range(following.stage.workers if following is not None else 1):
+                            self._put(following, _END, state)
+                    return
+                start = time.time()
+                result = self._call(state, item)
+                with self._lock:
+                    state.items += 1
+                    state.busy_time += time.time() - start
+                if not self._put(following, result, state):
+                    return
+        except Exception as exception:
+            self._fail(exception)
+
+    def _call(self, state, item):
+        if state.pool is not None:
+            return state.pool.submit(state.stage.action, item).result()
+        return _call_with_session(state.stage.action, self.session, item)
+
+    def _get(self, q):
+        """Return next element of `q`, `_STOPPED` if pipeline is stopped"""
+        while not self._stopped.is_set():
+            try:
+                return q.get(timeout=_POLL_INTERVAL)
+            except queue.Empty:
+                pass
+        return _STOPPED
+
+    def _put(self, state, item, producer):
+        """Put `item` to input queue of `state` (to results if it's None), waiting for room. Time of waiting is
+        added to `producer` stats. Returns False if pipeline is stopped"""
+        q = state.queue if state is not None else self.output
+        start = time.time()
+        while not self._stopped.is_set():
+            try:
+                q.put(item, timeout=_POLL_INTERVAL)
+            except queue.Full:
+                continue
+            with self._lock:
+                if producer is not None:
+                    producer.blocked_time += time.time() - start
+                if state is not None:
+                    state.max_queue = max(state.max_queue, q.qsize())
+            return True
+        return False
+
+    def _fail(self, exception):
+        with self._lock:
+            if self.error is None:
+                self.error = exception
+        self._stopped.set()
+
+
+def _stage_name(action):
+    from .action import Action
+
+    if isinstance(action, Action):
+        return node_label(action)
+    return getattr(action, '__name__', type(action).__name__)
@@ -1,18 +1,31 @@
-from graphviz import Digraph
+import math
+from .profile import Profiler
 
 
 class ActionsPlotter:
     """ActionsPlotter plots actions chain to image as a graph.
 
-    Used graphviz backend.
+    Used graphviz backend. If statistics of profiled run are given, every node is annotated with
+    its calls, items, time and throughput and filled by heat map color of its self time,
+    `for_each` edges are labeled and scaled by fan-out.
+
+    Example
+    -------
+    > profiler = ActionsPlotter().profile(workflow, samples, 'workflow')
+    > print(profiler.table())
     """
     def __init__(self):
         self.graph = None
         self.sub_graph = None
         self.node_num = 0
         self.cluster_num = 0
+        self.profiler = None
+        self._max_self_time = 0.0
+        self._total_time = 0.0
+        # node id -> action
+        self._node_actions = {}
 
-    def plot(self, action, filename, format='pdf'):
+    def plot(self, action, filename, format='pdf', profiler=None):
         """
         render `action` chain into image file
 
@@ -21,11 +34,94 @@ class ActionsPlotter:
         action : Action - root action of the workflow
         filename : string - file name of the image
         format : string - image format
+        profiler : Profiler - collected statistics of the workflow run to overlay on the graph
         """
+        self.build(action, format, profiler).render(filename)
+
+    def profile(self, action, samples, filename, format='pdf'):
+        """Run `action` on every element of `samples` under `Profiler` and render the graph with its statistics.
+
+        Returns the profiler
+        """
+        profiler = Profiler()
+        with profiler:
+            for data in samples:
+                action(data)
+        self.plot(action, filename, format, profiler)
+        return profiler
+
+    def build(self, action, format='pdf', profiler=None):
+        """Return graphviz `Digraph` of `action` chain without rendering. Arguments are the same as for `plot`"""
+        # graphviz is imported on first use, so workflows modules importing plot don't load it
+        from graphviz import Digraph
+
         self.graph = Digraph(format=format)
         self.sub_graph = self.graph
+        self.node_num = 0
+        self.cluster_num = 0
+        self._node_actions = {}
+        self.profiler = profiler
+        nodes = list(profiler.nodes.values()) if profiler is not None else []
+        self._max_self_time = max([node.self_time for node in nodes] or [0.0])
+        root = profiler.get(action.root) if profiler is not None else None
+        self._total_time = root.total_time if root is not None else sum(node.self_time for node in nodes)
         self._plot_dispatch(action)
-        self.graph.render(filename)
+        return self.graph
+
+    def node(self, action, label, **attrs):
+        """Add node of `action` to the current (sub)graph and return its id.
+
+        Custom plot functions should add nodes by it, so profile statistics are shown on them
+        """
+        current_node = self.node_num
+        self.node_num += 1
+        self._node_actions[current_node] = action
+        stats = self.profiler.get(action) if self.profiler is not None else None
+        if stats is not None:
+            label = '{}\n\n{}'.format(label, self._stats_label(stats))
+            attrs.update(style='filled', fillcolor=self._heat_color(stats.self_time))
+        elif self.profiler is not None:
+            # node isn't called in the profiled run
+            attrs.update(style='dashed')
+        self.sub_graph.node(str(current_node), label, **attrs)
+        return current_node
+
+    def edge(self, prev_node, current_node, edge_label=None):
+        """Add edge from `prev_node` to `current_node` if `prev_node` isn't None. Both are ids returned by `node`"""
+        if prev_node is None:
+            return
+        attrs = {}
+        action = self._node_actions[current_node]
+        stats = self.profiler.get(action) if self.profiler is not None else None
+        if stats is not None:
+            lines = [edge_label] if edge_label else []
+            parent = self._node_actions.get(prev_node)
+            parent_stats = self.profiler.get(parent) if parent is not None else None
+            # for_each edge is scaled by number of elements per call of parent action
+            if parent_stats is not None and parent_stats.calls and parent.for_each_action is action:
+                fan_out = parent_stats.items / parent_stats.calls
+                lines.append('x{:.4g} per call'.format(fan_out))
+                attrs['penwidth'] = '{:.2f}'.format(1 + math.log2(1 + fan_out))
+            lines.append('{} calls'.format(stats.calls))
+            edge_label = '\n'.join(lines)
+        self.sub_graph.edge(str(prev_node), str(current_node), constraint='false', label=edge_label, **attrs)
+
+    def _stats_label(self, stats):
+        lines = ['calls: {}'.format(stats.calls)]
+        if stats.items:
+            lines.append('items: {}'.format(stats.items))
+        share = ' ({:.0%})'.format(stats.total_time / self._total_time) if self._total_time else ''
+        lines.append('total: {:.3f} ms{}'.format(stats.total_time * 1000, share))
+        lines.append('self: {:.3f} ms'.format(stats.self_time * 1000))
+        if stats.total_time > 0:
+            lines.append('{:.4g} {}/s'.format((stats.items or stats.calls) / stats.total_time,
+                                              'items' if stats.items else 'calls'))
+        return '\n'.join(lines)
+
+    def _heat_color(self, self_time):
+        # white for cheap nodes to red for the most expensive one, graphviz "H S V" color
+        heat = self_time / self._max_self_time if self._max_self_time > 0 else 0.0
+        return '0.000 {:.3f} 1.000'.format(heat)
 
     def _plot_dispatch(self, action, prev_node=None, edge_label=None):
         type_name = type(action).__name__
@@ -36,11 +132,8 @@ class ActionsPlotter:
             self._plot_Action(action, prev_node, edge_label)
 
     def _plot_Action(self, action, prev_node, edge_label):
-        current_node = self.node_num
-        self.sub_graph.node(str(current_node), action.__class__.__name__)
-        self.node_num += 1
-        if prev_node is not None:
-            self.sub_graph.edge(str(prev_node), str(current_node), constraint='false', label=edge_label)
+        current_node = self.node(action, action.__class__.__name__)
+        self.edge(prev_node, current_node, edge_label)
         self._plot_next_and_for_each_actions(action, current_node)
 
     def _plot_next_and_for_each_actions(self, action, prev_node):
@@ -52,11 +145,8 @@ class ActionsPlotter:
 
 # Below are custom plot functins for particular Actions
 def _plot_FieldsTransform(self, action, prev_node, edge_label):
-    current_node = self.node_num
-    self.sub_graph.node(str(current_node), action.__class__.__name__)
-    self.node_num += 1
-    if prev_node is not None:
-        self.sub_graph.edge(str(prev_node), str(current_node), constraint='false', label=edge_label)
+    current_node = self.node(action, action.__class__.__name__)
+    self.edge(prev_node, current_node, edge_label)
 
     if action.transformations:
         with self.sub_graph.subgraph(name=str(self.cluster_num)) as c:
@@ -74,11 +164,8 @@ def _plot_FieldsTransform(self, action, prev_node, edge_label):
 
 
 def _plot_GetField(self, action, prev_node, edge_label):
-    current_node = self.node_num
-    self.sub_graph.node(str(current_node), "{}\n'{}'".format(action.__class__.__name__, action.field))
-    self.node_num += 1
-    if prev_node is not None:
-        self.sub_graph.edge(str(prev_node), str(current_node), constraint='false', label=edge_label)
+    current_node = self.node(action, "{}\n'{}'".format(action.__class__.__name__, action.field))
+    self.edge(prev_node, current_node, edge_label)
 
     self._plot_next_and_for_each_actions(action, current_node)
 
@@ -97,17 +184,38 @@ def _plot_ModelObjectCreate(self, action, prev_node, edge_label):
                                   ',\n'.join(fields_desc)
                                   )
 
-    current_node = self.node_num
-    self.sub_graph.node(str(current_node), label)
-    self.node_num += 1
-    if prev_node is not None:
-        self.sub_graph.edge(str(prev_node), str(current_node), constraint='false', label=edge_label)
+    current_node = self.node(action, label)
+    self.edge(prev_node, current_node, edge_label)
+
+    self._plot_next_and_for_each_actions(action, current_node)
+
+
+def _plot_Cache(self, action, prev_node, edge_label):
+    label = '{}\nmaxsize={}'.format(action.__class__.__name__, action.cache.maxsize)
+    if action.cache.ttl is not None:
+        label += ', ttl={}s'.format(action.cache.ttl)
+    if self.profiler is not None:
+        label += '\nhits: {hits}, misses: {misses}'.format(**action.stats())
+
+    current_node = self.node(action, label, shape='box3d', style='filled', fillcolor='lightyellow')
+    self.edge(prev_node, current_node, edge_label)
+
+    with self.sub_graph.subgraph(name=str(self.cluster_num)) as c:
+        self.cluster_num += 1
+        c.attr(label=action.__class__.__name__)
+        c.attr(color='orange', style='dashed')
+        prev_sub_graph = self.sub_graph
+        self.sub_graph = c
+        self._plot_dispatch(action.action, current_node, edge_label='cached')
+        self.sub_graph = prev_sub_graph
 
     self._plot_next_and_for_each_actions(action, current_node)
 
 
-# expandable list of custom plot functions for Action
+# expandable list of custom plot functions for Action.
+# They should add nodes and edges by `ActionsPlotter.node` and `ActionsPlotter.edge` to show profile statistics
 custom_plot_functions = {
+    'Cache': _plot_Cache,
     'FieldsTransform': _plot_FieldsTransform,
     'GetField': _plot_GetField,
     'ModelObjectCreate': _plot_ModelObjectCreate,
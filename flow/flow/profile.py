@@ -0,0 +1,226 @@
+import json
+import random
+import threading
+import time
+
+# profiler used by `Action.__call__`, None means profiling is off
+_active = None
+
+
+class NodeStats:
+    """Collected statistics of one action node
+
+    Attributes
+    ----------
+    action : Action - profiled action
+    calls : int - number of calls
+    items : int - number of elements passed to `for_each` action
+    total_time : float - seconds spent in `do` and `for_each` actions
+    self_time : float - `total_time` without time of nested actions (`for_each` and sub actions)
+    mode : str - how the action is run: 'batch' or 'bulk' if elements are processed at once by batched `map`,
+        'compiled' if it's run by compiled workflow step, None if it's called element by element
+    fused : tuple of Action - actions fused with the action into one compiled step or batch stage, their time is
+        accounted to the action
+    """
+    # max number of latency samples kept for percentiles estimation
+    max_samples = 10000
+
+    def __init__(self, action, mode=None, fused=()):
+        self.action = action
+        self.mode = mode
+        self.fused = tuple(fused)
+        self.calls = 0
+        self.items = 0
+        self.total_time = 0.0
+        self.self_time = 0.0
+        self._samples = []
+
+    def add(self, total_time, self_time, items):
+        self.calls += 1
+        self.items += items
+        self.total_time += total_time
+        self.self_time += self_time
+        # reservoir sampling keeps memory bounded
+        if len(self._samples) < self.max_samples:
+            self._samples.append(total_time)
+        else:
+            index = random.randrange(self.calls)
+            if index < self.max_samples:
+                self._samples[index] = total_time
+
+    def percentile(self, q):
+        """Return `q`-th percentile (0 <= q <= 100) of call latency in seconds"""
+        if not self._samples:
+            return 0.0
+        samples = sorted(self._samples)
+        return samples[min(len(samples) - 1, int(len(samples) * q / 100))]
+
+    def label(self):
+        """Return label of the node: labels of the action and fused actions followed by mode"""
+        label = ' + '.join(node_label(action) for action in (self.action,) + self.fused)
+        return label if self.mode is None else '{} [{}]'.format(label, self.mode)
+
+    def to_dict(self):
+        return {
+            'node': self.label(),
+            'calls': self.calls,
+            'items': self.items,
+            'total_time': self.total_time,
+            'self_time': self.self_time,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+        }
+
+
+class Profiler:
+    """Profiler collects per action timings of workflows run within its context
+
+    Profiling is opt-in: when there is no active profiler `Action.__call__` does only one extra check.
+    Workflows run by `acall` aren't profiled. Workflows are profiled as they are run: elements processed at once
+    by batch chains or batched `ModelObjectCreate` are recorded as one call of every action labeled by mode,
+    steps of compiled workflows are recorded as calls of their first actions labeled 'compiled'.
+
+    Example
+    -------
+    > profiler = Profiler()
+    > with profiler:
+    >     workflow(data)
+    > print(profiler.table())
+    """
+    def __init__(self):
+        self.nodes = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._previous = None
+
+    def __enter__(self):
+        global _active
+        self._previous = _active
+        _active = self
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        global _active
+        _active = self._previous
+        self._previous = None
+
+    def call(self, action, data):
+        """Perform `action.__call__` on `data` collecting its timings"""
+        stack = self._stack()
+        # time spent in nested actions is accumulated in stack frame
+        stack.append(0.0)
+        items = 0
+        start = time.perf_counter()
+        try:
+            ret = action.do(data)
+            if action.for_each_action is not None:
+                ret = action._for_each(ret)
+                items = len(ret) if isinstance(ret, list) else 0
+        finally:
+            total_time = time.perf_counter() - start
+            nested_time = stack.pop()
+            if stack:
+                stack[-1] += total_time
+            self._add(action, total_time, total_time - nested_time, items)
+
+        if action.next_action is not None:
+            return action.next_action(ret)
+        return ret
+
+    def batch(self, action, func, items, mode, fused=()):
+        """Perform `func(items)` processing all `items` at once by batched `map` of `action`, collecting its timings
+        as one call of `action`. Node of the action is labeled by `mode`, e.g. "ModelObjectCreate(Post) [bulk]".
+        `fused` are actions performed by `func` along with `action` in compiled batch stage
+        """
+        stack = self._stack()
+        stack.append(0.0)
+        ret = []
+        start = time.perf_counter()
+        try:
+            ret = func(items)
+        finally:
+            total_time = time.perf_counter() - start
+            nested_time = stack.pop()
+            if stack:
+                stack[-1] += total_time
+            self._add(action, total_time, total_time - nested_time, len(ret) if isinstance(ret, list) else 0, mode,
+                      fused)
+        return ret
+
+    def step(self, step, data):
+        """Perform `step` of compiled workflow on `data` collecting its timings as one call of the first action of
+        the step, e.g. "GetField 'name' + Lambda(upper) [compiled]" for fused step. `for_each` plan of the step
+        isn't accounted, its steps are recorded on their own
+        """
+        stack = self._stack()
+        stack.append(0.0)
+        items = 0
+        start = time.perf_counter()
+        try:
+            ret = step.func(data)
+            if step.actions[-1].for_each_action is not None:
+                items = len(ret) if isinstance(ret, list) else 0
+        finally:
+            total_time = time.perf_counter() - start
+            nested_time = stack.pop()
+            if stack:
+                stack[-1] += total_time
+            self._add(step.actions[0], total_time, total_time - nested_time, items, 'compiled', step.actions[1:])
+        return ret
+
+    def get(self, action):
+        """Return `NodeStats` of `action` or None if it wasn't called"""
+        return self.nodes.get(id(action))
+
+    def stats(self):
+        """Return list of dicts with statistics of every called action, sorted by total time"""
+        with self._lock:
+            nodes = list(self.nodes.values())
+        return [node.to_dict() for node in sorted(nodes, key=lambda node: -node.total_time)]
+
+    def to_json(self, **kwargs):
+        """Dump `stats` as JSON string, `kwargs` are passed to `json.dumps`"""
+        return json.dumps(self.stats(), **kwargs)
+
+    def table(self):
+        """Return `stats` as text table, times are in milliseconds"""
+        header = '{:<40} {:>8} {:>8} {:>11} {:>11} {:>9} {:>9} {:>9}'.format(
+            'node', 'calls', 'items', 'total, ms', 'self, ms', 'p50, ms', 'p90, ms', 'p99, ms')
+        lines = [header, '-' * len(header)]
+        for node in self.stats():
+            lines.append('{:<40} {:>8} {:>8} {:>11.3f} {:>11.3f} {:>9.3f} {:>9.3f} {:>9.3f}'.format(
+                node['node'].replace('\n', ' ')[:40], node['calls'], node['items'],
+                node['total_time'] * 1000, node['self_time'] * 1000,
+                node['p50'] * 1000, node['p90'] * 1000, node['p99'] * 1000))
+        return '\n'.join(lines)
+
+    def _stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _add(self, action, total_time, self_time, items, mode=None, fused=()):
+        with self._lock:
+            node = self.nodes.get(id(action))
+            if node is None:
+                node = self.nodes[id(action)] = NodeStats(action, fused=fused)
+            if mode is not None:
+                node.mode = mode
+            node.add(total_time, self_time, items)
+
+
+def node_label(action):
+    """Return short human readable description of `action`"""
+    name = type(action).__name__
+    field = getattr(action, 'field', None)
+    if field is not None:
+        return "{} '{}'".format(name, field)
+    func = getattr(action, 'func', None)
+    if func is not None:
+        return '{}({})'.format(name, getattr(func, '__name__', type(func).__name__))
+    orm_model = getattr(action, 'orm_model', None)
+    if orm_model is not None:
+        return '{}({})'.format(name, orm_model.__name__)
+    return name
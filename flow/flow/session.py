@@ -1,8 +1,50 @@
 from abc import ABC, abstractmethod
+import contextlib
+import contextvars
 import threading
+import time
 
 # used to hold global session
 _thread_local_storage = threading.local()
+# used to hold session of asyncio tasks, takes precedence over `_thread_local_storage`
+_session_context = contextvars.ContextVar('flow_session', default=None)
+
+
+class _PerInstance:
+    """Attribute default made by `factory` on first access for every instance"""
+    def __init__(self, factory):
+        self.factory = factory
+        self.name = None
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        # setdefault keeps the first value if attribute is accessed from several threads at once
+        return instance.__dict__.setdefault(self.name, self.factory())
+
+
+def _default_counters():
+    return {
+        'added': 0,
+        'inserted': 0,
+        'flushes': 0,
+        'chunks': 0,
+        'rolled_back_chunks': 0,
+        'commits': 0,
+        'commit_time': 0.0,
+        'max_commit_time': 0.0,
+    }
+
+
+def current_session():
+    """Return ORM session of current asyncio task or thread, None if there is no session"""
+    session = _session_context.get()
+    if session is None:
+        session = getattr(_thread_local_storage, 'session', None)
+    return session
 
 
 class ORMSessionBase(ABC):
@@ -11,13 +53,75 @@ class ORMSessionBase(ABC):
     To support different ORM framework one should inherit class from ORMSessionBase and define it's abstract methods.
     See detail in methods docs.
 
+    Optionally `get_or_create` results can be cached in `LRUCache` keyed by model and searched fields values.
+    Cache can be shared between sessions, so hot keys don't hit DB at all. Entries cached since last commit
+    are invalidated on rollback.
+
+    By default all the work is committed once on exit. With `commit_every` or `commit_interval` the work is split
+    into chunks: chunk is finished when `ModelObjectCreate` actions created `commit_every` objects or
+    `commit_interval` seconds passed since chunk start. Finished chunk is committed, or released as savepoint
+    if `savepoints` is True (then everything is committed on exit). On error only the current chunk is discarded,
+    finished chunks are kept. With `expunge` finished chunk objects are removed from the session, so its memory
+    doesn't grow with data size. Counters are returned by `stats`.
+
 
     Exmaple
     -------
     To run `data` processing with `workflow` actions with ORM session do the next:
     > with SomeInheritedORMSession(session):
     >     worflow(data)
+
+    or from coroutine:
+    > async with SomeInheritedORMSession(session):
+    >     await worflow.acall(data)
     """
+    # defaults for subclasses written before cache and commit policies, which don't call `__init__`
+    cache = None
+    commit_every = None
+    commit_interval = None
+    savepoints = False
+    expunge = False
+    counters = _PerInstance(_default_counters)
+    lock = _PerInstance(threading.RLock)
+    _chunk_objects = 0
+    _chunk_start = None
+    _chunk_cache_keys = 0
+    _context_tokens = _PerInstance(list)
+    _uncommitted_cache_keys = _PerInstance(list)
+    _savepoint_depth = 0
+
+    def __init__(self, cache=None, commit_every=None, commit_interval=None, savepoints=False, expunge=False):
+        """
+        Parameters
+        ----------
+        cache : LRUCache - cache of `get_or_create` results, could be None
+        commit_every : int - max number of objects created in one chunk, None means no limit
+        commit_interval : float - max chunk duration in seconds, None means no limit
+        savepoints : bool - every chunk is run within savepoint of one transaction instead of separate transaction
+        expunge : bool - remove objects of finished chunks from the session
+        """
+        if commit_every is not None and commit_every < 1:
+            raise ValueError('commit_every should be > 0 (got: {})'.format(commit_every))
+        if commit_interval is not None and commit_interval <= 0:
+            raise ValueError('commit_interval should be > 0 (got: {})'.format(commit_interval))
+        self.cache = cache
+        self.commit_every = commit_every
+        self.commit_interval = commit_interval
+        self.savepoints = savepoints
+        self.expunge = expunge
+        self.counters = _default_counters()
+        self._chunk_objects = 0
+        self._chunk_start = None
+        # cache keys stored before current chunk start
+        self._chunk_cache_keys = 0
+        # serializes session calls made from parallel for_each workers
+        self.lock = threading.RLock()
+        self._context_tokens = []
+        # cache keys stored since last commit, they are invalidated on rollback
+        self._uncommitted_cache_keys = []
+        # number of running `savepoint` blocks, chunks aren't finished within them
+        self._savepoint_depth = 0
+
     @abstractmethod
     def add(self, obj):
         """
@@ -41,29 +145,287 @@ class ORMSessionBase(ABC):
         kwargs : dict - fields to be searched in DB
         """
 
+    def get_or_create_cached(self, model, defaults=None, **kwargs):
+        """
+        Same as `get_or_create`, but search `cache` first. Returns (instance, created) tuple
+        """
+        if self.cache is None:
+            return self.get_or_create(model, defaults, **kwargs)
+        return self.get_or_create_many(model, [kwargs], defaults)[0]
+
+    def get_or_create_many(self, model, kwargs_list, defaults=None):
+        """
+        Batched version of `get_or_create`. Keys repeated in `kwargs_list` are resolved only once.
+        Keys found in `cache` don't go to DB.
+
+        Parameters
+        ----------
+        model : ORM model class
+        kwargs_list : list of dicts - fields to be searched in DB, one dict per object
+        defaults : dict - fields to be set if new object is created
+
+        Returns
+        -------
+        list of (instance, created) tuples in the same order as `kwargs_list`
+        """
+        resolved = {}
+        missed = []
+        for kwargs in kwargs_list:
+            key = _natural_key(kwargs)
+            if key in resolved:
+                continue
+            instance = self._cache_get(model, key)
+            if instance is not None:
+                resolved[key] = instance, False
+            else:
+                resolved[key] = None
+                missed.append(kwargs)
+
+        for kwargs, (instance, created) in zip(missed, self._get_or_create_many(model, missed, defaults)):
+            key = _natural_key(kwargs)
+            self._cache_put(model, key, instance)
+            resolved[key] = instance, created
+
+        ret = []
+        for kwargs in kwargs_list:
+            key = _natural_key(kwargs)
+            instance, created = resolved[key]
+            ret.append((instance, created))
+            # repeated keys refer to already created object
+            resolved[key] = instance, False
+        return ret
+
+    def _get_or_create_many(self, model, kwargs_list, defaults):
+        """
+        Resolve distinct keys `kwargs_list` missed in cache. Returns list of (instance, created) tuples.
+
+        Default implementation calls `get_or_create` for each key. ORM specific sessions
+        should override it to search all the keys with a single query.
+        """
+        return [self.get_or_create(model, defaults, **kwargs) for kwargs in kwargs_list]
+
+    def bulk_upsert(self, model, rows, unique):
+        """
+        Insert `rows` as `model` objects or update ones already existing with the same `unique` fields.
+        Returns list of instances in the same order as `rows`, rows with repeated keys share the instance.
+
+        Default implementation does it object by object with `get_or_create_many` and `setattr`.
+        ORM specific sessions should override it to write all the rows with bulk statements.
+
+        Parameters
+        ----------
+        model : ORM model class
+        rows : list of dicts - field values of objects, values of relationship fields are ORM objects
+        unique : list - fields identifying object
+        """
+        objects = self.get_or_create_many(model, [{field: row[field] for field in unique} for row in rows])
+        self.counters['inserted'] += len({id(instance) for instance, created in objects if created})
+        ret = []
+        for row, (instance, _) in zip(rows, objects):
+            for field, value in row.items():
+                setattr(instance, field, value)
+            ret.append(instance)
+        return ret
+
+    def _cache_get(self, model, key):
+        if self.cache is None:
+            return None
+        instance = self.cache.get((model, key))
+        if instance is None:
+            return None
+        instance = self._cache_adopt(instance)
+        if instance is None:
+            self.cache.pop((model, key))
+        return instance
+
+    def _cache_put(self, model, key, instance):
+        if self.cache is None:
+            return
+        self.cache.put((model, key), instance)
+        self._uncommitted_cache_keys.append((model, key))
+
+    def _cache_adopt(self, instance):
+        """
+        Make cached `instance` usable in this session. Cache could be shared between sessions,
+        so ORM specific sessions could override it to attach `instance` to the session.
+        Return None if `instance` can't be used, then it's evicted from cache.
+        """
+        return instance
+
+    def track(self, count=1):
+        """
+        Account `count` objects created by actions, current chunk is finished if it reaches commit policy limits.
+        Called by `ModelObjectCreate`
+        """
+        self.counters['added'] += count
+        self._chunk_objects += count
+        if self.commit_every is not None and self._chunk_objects >= self.commit_every:
+            self.checkpoint()
+        elif self.commit_interval is not None and self._chunk_start is not None and \
+                time.perf_counter() - self._chunk_start >= self.commit_interval:
+            self.checkpoint()
+
+    def checkpoint(self):
+        """Finish current chunk: commit it or release its savepoint, then start new chunk.
+        It's deferred while `savepoint` block is run"""
+        if self._savepoint_depth:
+            return
+        with self.lock:
+            if self.savepoints:
+                self.release_savepoint()
+            if self.expunge:
+                # expunged objects keep their state, so they could still be read by the next actions
+                self.flush()
+                self.expunge_all()
+            if self.savepoints:
+                self.begin_savepoint()
+            else:
+                self._timed_commit()
+            self.counters['chunks'] += 1
+            self._start_chunk()
+
+    def stats(self):
+        """Return dict of counters: objects `added`, new rows `inserted` by `bulk_upsert`, `flushes`, finished
+        `chunks` and `rolled_back_chunks`, `commits` and their total and max latency in seconds"""
+        return dict(self.counters)
+
+    def flush(self):
+        """Send pending changes to the DB without commit. ORM specific sessions could override it"""
+
+    def expunge_all(self):
+        """Remove all objects from the session. ORM specific sessions could override it"""
+
+    @contextlib.contextmanager
+    def savepoint(self):
+        """Run block within savepoint: if it raises, its changes are discarded and the exception is propagated.
+        Used by `for_each` error policies to isolate elements"""
+        cache_keys = len(self._uncommitted_cache_keys)
+        self.begin_savepoint()
+        self._savepoint_depth += 1
+        try:
+            yield
+        except BaseException:
+            self._savepoint_depth -= 1
+            self.rollback_savepoint()
+            if self.cache is not None:
+                for key in self._uncommitted_cache_keys[cache_keys:]:
+                    self.cache.pop(key)
+            del self._uncommitted_cache_keys[cache_keys:]
+            raise
+        self._savepoint_depth -= 1
+        self.release_savepoint()
+
+    def begin_savepoint(self):
+        """Start nested transaction, used if `savepoints` is True"""
+        raise NotImplementedError('{} does not support savepoints'.format(type(self).__name__))
+
+    def release_savepoint(self):
+        """Keep changes made since last `begin_savepoint`"""
+        raise NotImplementedError('{} does not support savepoints'.format(type(self).__name__))
+
+    def rollback_savepoint(self):
+        """Discard changes made since last `begin_savepoint`"""
+        raise NotImplementedError('{} does not support savepoints'.format(type(self).__name__))
+
     @abstractmethod
     def commit(self):
         """Commit changes to the DB"""
 
+    def rollback(self):
+        """Discard changes made since last commit. Cache entries stored since last commit are invalidated.
+
+        ORM specific sessions should override it and call base implementation
+        """
+        if self.cache is not None:
+            for key in self._uncommitted_cache_keys:
+                self.cache.pop(key)
+        self._uncommitted_cache_keys = []
+
+    def _start_chunk(self):
+        self._chunk_objects = 0
+        self._chunk_start = time.perf_counter()
+        if self.savepoints:
+            self._chunk_cache_keys = len(self._uncommitted_cache_keys)
+        else:
+            self._uncommitted_cache_keys = []
+            self._chunk_cache_keys = 0
+
+    def _timed_commit(self):
+        start = time.perf_counter()
+        self.commit()
+        elapsed = time.perf_counter() - start
+        self.counters['commits'] += 1
+        self.counters['commit_time'] += elapsed
+        self.counters['max_commit_time'] = max(self.counters['max_commit_time'], elapsed)
+
+    def _chunked(self):
+        return self.commit_every is not None or self.commit_interval is not None
+
     def __enter__(self):
         _thread_local_storage.session = self
+        self._context_tokens.append(_session_context.set(self))
+        if self.savepoints:
+            self.begin_savepoint()
+        self._start_chunk()
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         _thread_local_storage.__dict__.pop('session', None)
+        try:
+            _session_context.reset(self._context_tokens.pop())
+        except ValueError:
+            # session was entered concurrently from another asyncio task
+            _session_context.set(None)
         if exc_val:
+            if self._chunked():
+                self.counters['rolled_back_chunks'] += 1
+            if self.savepoints:
+                # only the current chunk is discarded, finished chunks are committed
+                self.rollback_savepoint()
+                if self.cache is not None:
+                    for key in self._uncommitted_cache_keys[self._chunk_cache_keys:]:
+                        self.cache.pop(key)
+                del self._uncommitted_cache_keys[self._chunk_cache_keys:]
+                try:
+                    self._timed_commit()
+                except Exception:
+                    self.rollback()
+                    raise
+                self._uncommitted_cache_keys = []
+            else:
+                self.rollback()
             raise
-        self.commit()
+        if self.savepoints:
+            self.release_savepoint()
+        self._timed_commit()
+        if self._chunk_objects:
+            self.counters['chunks'] += 1
+        self._uncommitted_cache_keys = []
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        return self.__exit__(exc_type, exc_val, exc_tb)
 
 
 class ORMSessionSQLAlchemy(ORMSessionBase):
     """ORMSession realisation for SQLAlchemy"""
-    def __init__(self, session):
+    def __init__(self, session, chunk_size=500, cache=None, **kwargs):
         """
         Parameters
         ----------
         session : SQLAlchemy's session object
+        chunk_size : int - max number of keys searched by one query in `get_or_create_many`.
+            Keeps `IN (...)` lists below DB bound parameters limit
+        cache : LRUCache - cache of `get_or_create` results, could be None
+        kwargs : commit policy arguments of `ORMSessionBase`
         """
+        super(ORMSessionSQLAlchemy, self).__init__(cache=cache, **kwargs)
         self.session = session
+        self.chunk_size = chunk_size
+        self._savepoints = []
+        # (cache key, instance) pairs cached since last commit, they are replaced by `_CachedState` on commit
+        self._cached_instances = []
 
     def add(self, obj):
         self.session.add(obj)
@@ -79,5 +441,338 @@ class ORMSessionSQLAlchemy(ORMSessionBase):
             self.add(instance)
             return instance, True
 
+    def _get_or_create_many(self, model, kwargs_list, defaults):
+        found = self._find_many(model, [_natural_key(kwargs) for kwargs in kwargs_list])
+        ret = []
+        for kwargs in kwargs_list:
+            instance = found.get(_natural_key(kwargs))
+            if instance is not None:
+                ret.append((instance, False))
+            else:
+                params = kwargs.copy()
+                params.update(defaults or {})
+                instance = model(**params)
+                self.add(instance)
+                ret.append((instance, True))
+        return ret
+
+    def _find_many(self, model, keys, refresh=False):
+        """
+        Return dict natural key -> instance of `model` found in DB by `keys`.
+        If `refresh` is True then instances already loaded in the session are refreshed from DB
+        """
+        # flow doesn't depend on SQLAlchemy, so import it only when SQLAlchemy session is actually used
+        from sqlalchemy import and_, or_
+
+        # group keys by searched fields so every group is resolved by one query per chunk
+        groups = {}
+        for key in keys:
+            groups.setdefault(tuple(name for name, _ in key), []).append(key)
+
+        found = {}
+        for names, keys in groups.items():
+            for start in range(0, len(keys), self.chunk_size):
+                chunk = keys[start:start + self.chunk_size]
+                if len(names) == 1:
+                    condition = getattr(model, names[0]).in_([key[0][1] for key in chunk])
+                else:
+                    condition = or_(*[and_(*[getattr(model, name) == value for name, value in key])
+                                      for key in chunk])
+                query = self.session.query(model).filter(condition)
+                if refresh:
+                    query = query.populate_existing()
+                for instance in query:
+                    found.setdefault(tuple((name, getattr(instance, name)) for name in names), instance)
+        return found
+
+    def bulk_upsert(self, model, rows, unique):
+        """
+        Write `rows` by Core statements instead of ORM unit of work.
+
+        On SQLite and PostgreSQL rows are written by one `INSERT ... ON CONFLICT (unique) DO NOTHING RETURNING`
+        statement, so `unique` fields should have unique index in DB. Returned keys are keys of inserted rows,
+        the rest rows are updated by `executemany` of UPDATE. On other DBs (and with SQLAlchemy < 2.0, which
+        can't return rows of `executemany`) existing keys are selected first, then rows are written by
+        `executemany` of UPDATE and INSERT. Number of inserted rows is added to `inserted` counter.
+
+        Many-to-one relationship values are written as foreign keys, many-to-many ones replace rows of
+        association table. Pending related objects are flushed to get their ids. Instances are loaded back
+        from DB, so relationships of returned objects are usable as usual. Written objects aren't put
+        to the identity cache.
+        """
+        from sqlalchemy import inspect
+        from sqlalchemy.orm.interfaces import MANYTOMANY, MANYTOONE
+
+        mapper = inspect(model)
+        # the last row wins like in object by object processing
+        rows_by_key = {}
+        for row in rows:
+            rows_by_key[_natural_key({field: row[field] for field in unique})] = row
+        if not rows_by_key:
+            return []
+
+        # related objects should have ids
+        self.session.flush()
+        values = []
+        associations = []
+        for key, row in rows_by_key.items():
+            record = {}
+            for field, value in row.items():
+                relationship = mapper.relationships.get(field)
+                if relationship is None:
+                    if field not in mapper.column_attrs:
+                        raise ValueError("model {} doesn't have attribute {}".format(model.__name__, field))
+                    record[mapper.column_attrs[field].columns[0].key] = value
+                elif relationship.direction is MANYTOONE:
+                    for local, remote in relationship.local_remote_pairs:
+                        record[local.key] = _column_value(relationship.mapper, value, remote)
+                elif relationship.direction is MANYTOMANY:
+                    associations.append((key, relationship, value or []))
+                else:
+                    raise ValueError("bulk upsert doesn't support one-to-many relationship '{}' of {}".format(
+                        field, model.__name__))
+            values.append(record)
+
+        table = mapper.local_table
+        key_columns = [mapper.column_attrs[field].columns[0].key for field in unique]
+        self.counters['inserted'] += self._upsert(table, key_columns, values)
+
+        found = self._find_many(model, list(rows_by_key), refresh=True)
+        if associations:
+            self._replace_associations(found, associations)
+            # collections are changed behind ORM back
+            keys = list({relationship.key for _, relationship, _ in associations})
+            for instance in found.values():
+                self.session.expire(instance, keys)
+
+        if self.cache is not None:
+            # bulk rows aren't looked up by key usually, caching them would evict hot objects. Cached states
+            # of the keys are stale now
+            for key in rows_by_key:
+                self.cache.pop((model, key))
+        return [found[_natural_key({field: row[field] for field in unique})] for row in rows]
+
+    def _upsert(self, table, key_columns, values):
+        """Write `values` rows, return number of inserted ones"""
+        update_columns = [column for column in values[0] if column not in key_columns]
+        insert = self._dialect_insert()
+        if insert is None or not getattr(self.session.get_bind().dialect, 'insert_executemany_returning', False):
+            return self._upsert_executemany(table, key_columns, update_columns, values)
+
+        # keys of inserted rows are returned, the rest rows exist already
+        statement = insert(table).on_conflict_do_nothing(index_elements=key_columns)\
+            .returning(*[table.c[column] for column in key_columns])
+        inserted = {tuple(sorted(zip(key_columns, row))) for row in self.session.execute(statement, values)}
+        if update_columns:
+            self._update_executemany(table, key_columns, update_columns,
+                                     [record for record in values if _record_key(record, key_columns) not in inserted])
+        return len(inserted)
+
+    def _dialect_insert(self):
+        """Return `insert` construct supporting ON CONFLICT for session DB, None if there is no one"""
+        dialect = self.session.get_bind().dialect.name
+        try:
+            if dialect == 'postgresql':
+                from sqlalchemy.dialects.postgresql import insert
+                return insert
+            if dialect == 'sqlite':
+                from sqlalchemy.dialects.sqlite import insert
+                return insert
+        except ImportError:
+            # SQLAlchemy is too old to support ON CONFLICT for the dialect
+            pass
+        return None
+
+    def _upsert_executemany(self, table, key_columns, update_columns, values):
+        keys = [_record_key(record, key_columns) for record in values]
+        existing = set()
+        for start in range(0, len(keys), self.chunk_size):
+            existing.update(self._select_keys(table, key_columns, keys[start:start + self.chunk_size]))
+        updated = [record for key, record in zip(keys, values) if key in existing]
+        inserted = [record for key, record in zip(keys, values) if key not in existing]
+        if update_columns:
+            self._update_executemany(table, key_columns, update_columns, updated)
+        if inserted:
+            self.session.execute(table.insert(), inserted)
+        return len(inserted)
+
+    def _update_executemany(self, table, key_columns, update_columns, values):
+        from sqlalchemy import and_, bindparam
+
+        if not values:
+            return
+        # bind parameters can't be named as updated columns
+        statement = table.update()\
+            .where(and_(*[table.c[column] == bindparam('key_' + column) for column in key_columns]))\
+            .values({column: bindparam('value_' + column) for column in update_columns})
+        self.session.execute(statement, [{('key_' if column in key_columns else 'value_') + column: value
+                                          for column, value in record.items()} for record in values])
+
+    def _select_keys(self, table, key_columns, keys):
+        from sqlalchemy import and_, or_
+
+        columns = sorted(key_columns)
+        condition = or_(*[and_(*[table.c[column] == value for column, value in key]) for key in keys])
+        for row in self.session.query(*[table.c[column] for column in columns]).filter(condition):
+            yield tuple(zip(columns, row))
+
+    def _replace_associations(self, found, associations):
+        """Replace rows of many-to-many association tables by `associations` list of (key, relationship, objects)"""
+        from sqlalchemy import tuple_
+
+        by_relationship = {}
+        for key, relationship, objects in associations:
+            by_relationship.setdefault(relationship, []).append((found[key], objects))
+        for relationship, pairs in by_relationship.items():
+            secondary = relationship.secondary
+            parent_pairs = [(local, secondary.c[remote.key]) for local, remote in relationship.synchronize_pairs]
+            child_pairs = [(remote, secondary.c[local.key])
+                           for remote, local in relationship.secondary_synchronize_pairs]
+            parents = [{column.key: _column_value(relationship.parent, parent, source)
+                        for source, column in parent_pairs} for parent, _ in pairs]
+            for start in range(0, len(parents), self.chunk_size):
+                chunk = parents[start:start + self.chunk_size]
+                if len(parent_pairs) == 1:
+                    column = parent_pairs[0][1]
+                    condition = column.in_([parent[column.key] for parent in chunk])
+                else:
+                    condition = tuple_(*[column for _, column in parent_pairs]).in_(
+                        [tuple(parent[column.key] for _, column in parent_pairs) for parent in chunk])
+                self.session.execute(secondary.delete().where(condition))
+
+            rows = []
+            for parent, (_, objects) in zip(parents, pairs):
+                seen = set()
+                for obj in objects:
+                    row = dict(parent)
+                    row.update({column.key: _column_value(relationship.mapper, obj, source)
+                                for source, column in child_pairs})
+                    key = tuple(sorted(row.items()))
+                    if key not in seen:
+                        seen.add(key)
+                        rows.append(row)
+            if rows:
+                self.session.execute(secondary.insert(), rows)
+
+    def _cache_put(self, model, key, instance):
+        super(ORMSessionSQLAlchemy, self)._cache_put(model, key, instance)
+        if self.cache is not None:
+            self._cached_instances.append(((model, key), instance))
+
+    def _cache_adopt(self, instance):
+        from sqlalchemy.exc import InvalidRequestError
+        from sqlalchemy.orm import object_session
+
+        if isinstance(instance, _CachedState):
+            return instance.adopt(self.session)
+        if object_session(instance) is self.session:
+            return instance
+        # instance is cached by another session, copy its state without hitting DB
+        try:
+            return self.session.merge(instance, load=False)
+        except InvalidRequestError:
+            return None
+
+    def flush(self):
+        self.session.flush()
+
+    def expunge_all(self):
+        self.session.expunge_all()
+
+    def begin_savepoint(self):
+        self._savepoints.append(self.session.begin_nested())
+
+    def release_savepoint(self):
+        self._savepoints.pop().commit()
+
+    def rollback_savepoint(self):
+        self._savepoints.pop().rollback()
+
     def commit(self):
+        if self._cached_instances:
+            # committed instances are expired, so their state is cached to be used without refresh from DB
+            self.session.flush()
+            for key, instance in self._cached_instances:
+                state = _CachedState.of(instance)
+                if state is not None and key in self.cache:
+                    self.cache.put(key, state)
+            self._cached_instances = []
         self.session.commit()
+
+    def rollback(self):
+        self._savepoints = []
+        self._cached_instances = []
+        self.session.rollback()
+        super(ORMSessionSQLAlchemy, self).rollback()
+
+    def __enter__(self):
+        from sqlalchemy import event
+
+        event.listen(self.session, 'after_flush', self._count_flush)
+        return super(ORMSessionSQLAlchemy, self).__enter__()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        from sqlalchemy import event
+
+        event.remove(self.session, 'after_flush', self._count_flush)
+        return super(ORMSessionSQLAlchemy, self).__exit__(exc_type, exc_val, exc_tb)
+
+    def _count_flush(self, session, flush_context):
+        self.counters['flushes'] += 1
+
+
+class _CachedState:
+    """Primary key and column values of committed SQLAlchemy instance kept in cache instead of the instance.
+    Instance is rebuilt from them in any session without DB queries"""
+    __slots__ = ('identity_key', 'values')
+
+    def __init__(self, identity_key, values):
+        self.identity_key = identity_key
+        self.values = values
+
+    @classmethod
+    def of(cls, instance):
+        """Return state of persistent `instance`, None if it isn't stored in DB"""
+        from sqlalchemy import inspect
+
+        state = inspect(instance)
+        if state.key is None or state.was_deleted:
+            return None
+        values = {attr.key: state.dict[attr.key] for attr in state.mapper.column_attrs if attr.key in state.dict}
+        return cls(state.key, values)
+
+    def adopt(self, session):
+        """Return instance in `session`: the one of the session identity map or new persistent one"""
+        from sqlalchemy import inspect
+        from sqlalchemy.orm import make_transient_to_detached
+        from sqlalchemy.orm.attributes import set_committed_value
+
+        instance = session.identity_map.get(self.identity_key)
+        if instance is not None:
+            # expired attributes are loaded from cache instead of refresh from DB
+            for key in inspect(instance).expired_attributes & set(self.values):
+                set_committed_value(instance, key, self.values[key])
+            return instance
+        instance = inspect(self.identity_key[0]).class_manager.new_instance()
+        for key, value in self.values.items():
+            set_committed_value(instance, key, value)
+        make_transient_to_detached(instance)
+        session.add(instance)
+        return instance
+
+
+def _natural_key(kwargs):
+    """Hashable key of `get_or_create` search fields"""
+    return tuple(sorted(kwargs.items()))
+
+
+def _record_key(record, key_columns):
+    """Hashable key of table row `record` made of `key_columns` values"""
+    return tuple(sorted((column, record[column]) for column in key_columns))
+
+
+def _column_value(mapper, obj, column):
+    """Return value of mapped `column` of `obj`, None if there is no object"""
+    if obj is None:
+        return None
+    return getattr(obj, mapper.get_property_by_column(column).key)
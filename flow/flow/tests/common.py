@@ -6,7 +6,8 @@ class ORMSessionMockup(ORMSessionBase):
     """
     Fake session which holds all results in attributes `added` and `commited`
     """
-    def __init__(self):
+    def __init__(self, cache=None, **kwargs):
+        super(ORMSessionMockup, self).__init__(cache=cache, **kwargs)
         self.added = []
         self.commited = []
 
@@ -33,6 +34,10 @@ class ORMSessionMockup(ORMSessionBase):
         self.commited.extend(self.added)
         self.added = []
 
+    def rollback(self):
+        self.added = []
+        super(ORMSessionMockup, self).rollback()
+
 
 class Book:
     """
@@ -1,5 +1,5 @@
 import unittest
-from flow import Action, GetField, FieldsTransform, Lambda, ModelObjectCreate
+from flow import Action, Cache, GetField, FieldsTransform, Lambda, ModelObjectCreate, Root
 from .common import *
 
 
@@ -59,6 +59,45 @@ class LambdaTest(TestCaseWithData):
         self.assertEqual('my_answer', Lambda(do_strange)('10'))
 
 
+class CacheTest(unittest.TestCase):
+    def test_memoize(self):
+        calls = []
+
+        def normalize(name):
+            calls.append(name)
+            return name.strip().lower()
+
+        a = Cache(normalize, maxsize=2)
+        self.assertEqual(['bob', 'bob', 'alice', 'bob'], [a(name) for name in [' Bob', ' Bob', 'Alice', ' Bob']])
+        self.assertEqual([' Bob', 'Alice'], calls)
+        self.assertEqual({'size': 2, 'maxsize': 2, 'hits': 2, 'misses': 2}, a.stats())
+
+    def test_key_and_ttl(self):
+        now = [0]
+        a = Cache(Lambda(len).then(Lambda(lambda x: [x])).root, key=tuple, ttl=10)
+        a.cache.clock = lambda: now[0]
+        first = a(['x', 'y'])
+        self.assertEqual([2], first)
+        self.assertIs(first, a(['x', 'y']))
+        now[0] = 10
+        # result is expired and computed again
+        second = a(['x', 'y'])
+        self.assertIsNot(first, second)
+        self.assertEqual(first, second)
+        self.assertEqual(1, a.stats()['hits'])
+        self.assertEqual(2, a.stats()['misses'])
+
+    def test_for_each(self):
+        calls = []
+        a = Root().for_each(Cache(lambda x: calls.append(x) or x * 2)).root
+        self.assertEqual([2, 4, 2, 4], a([1, 2, 1, 2]))
+        # batch of elements computes every missed key once
+        self.assertEqual([1, 2], calls)
+        threaded = Root().for_each(a.for_each_action, executor='thread', max_workers=4).root
+        self.assertEqual([2, 4] * 50, threaded([1, 2] * 50))
+        self.assertEqual([1, 2], calls)
+
+
 class ModelObjectCreateTest(TestCaseWithData):
     def test_without_session(self):
         a = ModelObjectCreate(Book)
@@ -0,0 +1,59 @@
+import unittest
+from flow import (FieldsTransform, GetField, Lambda, ModelObjectCreate, Project, Root,
+                  custom_fields_functions, prune_fields, required_fields)
+from .common import *
+from flow import Action
+
+
+class RequiredFieldsTest(unittest.TestCase):
+    def test_known_actions(self):
+        self.assertEqual({'name'}, required_fields(GetField('name')))
+        a = FieldsTransform({'name': str.upper}).then(GetField('author')).root
+        self.assertEqual({'name', 'author'}, required_fields(a))
+        a = ModelObjectCreate(Book, fields=['author'], fields_map={'author': 'writer'}, unique=['name'])
+        self.assertEqual({'writer', 'name'}, required_fields(a))
+
+    def test_unknown(self):
+        # whole data is passed to lambda
+        self.assertIsNone(required_fields(FieldsTransform({'name': str.upper}).then(Lambda(str)).root))
+        # transformed data is returned, so anything could be read later
+        self.assertIsNone(required_fields(FieldsTransform({'name': str.upper})))
+        self.assertIsNone(required_fields(ModelObjectCreate(Book)))
+
+
+class PruneFieldsTest(TestCaseWithData):
+    def test_prune(self):
+        books = [dict(book, year=1900, text='...') for book in self.books]
+        a = Root().for_each(FieldsTransform({'name': str.upper}).then(Project(['name', 'author'])).root).root
+        self.assertIs(a, prune_fields(a))
+        self.assertEqual(Project, type(a.for_each_action))
+        self.assertEqual(['author', 'name'], a.for_each_action.fields)
+        self.assertEqual([{'name': book['name'].upper(), 'author': book['author']} for book in self.books], a(books))
+        # input elements aren't changed since chain gets their projections
+        self.assertEqual('...', books[0]['text'])
+        self.assertEqual(self.books[0]['name'], books[0]['name'])
+        # pruning twice doesn't add projections
+        prune_fields(a)
+        self.assertEqual(FieldsTransform, type(a.for_each_action.next_action))
+
+    def test_not_pruned(self):
+        batched = Root().for_each(ModelObjectCreate(Book, fields=['name'], unique=['name'], batch=True)).root
+        passed = Root().for_each(FieldsTransform({'name': str.upper})).root
+        for a in [batched, passed]:
+            child = a.for_each_action
+            prune_fields(a)
+            self.assertIs(child, a.for_each_action)
+
+    def test_custom_action(self):
+
+        class Upper(Action):
+            def do(self, data):
+                return data['name'].upper()
+
+        custom_fields_functions['Upper'] = lambda action, next_fields: {'name'}
+        try:
+            a = prune_fields(GetField('books').for_each(Upper()).root)
+            self.assertEqual(['name'], a.for_each_action.fields)
+            self.assertEqual([book['name'].upper() for book in self.books], a({'books': self.books}))
+        finally:
+            del custom_fields_functions['Upper']
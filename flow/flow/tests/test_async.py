@@ -0,0 +1,70 @@
+import asyncio
+from flow import AsyncAction, FieldsTransform, GetField, Lambda, ModelObjectCreate, Root
+from .common import *
+
+
+class Sleep(AsyncAction):
+    """Returns its argument after asynchronous sleep, tracks number of concurrently running calls"""
+    def __init__(self):
+        super(Sleep, self).__init__()
+        self.running = 0
+        self.max_running = 0
+
+    async def ado(self, data):
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        await asyncio.sleep(0.001)
+        self.running -= 1
+        return data
+
+
+class AsyncActionTest(TestCaseWithData):
+    def test_mixed_chain(self):
+        sleep = Sleep()
+        a = Root().for_each(FieldsTransform({'name': str.upper})).then(sleep).then(GetField('name')).root
+        names = asyncio.run(a.acall([book.copy() for book in self.books]))
+        self.assertEqual([book['name'].upper() for book in self.books], names)
+        # sync call runs async actions in its own event loop
+        self.assertEqual(names, a([book.copy() for book in self.books]))
+
+    def test_concurrency(self):
+        sleep = Sleep()
+        a = Root().for_each(sleep, concurrency=3).root
+        self.assertEqual(list(range(20)), asyncio.run(a.acall(list(range(20)))))
+        self.assertEqual(3, sleep.max_running)
+
+    def test_coroutine_lambda(self):
+
+        async def double(x):
+            await asyncio.sleep(0)
+            return x * 2
+
+        a = Root().for_each(Lambda(double)).root
+        self.assertEqual([0, 2, 4], asyncio.run(a.acall([0, 1, 2])))
+
+    def test_first_error_is_raised(self):
+
+        async def check(x):
+            await asyncio.sleep(0.001 * (10 - x))
+            if x in (3, 7):
+                raise ValueError('bad item {}'.format(x))
+            return x
+
+        a = Root().for_each(Lambda(check)).root
+        self.assertRaisesRegex(ValueError, r'bad item 3$', asyncio.run, a.acall(list(range(10))))
+
+    def test_sessions_per_task(self):
+        a = Root().for_each(Sleep().then(ModelObjectCreate(Book, unique=['name', 'author']))).root
+
+        async def ingest(session, books):
+            async with session:
+                await a.acall(books)
+
+        async def main(sessions):
+            await asyncio.gather(*[ingest(session, self.books) for session in sessions])
+
+        sessions = [ORMSessionMockup() for _ in range(5)]
+        asyncio.run(main(sessions))
+        # each task uses own session
+        for session in sessions:
+            self.assertEqual(self.books, session.commited)
@@ -0,0 +1,177 @@
+import asyncio
+import os
+import pickle
+import tempfile
+from flow import (Action, DeadLetterFile, DeadLetterList, ErrorPolicy, FieldsTransform, GetField, Lambda,
+                  ModelObjectCreate, ProcessExecutor, Root)
+from .common import *
+
+
+class SavepointSessionMockup(ORMSessionMockup):
+    """Mockup session discarding objects added within rolled back savepoint"""
+    def __init__(self, **kwargs):
+        super(SavepointSessionMockup, self).__init__(**kwargs)
+        self.savepoints_stack = []
+
+    def begin_savepoint(self):
+        self.savepoints_stack.append(len(self.added))
+
+    def release_savepoint(self):
+        self.savepoints_stack.pop()
+
+    def rollback_savepoint(self):
+        del self.added[self.savepoints_stack.pop():]
+
+
+class Flaky(Action):
+    """Raises on first `failures` calls for every element"""
+    def __init__(self, failures):
+        super(Flaky, self).__init__()
+        self.failures = failures
+        self.calls = {}
+
+    def do(self, data):
+        calls = self.calls[data] = self.calls.get(data, 0) + 1
+        if calls <= self.failures:
+            raise IOError('try again')
+        return data
+
+
+def check_name(book):
+    if book['name'] is None:
+        raise ValueError('no name')
+    return book
+
+
+class ErrorPolicyTest(TestCaseWithData):
+    def books_with_broken(self):
+        return [dict(book) for book in self.books[:2]] + [{'author': 'Nobody', 'name': None}] + \
+            [dict(self.books[2])]
+
+    def test_raise(self):
+        for errors in [None, 'raise']:
+            workflow = Root().for_each(Lambda(check_name), errors=errors).root
+            self.assertIsNone(workflow.for_each_errors)
+            with self.assertRaises(ValueError):
+                workflow(self.books_with_broken())
+
+    def test_skip(self):
+        dead_letters = DeadLetterList()
+        step = Lambda(check_name)
+        workflow = Root().for_each(step.then(GetField('name')).root,
+                                   errors=ErrorPolicy('skip', dead_letters=dead_letters)).root
+        self.assertEqual([book['name'] for book in self.books], workflow(self.books_with_broken()))
+        letter, = dead_letters.letters
+        self.assertEqual({'author': 'Nobody', 'name': None}, letter.item)
+        # the failed node is the innermost action
+        self.assertEqual('Lambda(check_name)', letter.node)
+        self.assertEqual('ValueError: no name', letter.error)
+        self.assertIn('check_name', letter.traceback)
+        # compiled workflow keeps the policy
+        self.assertEqual([book['name'] for book in self.books], workflow.compile()(self.books_with_broken()))
+        self.assertEqual(2, len(dead_letters))
+
+    def test_retry(self):
+        flaky = Flaky(failures=2)
+        dead_letters = DeadLetterList()
+        workflow = Root().for_each(flaky, errors=ErrorPolicy('retry', retries=2, backoff=0,
+                                                             dead_letters=dead_letters)).root
+        self.assertEqual([1, 2, 3], workflow([1, 2, 3]))
+        self.assertEqual(0, len(dead_letters))
+        # retries are exhausted
+        workflow = Root().for_each(Flaky(failures=2), errors=ErrorPolicy('retry', retries=1, backoff=0,
+                                                                         dead_letters=dead_letters)).root
+        self.assertEqual([], workflow([1]))
+        self.assertEqual('OSError: try again', dead_letters.letters[0].error)
+        self.assertEqual(0.4, ErrorPolicy('retry', backoff=0.1).delay(3))
+
+    def test_batch(self):
+        # chain of batch actions fails as a whole, then elements are processed one by one
+        dead_letters = DeadLetterList()
+        workflow = Root().for_each(GetField('name').then(Lambda(str.upper)).root,
+                                   errors=ErrorPolicy('skip', dead_letters=dead_letters, copy=dict)).root
+        self.assertEqual([book['name'].upper() for book in self.books], workflow(self.books_with_broken()))
+        self.assertEqual([None], [letter.item['name'] for letter in dead_letters.letters])
+
+    def test_batch_in_place(self):
+        # the first transformation changes elements in place before the second one fails
+        for copy in [None, dict]:
+            dead_letters = DeadLetterList()
+            transform = FieldsTransform({'a': lambda a: a + 1, 'b': lambda b: 1 / b})
+            workflow = Root().for_each(transform, errors=ErrorPolicy('skip', dead_letters=dead_letters,
+                                                                     copy=copy)).root
+            items = [{'a': 1, 'b': 1}, {'a': 1, 'b': 0}, {'a': 1, 'b': 2}]
+            self.assertEqual([{'a': 2, 'b': 1.0}, {'a': 2, 'b': 0.5}], workflow(items))
+            self.assertEqual([0], [letter.item['b'] for letter in dead_letters.letters])
+        # copied elements are recorded as they were passed
+        self.assertEqual([{'a': 1, 'b': 0}], [letter.item for letter in dead_letters.letters])
+
+    def test_savepoints(self):
+        def check_book(book):
+            if book.name is None:
+                raise ValueError('no name')
+            return book
+
+        dead_letters = DeadLetterList()
+        policy = ErrorPolicy('skip', dead_letters=dead_letters, savepoints=True)
+        for batch in [False, True]:
+            dead_letters.pop_all()
+            session = SavepointSessionMockup(commit_every=2)
+            store = ModelObjectCreate(Book, fields=['author', 'name'], unique=['name'], batch=batch)
+            store.then(Lambda(check_book))
+            with session:
+                Root().for_each(store, errors=policy).root(self.books_with_broken())
+            # objects of the failed element are discarded, the others are committed
+            self.assertEqual(sorted(book['name'] for book in self.books),
+                             sorted(book.name for book in session.commited))
+            self.assertEqual([None], [letter.item['name'] for letter in dead_letters.letters])
+
+    def test_replay(self):
+        dead_letters = DeadLetterList()
+        workflow = Root().for_each(Lambda(check_name), errors=ErrorPolicy('skip', dead_letters=dead_letters)).root
+        workflow(self.books_with_broken())
+        # still broken
+        self.assertEqual([], dead_letters.replay(Lambda(check_name)))
+        self.assertEqual(1, len(dead_letters))
+        # fixed
+        self.assertEqual([{'author': 'Nobody', 'name': 'Unknown'}],
+                         dead_letters.replay(Lambda(lambda book: dict(book, name='Unknown'))))
+        self.assertEqual(0, len(dead_letters))
+
+    def test_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            dead_letters = DeadLetterFile(os.path.join(directory, 'dead_letters'))
+            self.assertEqual([], dead_letters.pop_all())
+            workflow = Root().for_each(Lambda(check_name),
+                                       errors=ErrorPolicy('skip', dead_letters=dead_letters)).root
+            for _ in range(2):
+                workflow(self.books_with_broken())
+            letters = dead_letters.pop_all()
+            self.assertEqual([{'author': 'Nobody', 'name': None}] * 2, [letter.item for letter in letters])
+            self.assertEqual('Lambda(check_name)', letters[0].node)
+            self.assertEqual([], dead_letters.pop_all())
+
+    def test_stream_and_executors(self):
+        dead_letters = DeadLetterList()
+        policy = ErrorPolicy('skip', dead_letters=dead_letters)
+        expected = [book['name'] for book in self.books]
+        workflow = Root().for_each(Lambda(check_name).then(GetField('name')).root, chunk_size=2, errors=policy).root
+        self.assertEqual([expected[:2], expected[2:]], list(workflow(self.books_with_broken())))
+        workflow = Root().for_each(Lambda(check_name).then(GetField('name')).root, executor='thread',
+                                   errors=policy).root
+        self.assertEqual(expected, workflow(self.books_with_broken()))
+        # dead letters aren't sent to process workers, failures are recorded by calling process
+        self.assertIsNone(pickle.loads(pickle.dumps(policy)).dead_letters)
+        workflow = Root().for_each(Lambda(check_name), executor=ProcessExecutor(max_workers=2), errors=policy).root
+        self.assertEqual(self.books, workflow(self.books_with_broken()))
+        self.assertEqual(3, len(dead_letters))
+
+    def test_async(self):
+        dead_letters = DeadLetterList()
+        workflow = Root().for_each(Lambda(check_name), errors=ErrorPolicy('skip', dead_letters=dead_letters)).root
+        self.assertEqual(self.books, asyncio.run(workflow.acall(self.books_with_broken())))
+        self.assertEqual(1, len(dead_letters))
+
+    def test_wrong_policy(self):
+        self.assertRaisesRegex(ValueError, r'mode should be one of', ErrorPolicy, 'ignore')
+        self.assertRaisesRegex(ValueError, r"retries are supported by 'retry' mode only", ErrorPolicy, 'skip', 2)
@@ -0,0 +1,39 @@
+import importlib
+import os
+import subprocess
+import sys
+import types
+import unittest
+import flow
+
+
+def _imported_modules(code):
+    """Run `code` in fresh interpreter and return set of modules imported by it"""
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([p for p in sys.path if p]))
+    output = subprocess.check_output([sys.executable, '-c', code + '\nimport sys\nprint(" ".join(sys.modules))'],
+                                     env=env)
+    return set(output.decode('utf-8').split())
+
+
+class LazyImportTest(unittest.TestCase):
+    def test_names(self):
+        # every public name of submodules is exported
+        names = set()
+        for module_name in ['cache', 'session', 'executor', 'action', 'compiler', 'profile', 'analysis', 'errors',
+                            'pipeline']:
+            module = importlib.import_module('flow.' + module_name)
+            for name, value in vars(module).items():
+                if not name.startswith('_') and not isinstance(value, types.ModuleType) and \
+                        getattr(value, '__module__', module.__name__) == module.__name__:
+                    names.add(name)
+        self.assertEqual(sorted(names), flow.__all__)
+        self.assertIs(flow.Root, importlib.import_module('flow.action').Root)
+        self.assertIn('Root', dir(flow))
+        with self.assertRaises(AttributeError):
+            flow.NoSuchAction
+
+    def test_lazy(self):
+        modules = _imported_modules('import flow, flow.plot')
+        for name in ['flow.action', 'flow.executor', 'graphviz', 'asyncio', 'concurrent.futures']:
+            self.assertNotIn(name, modules)
+        self.assertIn('flow.action', _imported_modules('from flow import Root'))
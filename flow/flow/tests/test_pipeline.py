@@ -0,0 +1,101 @@
+import threading
+import time
+from flow import Lambda, Pipeline, Stage, current_session
+from .common import *
+
+
+def double(x):
+    return 2 * x
+
+
+def slow_double(x):
+    time.sleep(0.02)
+    return 2 * x
+
+
+def fail_on_five(x):
+    if x == 5:
+        raise ValueError('bad element')
+    return x
+
+
+def pipeline_threads():
+    return [thread for thread in threading.enumerate() if thread.name.startswith('pipeline-')]
+
+
+class PipelineTest(unittest.TestCase):
+    def test_pipeline(self):
+        pipeline = Pipeline([Stage(double, name='double'), Lambda(lambda x: x + 1)])
+        self.assertEqual([2 * x + 1 for x in range(100)], pipeline(range(100)))
+        stats = pipeline.stats()
+        self.assertEqual(['double', 'Lambda(<lambda>)'], [stage['name'] for stage in stats])
+        for stage in stats:
+            self.assertEqual(100, stage['items'])
+            self.assertEqual(0, stage['queue'])
+            self.assertLessEqual(stage['max_queue'], stage['maxsize'])
+        self.assertEqual([], pipeline_threads())
+        self.assertEqual([], pipeline([]))
+
+    def test_overlap(self):
+        # two stages of the same latency are run concurrently
+        pipeline = Pipeline([slow_double, slow_double])
+        start = time.time()
+        self.assertEqual([4 * x for x in range(20)], pipeline(range(20)))
+        self.assertLess(time.time() - start, 0.75 * 2 * 20 * 0.02)
+
+    def test_workers(self):
+        pipeline = Pipeline([Stage(slow_double, workers=4), Stage(double, workers=2)])
+        start = time.time()
+        self.assertEqual([4 * x for x in range(20)], sorted(pipeline(range(20))))
+        self.assertLess(time.time() - start, 0.5 * 20 * 0.02)
+
+    def test_process(self):
+        pipeline = Pipeline([Stage(double, executor='process', workers=2), double])
+        self.assertEqual([4 * x for x in range(10)], sorted(pipeline(range(10))))
+
+    def test_backpressure(self):
+        read = []
+
+        def inputs():
+            for i in range(1000):
+                read.append(i)
+                yield i
+
+        pipeline = Pipeline([double, double], maxsize=1)
+        results = pipeline.run(inputs())
+        self.assertEqual(0, next(results))
+        time.sleep(0.1)
+        # elements in queues, in workers and in feeder only
+        self.assertLess(len(read), 10)
+        results.close()
+        self.assertEqual([], pipeline_threads())
+
+    def test_errors(self):
+        pipeline = Pipeline([fail_on_five, double])
+        with self.assertRaisesRegex(ValueError, 'bad element'):
+            pipeline(range(1000))
+        self.assertEqual([], pipeline_threads())
+
+        def inputs():
+            yield 1
+            raise KeyError('bad input')
+
+        with self.assertRaises(KeyError):
+            Pipeline([double])(inputs())
+        self.assertEqual([], pipeline_threads())
+
+    def test_session(self):
+        session = ORMSessionMockup()
+        with session:
+            sessions = Pipeline([Stage(lambda x: current_session(), workers=2)])(range(4))
+        self.assertEqual([session] * 4, sessions)
+
+    def test_wrong_arguments(self):
+        with self.assertRaises(ValueError):
+            Stage(double, workers=0)
+        with self.assertRaises(ValueError):
+            Stage(double, executor='fiber')
+        with self.assertRaises(ValueError):
+            Pipeline([])
+        with self.assertRaises(ValueError):
+            Pipeline([double], maxsize=0)
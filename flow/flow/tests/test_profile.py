@@ -0,0 +1,111 @@
+import json
+import re
+import time
+from flow import FieldsTransform, GetField, Lambda, ModelObjectCreate, Profiler
+from .common import *
+
+
+def slow_upper(name):
+    time.sleep(0.001)
+    return name.upper()
+
+
+def books_workflow():
+    return GetField('books').for_each(Lambda(dict)).then(FieldsTransform({'name': slow_upper})).root
+
+
+class ProfilerTest(TestCaseWithData):
+    def test_stats(self):
+        workflow = books_workflow()
+        profiler = Profiler()
+        with profiler:
+            workflow({'books': self.books})
+            workflow({'books': self.books})
+
+        stats = {node['node']: node for node in profiler.stats()}
+        # elements are processed by batch chain, every action is called once per batch
+        self.assertEqual({"GetField 'books'", 'Lambda(dict) [batch]', 'FieldsTransform [batch]',
+                          'Lambda(slow_upper) [batch]'}, set(stats))
+        self.assertEqual((2, 6), (stats["GetField 'books'"]['calls'], stats["GetField 'books'"]['items']))
+        self.assertEqual((2, 6), (stats['Lambda(dict) [batch]']['calls'], stats['Lambda(dict) [batch]']['items']))
+        # sub actions of FieldsTransform are accounted as nested ones
+        transform = profiler.get(workflow.for_each_action.next_action)
+        slow_upper = profiler.get(workflow.for_each_action.next_action.transformations['name'])
+        self.assertEqual(2, transform.calls)
+        self.assertGreaterEqual(transform.total_time, slow_upper.total_time)
+        self.assertLess(transform.self_time, slow_upper.total_time)
+        self.assertGreaterEqual(slow_upper.percentile(50), 0.001)
+        self.assertEqual(stats["GetField 'books'"]['node'], profiler.stats()[0]['node'])
+
+        self.assertEqual(profiler.stats(), json.loads(profiler.to_json()))
+        self.assertEqual(len(stats) + 2, len(profiler.table().split('\n')))
+
+    def test_off(self):
+        workflow = books_workflow()
+        profiler = Profiler()
+        with profiler:
+            pass
+        workflow({'books': self.books})
+        self.assertEqual([], profiler.stats())
+
+    def test_batch(self):
+        for mode in ['batch', 'bulk']:
+            store = ModelObjectCreate(Book, unique=['name', 'author'], **{mode: True})
+            workflow = GetField('books')
+            workflow.for_each(store)
+            workflow.then(Lambda(len))
+            profiler = Profiler()
+            with ORMSessionMockup(), profiler:
+                workflow({'books': self.books})
+
+            stats = {node['node']: node for node in profiler.stats()}
+            self.assertEqual({"GetField 'books'", 'ModelObjectCreate(Book) [{}]'.format(mode), 'Lambda(len)'},
+                             set(stats))
+            self.assertEqual((1, len(self.books)), (profiler.get(store).calls, profiler.get(store).items))
+            # time of the batch isn't accounted as self time of the parent action
+            books = profiler.get(workflow)
+            self.assertLessEqual(books.self_time, books.total_time - profiler.get(store).total_time)
+
+    def test_compiled(self):
+        workflow = books_workflow()
+        compiled = workflow.compile()
+        expected = workflow({'books': self.books})
+        profiler = Profiler()
+        with profiler:
+            self.assertEqual(expected, compiled({'books': self.books}))
+        # compiled workflow is profiled by steps and stages it's run by, plain functions are fused into them
+        self.assertEqual({"GetField 'books' [compiled]", 'Lambda(dict) [batch]',
+                          'FieldsTransform + Lambda(slow_upper) [batch]'}, {node['node'] for node in profiler.stats()})
+        self.assertEqual((1, 3), (profiler.get(workflow).calls, profiler.get(workflow).items))
+        self.assertEqual(1, profiler.get(workflow.for_each_action).calls)
+        transform = profiler.get(workflow.for_each_action.next_action)
+        self.assertGreaterEqual(transform.self_time, 0.003)
+
+
+class PlotOverlayTest(TestCaseWithData):
+    def test_overlay(self):
+        from flow.plot import ActionsPlotter
+
+        workflow = books_workflow()
+        plotter = ActionsPlotter()
+        source = plotter.build(workflow).source
+        self.assertNotIn('calls', source)
+
+        profiler = Profiler()
+        with profiler:
+            for _ in range(2):
+                workflow({'books': self.books})
+        source = plotter.build(workflow, profiler=profiler).source
+        n = len(self.books)
+        self.assertIn('calls: 2\nitems: {}'.format(2 * n), source)
+        # for_each edge is scaled by fan-out, batch chain is called once per call of the parent
+        self.assertIn('for_each\nx{} per call\n2 calls'.format(n), source)
+        self.assertIn('penwidth', source)
+        # the most expensive node is the reddest one
+        slowest = max(profiler.nodes.values(), key=lambda node: node.self_time)
+        self.assertEqual(1, source.count('fillcolor="0.000 1.000 1.000"'))
+        hottest = re.search(r'label="(\w+)[^"]*" fillcolor="0.000 1.000 1.000"', source).group(1)
+        self.assertEqual(slowest.action.__class__.__name__, hottest)
+        # not called nodes are dashed
+        self.assertNotIn('dashed', source)
+        self.assertIn('dashed', plotter.build(workflow, profiler=Profiler()).source)
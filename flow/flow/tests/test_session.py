@@ -0,0 +1,131 @@
+import unittest
+from flow import LRUCache, Lambda, ModelObjectCreate, Root
+from .common import *
+
+
+class LRUCacheTest(unittest.TestCase):
+    def test_eviction(self):
+        cache = LRUCache(maxsize=2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        # 'a' becomes most recently used, so 'b' is evicted
+        self.assertEqual(1, cache.get('a'))
+        cache.put('c', 3)
+        self.assertEqual(None, cache.get('b'))
+        self.assertEqual(3, cache.get('c'))
+        self.assertEqual({'size': 2, 'maxsize': 2, 'hits': 2, 'misses': 1}, cache.stats())
+
+    def test_ttl(self):
+        now = [0]
+        cache = LRUCache(maxsize=2, ttl=10, clock=lambda: now[0])
+        cache.put('a', 1)
+        now[0] = 5
+        cache.put('b', 2)
+        self.assertIn('a', cache)
+        now[0] = 10
+        # 'a' is expired, 'b' isn't
+        self.assertNotIn('a', cache)
+        self.assertEqual(None, cache.get('a'))
+        self.assertEqual(2, cache.get('b'))
+        self.assertEqual(2, cache.pop('b'))
+        self.assertEqual(0, len(cache))
+
+    def test_wrong_maxsize(self):
+        self.assertRaisesRegex(ValueError, r"maxsize should be > 0", LRUCache, 0)
+
+
+class SessionCacheTest(TestCaseWithData):
+    def test_cache_shared_between_sessions(self):
+        cache = LRUCache(maxsize=100)
+        a = Root().for_each(ModelObjectCreate(Book, unique=['name', 'author'])).root
+
+        session = ORMSessionMockup(cache=cache)
+        with session:
+            a(self.books)
+        self.assertEqual({'size': 3, 'maxsize': 100, 'hits': 0, 'misses': 3}, cache.stats())
+
+        # new session doesn't see objects of the first one, but gets them from cache
+        session2 = ORMSessionMockup(cache=cache)
+        with session2:
+            objects = a(self.books)
+        self.assertEqual([], session2.commited)
+        self.assertEqual(session.commited, objects)
+        self.assertEqual(3, cache.hits)
+
+    def test_rollback_invalidation(self):
+        cache = LRUCache(maxsize=100)
+        a = Root().for_each(ModelObjectCreate(Book, unique=['name', 'author'])).root
+        session = ORMSessionMockup(cache=cache)
+        with session:
+            a(self.books[:1])
+
+        def fail(data):
+            raise RuntimeError('fail')
+
+        failing = Root().for_each(ModelObjectCreate(Book, unique=['name', 'author'])).then(Lambda(fail)).root
+        with self.assertRaisesRegex(RuntimeError, 'fail'):
+            with session:
+                failing(self.books)
+        # only committed object is left in cache
+        self.assertEqual(1, len(cache))
+        self.assertEqual(self.books[:1], session.commited)
+
+
+class LegacySessionTest(TestCaseWithData):
+    def test_without_base_init(self):
+
+        class LegacySession(ORMSessionMockup):
+            def __init__(self):
+                # sessions written before commit policies didn't call base `__init__`
+                self.added = []
+                self.commited = []
+
+        session = LegacySession()
+        with session:
+            Root().for_each(ModelObjectCreate(Book, fields=['author', 'name'], unique=['name'])).root(self.books)
+        self.assertEqual(self.books, session.commited)
+        self.assertEqual(3, session.stats()['added'])
+        self.assertIsNot(session.counters, LegacySession().counters)
+
+
+class CommitPolicyTest(TestCaseWithData):
+    def test_commit_every(self):
+        session = ORMSessionMockup(commit_every=2)
+        a = Root().for_each(ModelObjectCreate(Book)).root
+        with session:
+            a(self.books)
+            # the last chunk isn't finished yet
+            self.assertEqual(self.books[:2], session.commited)
+        self.assertEqual(self.books, session.commited)
+        stats = session.stats()
+        self.assertEqual(3, stats['added'])
+        self.assertEqual(2, stats['chunks'])
+        self.assertEqual(2, stats['commits'])
+
+    def test_bad_chunk(self):
+
+        def check(book):
+            if book['name'] == self.books[-1]['name']:
+                raise ValueError('bad book')
+            return book
+
+        session = ORMSessionMockup(commit_every=1)
+        a = Root().for_each(Lambda(check).then(ModelObjectCreate(Book)).root).root
+        with self.assertRaises(ValueError):
+            with session:
+                a(self.books)
+        # finished chunks are kept
+        self.assertEqual(self.books[:2], session.commited)
+        self.assertEqual(1, session.stats()['rolled_back_chunks'])
+
+    def test_commit_interval(self):
+        session = ORMSessionMockup(commit_interval=1e-9)
+        with session:
+            Root().for_each(ModelObjectCreate(Book)).root(self.books)
+        self.assertEqual(3, session.stats()['chunks'])
+
+    def test_wrong_policy(self):
+        self.assertRaisesRegex(ValueError, r"commit_every should be > 0", ORMSessionMockup, commit_every=0)
+        with self.assertRaises(NotImplementedError):
+            with ORMSessionMockup(savepoints=True):
+                pass
@@ -1,7 +1,13 @@
+import sys
 import unittest
-from flow import FieldsTransform, ModelObjectCreate, Root
+from flow import Action, FieldsTransform, GetField, Lambda, ModelObjectCreate, Root
 from .common import *
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 
 class ForEachUpperCaseTest(TestCaseWithData):
     def test_for_each_upper_case(self):
@@ -19,3 +25,275 @@ class ForEachToModelTest(TestCaseWithData):
             # check for uniqueness also
             a(self.books + self.books)
         self.assertEqual(self.books, session.commited)
+
+
+class ForEachToModelBatchTest(TestCaseWithData):
+    def test_for_each_to_model_batch(self):
+
+        class CountingSession(ORMSessionMockup):
+            def __init__(self):
+                super(CountingSession, self).__init__()
+                self.batches = []
+
+            def get_or_create_many(self, model, kwargs_list, defaults=None):
+                self.batches.append(kwargs_list)
+                return super(CountingSession, self).get_or_create_many(model, kwargs_list, defaults)
+
+        session = CountingSession()
+        a = Root().for_each(ModelObjectCreate(Book, unique=['name', 'author'], batch=True)).root
+        with session:
+            objects = a(self.books + self.books)
+        # all keys are resolved by one call, duplicates point to the same object
+        self.assertEqual(1, len(session.batches))
+        self.assertEqual(len(self.books) * 2, len(objects))
+        for first, second in zip(objects[:len(self.books)], objects[len(self.books):]):
+            self.assertIs(first, second)
+        self.assertEqual(self.books, session.commited)
+
+    def test_for_each_to_model_bulk(self):
+
+        class BulkSession(ORMSessionMockup):
+            def __init__(self):
+                super(BulkSession, self).__init__()
+                self.bulks = []
+
+            def bulk_upsert(self, model, rows, unique):
+                self.bulks.append(rows)
+                return super(BulkSession, self).bulk_upsert(model, rows, unique)
+
+        session = BulkSession()
+        a = Root().for_each(ModelObjectCreate(Book, fields=['author'], unique=['name'], bulk=True)).root
+        renamed = [{'author': 'Unknown', 'name': book['name']} for book in self.books]
+        with session:
+            objects = a(self.books + renamed)
+        # all rows are written by one call, the last row of the same key wins
+        self.assertEqual([[{'author': book['author'], 'name': book['name']} for book in self.books + renamed]],
+                         session.bulks)
+        for first, second in zip(objects[:len(self.books)], objects[len(self.books):]):
+            self.assertIs(first, second)
+        self.assertEqual(renamed, session.commited)
+
+
+class ForEachBatchTest(TestCaseWithData):
+    class CountingLambda(Lambda):
+        def __init__(self, func):
+            super(ForEachBatchTest.CountingLambda, self).__init__(func)
+            self.batches = 0
+
+        def do_batch(self, items):
+            self.batches += 1
+            return super(ForEachBatchTest.CountingLambda, self).do_batch(items)
+
+    def test_batch_chain(self):
+        upper = self.CountingLambda(str.upper)
+        a = Root().for_each(FieldsTransform({'name': upper, 'author': str.strip})).root
+        a.for_each_action.then(GetField('name'))
+        books = [dict(book) for book in self.books]
+        self.assertEqual([book['name'].upper() for book in self.books], a(books))
+        # the whole column is transformed by one call
+        self.assertEqual(1, upper.batches)
+
+    def test_nested_batch_chain(self):
+        upper = self.CountingLambda(str.upper)
+        a = Root().for_each(GetField('tags').for_each(upper).root).root
+        data = [{'tags': ['a', 'b']}, {'tags': []}, {'tags': ['c']}]
+        for workflow in [a, a.compile()]:
+            upper.batches = 0
+            self.assertEqual([['A', 'B'], [], ['C']], workflow(data))
+            # elements of all lists are processed by one call
+            self.assertEqual(1, upper.batches)
+
+    def test_not_batch_chain(self):
+
+        class Strip(Action):
+            def do(self, data):
+                return data.strip()
+
+        upper = self.CountingLambda(str.upper)
+        a = Root().for_each(GetField('name').then(upper).then(Strip()).root).root
+        # Strip doesn't support batches, so elements are processed one by one
+        self.assertEqual([book['name'].upper().strip() for book in self.books], a(self.books))
+        self.assertEqual(0, upper.batches)
+
+    def test_do_override(self):
+
+        class UpperField(GetField):
+            def do(self, data):
+                return data[self.field].upper()
+
+        class Upper(Lambda):
+            def do(self, data):
+                return self.func(data).upper()
+
+        # `do_batch` inherited from the parent class doesn't do what overridden `do` does
+        for a in [Root().for_each(UpperField('name')).root, Root().for_each(Upper(str.strip)).root]:
+            data = [{'name': 'x'}] if isinstance(a.for_each_action, GetField) else [' x ']
+            self.assertEqual(['X'], a(data))
+            self.assertEqual(['X'], a.compile()(data))
+
+    def test_order(self):
+        calls = []
+
+        def log(name):
+            def func(value):
+                calls.append((name, value))
+                return value
+            return func
+
+        names = [book['name'] for book in self.books]
+        authors = [book['author'] for book in self.books]
+        a = Root().for_each(GetField('name').then(Lambda(log('a'))).then(Lambda(log('b'))).root).root
+        t = Root().for_each(FieldsTransform({'name': log('name'), 'author': log('author')})).root
+        # stage by stage in both paths: each action is done on all elements before the next one
+        for action, expected in [(a, [('a', name) for name in names] + [('b', name) for name in names]),
+                                 (t, [('name', name) for name in names] + [('author', author) for author in authors])]:
+            for workflow in [action, action.compile()]:
+                calls[:] = []
+                workflow([dict(book) for book in self.books])
+                self.assertEqual(expected, calls)
+
+    @unittest.skipIf(numpy is None, 'NumPy is not installed')
+    def test_vectorized(self):
+        a = Root().for_each(FieldsTransform({'price': Lambda(numpy.sqrt, vectorized=True)})).root
+        self.assertEqual([{'price': 2.0}, {'price': 3.0}], a([{'price': 4}, {'price': 9}]))
+        self.assertEqual([], a([]))
+
+
+class ForEachExecutorTest(TestCaseWithData):
+    def test_thread_executor(self):
+        session = ORMSessionMockup()
+        a = Root().for_each(ModelObjectCreate(Book, unique=['name', 'author']), executor='thread', max_workers=4).root
+        with session:
+            objects = a(self.books * 10)
+        # results order is kept and objects are unique
+        self.assertEqual(self.books * 10, objects)
+        self.assertEqual(self.books, session.commited)
+
+    def test_process_executor(self):
+        a = Root().for_each(GetField('name'), executor='process', max_workers=2).root
+        self.assertEqual([book['name'] for book in self.books], a(self.books))
+
+    def test_first_error_is_raised(self):
+
+        def check(x):
+            if x % 3 == 2:
+                raise ValueError('bad item {}'.format(x))
+            return x
+
+        a = Root().for_each(Lambda(check), executor='thread', max_workers=4).root
+        for _ in range(10):
+            self.assertRaisesRegex(ValueError, r'bad item 2$', a, list(range(100)))
+
+    def test_unexpected_executor(self):
+        self.assertRaisesRegex(ValueError, r'unexpected executor', Root().for_each, Lambda(int), executor='gpu')
+
+
+class ForEachStreamTest(TestCaseWithData):
+    def test_stream(self):
+        processed = []
+
+        def process(x):
+            processed.append(x)
+            return x * 2
+
+        a = Root().for_each(Lambda(process), stream=True).root
+        ret = a(iter(range(10)))
+        # nothing is processed until results are requested
+        self.assertEqual([], processed)
+        self.assertEqual([0, 2], [next(ret), next(ret)])
+        self.assertEqual([0, 1], processed)
+        self.assertEqual(list(range(4, 20, 2)), list(ret))
+
+    def test_chunks(self):
+        a = Root().for_each(Lambda(lambda x: x * 2), chunk_size=4).root
+        self.assertEqual([[0, 2, 4, 6], [8, 10, 12, 14], [16, 18]], list(a(range(10))))
+
+        a = Root().for_each(Lambda(lambda x: x * 2), executor='thread', max_workers=2, chunk_size=4).root
+        self.assertEqual([[0, 2, 4, 6], [8, 10, 12, 14], [16, 18]], list(a(range(10))))
+
+    def test_stream_to_model_by_chunks(self):
+
+        class CountingSession(ORMSessionMockup):
+            def __init__(self):
+                super(CountingSession, self).__init__()
+                self.batches = 0
+
+            def get_or_create_many(self, model, kwargs_list, defaults=None):
+                self.batches += 1
+                return super(CountingSession, self).get_or_create_many(model, kwargs_list, defaults)
+
+        session = CountingSession()
+        a = Root()
+        a.for_each(Lambda(dict), chunk_size=2)
+        store_chunk = Root().for_each(ModelObjectCreate(Book, unique=['name', 'author'], batch=True)).root
+        a.then(Root().for_each(store_chunk, stream=True).root)
+        with session:
+            chunks = list(a(self.books + self.books))
+        self.assertEqual([2, 2, 2], [len(chunk) for chunk in chunks])
+        self.assertEqual(3, session.batches)
+        self.assertEqual(self.books, session.commited)
+
+        session = CountingSession()
+        a = Root().for_each(ModelObjectCreate(Book, unique=['name', 'author'], batch=2), stream=True).root
+        with session:
+            objects = list(a(self.books + self.books))
+        self.assertEqual(self.books + self.books, objects)
+        self.assertEqual(3, session.batches)
+
+
+class CompiledWorkflowTest(TestCaseWithData):
+    def test_same_results(self):
+        session = ORMSessionMockup()
+        a = Root()
+        a.for_each(GetField('name')).then(Lambda(str.upper))
+        a.then(Lambda(len))
+        self.assertEqual(3, a.compile()(self.books))
+
+        name = Lambda(str.upper).then(Lambda(str.strip)).root
+        a = Root().for_each(Lambda(dict)).then(FieldsTransform({'name': name}))\
+            .then(ModelObjectCreate(Book, unique=['name', 'author'])).root
+        with session:
+            objects = a.compile()([book for book in self.books + self.books])
+        true_books = [dict(book, name=book['name'].upper()) for book in self.books]
+        self.assertEqual(true_books + true_books, objects)
+        self.assertEqual(true_books, session.commited)
+
+    def test_nested_for_each(self):
+        double_and_sum = Root()
+        double_and_sum.for_each(Lambda(lambda x: x * 2))
+        double_and_sum.then(Lambda(sum)).then(Lambda(str))
+        a = Root().for_each(double_and_sum).root
+        data = [[1, 2], [], [3]]
+        self.assertEqual(a(data), a.compile()(data))
+        self.assertEqual(['6', '0', '6'], a.compile()(data))
+
+    def test_not_compiled_for_each(self):
+        a = Root().for_each(Lambda(lambda x: x + 1), executor='thread').then(Lambda(str)).root
+        compiled = a.compile()
+        self.assertEqual(['1', '2'], compiled([0, 1]))
+        self.assertEqual(['<Step(Root)>'], compiled.describe())
+
+    def test_fusion(self):
+        a = GetField('books').then(Lambda(len)).then(Lambda(str)).root
+        compiled = a.compile()
+        self.assertEqual(['<Step(GetField + Lambda + Lambda)>'], compiled.describe())
+        self.assertEqual(str(len(self.books)), compiled({'books': self.books}))
+
+    def test_batch_for_each(self):
+        a = GetField('books').then(Lambda(list)).for_each(GetField('name')).then(Lambda(str.upper)).root
+        compiled = a.compile()
+        # batch chain is run within the step, stage by stage
+        self.assertEqual(['<Step(GetField)>', '<Step(Lambda)>'], compiled.describe())
+        self.assertEqual([book['name'].upper() for book in self.books], compiled({'books': self.books}))
+
+        a = Root().for_each(Lambda(dict)).then(FieldsTransform({'name': Lambda(str.upper), 'author': Lambda(len)})).root
+        data = [dict(book) for book in self.books]
+        self.assertEqual(a(data), a.compile()(data))
+
+    def test_deep_chain(self):
+        a = Root()
+        last = a
+        for _ in range(sys.getrecursionlimit() * 2):
+            last = last.then(Lambda(lambda x: x + 1)).then(FieldsTransform({})).then(Lambda(lambda x: x - 1))
+        self.assertRaises(RecursionError, a, 0)
+        self.assertEqual(0, a.compile()(0))
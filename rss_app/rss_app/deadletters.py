@@ -0,0 +1,41 @@
+from datetime import datetime
+from flow import current_session
+from flow.errors import DeadLetter, DeadLetterStore
+from .model import DeadLetter as DeadLetterRow
+
+
+class DeadLetterTable(DeadLetterStore):
+    """DeadLetterTable keeps dead letters of workflow `stage` in `dead_letters` table
+
+    Letters are added to ORM session of the running workflow, so they are committed along with the good elements.
+    `put` and `pop_all` should be called within `ORMSessionSQLAlchemy` context.
+    """
+    def __init__(self, stage, encode=None):
+        """
+        Parameters
+        ----------
+        stage : str - name of workflow stage, letters of different stages are replayed separately
+        encode : callable - turns failed element into picklable form, which could be replayed by the stage
+        """
+        self.stage = stage
+        self.encode = encode
+
+    def put(self, letter):
+        item = letter.item if self.encode is None else self.encode(letter.item)
+        current_session().add(DeadLetterRow(stage=self.stage, node=letter.node, error=letter.error,
+                                            traceback=letter.traceback, item=item,
+                                            created=datetime.fromtimestamp(letter.time)))
+
+    def pop_all(self):
+        session = current_session().session
+        rows = session.query(DeadLetterRow).filter(DeadLetterRow.stage == self.stage).order_by(DeadLetterRow.id).all()
+        letters = [DeadLetter(row.item, row.node, row.error, row.traceback,
+                              row.created.timestamp() if row.created is not None else None)
+                   for row in rows]
+        for row in rows:
+            session.delete(row)
+        return letters
+
+    def count(self):
+        """Return number of stored letters of the stage"""
+        return current_session().session.query(DeadLetterRow).filter(DeadLetterRow.stage == self.stage).count()
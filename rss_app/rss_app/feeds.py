@@ -0,0 +1,346 @@
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+import feedparser
+import feedparser.http
+from flow import ORMSessionSQLAlchemy, Pipeline, Stage
+import hashlib
+import io
+import itertools
+import logging
+import time
+import urllib.parse
+import urllib.request
+from .model import Feed
+from .deadletters import DeadLetterTable
+from .stream import TIMEOUT, iter_documents
+from .workflow import (_stored_guids, build_feed_extractor, build_record_loader, feed_extractor, record_extractor,
+                       record_loader)
+
+
+logger = logging.getLogger('rss parser')
+
+
+class _TimeoutHandler(urllib.request.BaseHandler):
+    """Sets `timeout` of requests opened by `feedparser.http.get`, which doesn't pass any timeout itself"""
+    def __init__(self, timeout):
+        self.timeout = timeout
+
+    def http_request(self, request):
+        request.timeout = self.timeout
+        return request
+
+    https_request = ftp_request = http_request
+
+
+def download(url, etag=None, modified=None, timeout=TIMEOUT):
+    """Download feed `url` or read it if it's file path. Returns content and dict of response fields
+    like `feedparser` documents have: `status`, `etag`, `modified`, `href`, `headers` and `bozo`
+
+    `etag` and `modified` are validators of previously fetched version, if the feed isn't changed
+    server responds with 304 status and content is empty. `timeout` is seconds to wait for connection and
+    every read, the feed isn't downloaded if it's exceeded.
+    """
+    response = feedparser.FeedParserDict(bozo=False, entries=[], feed=feedparser.FeedParserDict(), headers={})
+    if urllib.parse.urlparse(url).scheme not in ('http', 'https', 'ftp', 'file', 'feed'):
+        with open(url, 'rb') as f:
+            return f.read(), response
+    try:
+        # `feedparser.http.get` is internal API of feedparser 6, the version is bounded in setup.py
+        content = feedparser.http.get(url, etag, modified, feedparser.USER_AGENT, handlers=[_TimeoutHandler(timeout)],
+                                      result=response)
+    except OSError as error:
+        # `urllib.error.URLError` or timeout of reading
+        response.update(bozo=True, bozo_exception=error)
+        return b'', response
+    return content, response
+
+
+def parse_content(content, response):
+    """Parse feed `content` downloaded by `download`, fields of `response` are kept in the document"""
+    if not content:
+        return response
+    rss_document = feedparser.parse(io.BytesIO(content), response_headers=response['headers'])
+    for key in ('status', 'etag', 'modified', 'modified_parsed', 'href'):
+        if key in response:
+            rss_document[key] = response[key]
+    return rss_document
+
+
+def fetch_rss(url, etag=None, modified=None):
+    """Download and parse feed. Returns parsed document, download and parse time in seconds
+
+    See `download` for `etag` and `modified`, document of not modified feed has no entries.
+    """
+    start = time.time()
+    content, response = download(url, etag, modified)
+    fetch_time = time.time() - start
+    start = time.time()
+    rss_document = parse_content(content, response)
+    return rss_document, fetch_time, time.time() - start
+
+
+def content_hash(rss_document):
+    """Hash of feed entries, used to detect unchanged feeds when server ignores validators"""
+    digest = hashlib.sha1()
+    for entry in rss_document.get('entries', []):
+        date = entry.get('published_parsed') or entry.get('updated_parsed')
+        digest.update(repr((entry.get('id'), entry.get('title'), entry.get('link'), entry.get('author'),
+                            [tag.get('term') for tag in entry.get('tags', [])],
+                            tuple(date) if date else None)).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def store_rss(rss_document, session, cache=None, feed=None, known_guids=None, commit_policy=None):
+    """Store feed entries into DB. `feed` state is committed along with entries
+
+    If `known_guids` is given, entries of already stored posts are skipped and guids of
+    stored entries are added to `known_guids` once they are committed.
+    `commit_policy` is dict of `ORMSessionBase` commit policy arguments.
+    """
+    workflow = feed_extractor if known_guids is None else build_feed_extractor(known_guids)
+    with ORMSessionSQLAlchemy(session, cache=cache, **(commit_policy or {})):
+        workflow(rss_document)
+        if feed is not None:
+            session.add(feed)
+    if known_guids is not None:
+        known_guids.update(entry.get('id') for entry in rss_document.get('entries', []))
+
+
+def store_stream(source, session, cache=None, batch_size=100, known_guids=None, commit_policy=None, pipeline=False,
+                 timeout=TIMEOUT):
+    """Store entries of feed `source` parsed incrementally by `iter_documents`. Returns number of entries
+
+    It's library function for one-off loads of huge feeds (archives, dumps), `poll` doesn't use it: feed is
+    downloaded without HTTP validators, so it's stored every time, entries failed to be stored fail the whole
+    feed and metrics aren't recorded.
+
+    Entries are passed to the workflow by batches of `batch_size` as they are read, so memory doesn't grow
+    with document size. All batches are stored in one `ORMSessionBase` context, use `commit_policy`
+    to commit them by chunks. If `pipeline` is True, next batches are parsed and turned into records
+    by `flow.Pipeline` threads while the current one is stored. `timeout` is passed to `iter_documents`.
+    Other arguments are the same as for `store_rss`
+    """
+    count = 0
+    guids = []
+    with ORMSessionSQLAlchemy(session, cache=cache, **(commit_policy or {})):
+        if pipeline:
+            # DB is written by this thread only, known guids are checked by the loader as they need DB
+            loader = record_loader if known_guids is None else build_record_loader(known_guids)
+            stages = Pipeline([Stage(record_extractor, name='extract')])
+            for records in stages.run(iter_documents(source, batch_size, timeout=timeout)):
+                loader(records)
+                count += len(records)
+                guids.extend(record['id'] for record in records)
+        else:
+            workflow = feed_extractor if known_guids is None else build_feed_extractor(known_guids)
+            for rss_document in iter_documents(source, batch_size, timeout=timeout):
+                workflow(rss_document)
+                count += len(rss_document['entries'])
+                if known_guids is not None:
+                    guids.extend(entry.get('id') for entry in rss_document['entries'])
+    if known_guids is not None:
+        known_guids.update(guids)
+    return count
+
+
+def parse_rss(url, session, cache=None, batch_size=None):
+    """Fetch feed and store it into DB once. If `batch_size` is given, feed is parsed incrementally
+    by `store_stream`, which is preferable for large feeds. It's library function like `store_stream`,
+    the polling loop of rss_app uses `poll`"""
+    logger.info("Parse '{}'".format(url))
+    if batch_size:
+        store_stream(url, session, cache, batch_size)
+        return
+    rss_document, _, _ = fetch_rss(url)
+    store_rss(rss_document, session, cache)
+
+
+def fetch_error(rss_document):
+    """Return description of failed fetch of `rss_document`, None if it's fetched"""
+    status = rss_document.get('status')
+    # redirects are followed by feedparser, status of the redirect is kept then
+    if status is not None and not 200 <= status < 400:
+        return 'HTTP status {}'.format(status)
+    if rss_document.get('bozo') and not rss_document.get('entries'):
+        exception = rss_document.get('bozo_exception')
+        return '{}: {}'.format(type(exception).__name__, exception) if exception is not None else 'no entries'
+    return None
+
+
+def load_feeds(urls, session):
+    """Return dict url -> `Feed` with state of the last stored version of `urls`"""
+    feeds = {feed.url: feed for feed in session.query(Feed).filter(Feed.url.in_(urls))}
+    for url in urls:
+        if url not in feeds:
+            feeds[url] = Feed(url=url)
+    return feeds
+
+
+def fetch_records(url, etag=None, modified=None, last_hash=None):
+    """Fetch feed and turn it into records unless it isn't modified since the last stored version.
+
+    Doesn't touch DB, so it's run by worker threads or processes. Returns picklable dict with
+    `status` ('error', 'not modified', 'same content' or 'changed'), `fetch_time` (download), `parse_time`,
+    `extract_time` and, for changed feeds, feed validators, `content_hash` and `records`, for failed fetches `error`.
+    """
+    rss_document, fetch_time, parse_time = fetch_rss(url, etag, modified)
+    result = {'status': 'not modified', 'fetch_time': fetch_time, 'parse_time': parse_time, 'extract_time': 0.0}
+    if rss_document.get('status') == 304:
+        return result
+    error = fetch_error(rss_document)
+    if error is not None:
+        result.update(status='error', error=error)
+        return result
+    start = time.time()
+    digest = content_hash(rss_document)
+    if digest == last_hash:
+        result['status'] = 'same content'
+    else:
+        result.update(status='changed', etag=rss_document.get('etag'), modified=rss_document.get('modified'),
+                      content_hash=digest, records=record_extractor(rss_document))
+    result['extract_time'] = time.time() - start
+    return result
+
+
+def store_records(records, session, cache=None, feed=None, known_guids=None, commit_policy=None, error_policy=None):
+    """Store `records` made by `fetch_records` into DB. Arguments are the same as for `store_rss`.
+    `error_policy` is dict of `build_record_loader` error handling arguments, failed records are stored
+    to `dead_letters` table then. Returns `ORMSessionBase.stats()` of the storing session"""
+    if known_guids is None and not error_policy:
+        workflow = record_loader
+    else:
+        workflow = build_record_loader(known_guids, **(error_policy or {}))
+    guids = [record['id'] for record in records]
+    orm_session = ORMSessionSQLAlchemy(session, cache=cache, **(commit_policy or {}))
+    with orm_session:
+        workflow(records)
+        if feed is not None:
+            session.add(feed)
+        if known_guids is not None and error_policy:
+            # failed records aren't known, so they are processed again when the feed changes
+            orm_session.flush()
+            guids = _stored_guids(guids)
+    if known_guids is not None:
+        known_guids.update(guids)
+    return orm_session.stats()
+
+
+def replay_dead_letters(session, cache=None, error_policy=None):
+    """Store records from `dead_letters` table again, records failing again are kept there.
+    Returns number of replayed records"""
+    table = DeadLetterTable('records')
+    with ORMSessionSQLAlchemy(session, cache=cache):
+        records = [letter.item for letter in table.pop_all()]
+        build_record_loader(**(error_policy or {'errors': 'skip'}))(records)
+    return len(records)
+
+
+def make_pool(workers=1, processes=0):
+    """Return executor fetching feeds for `poll`: pool of `processes` worker processes if it's > 0,
+    pool of `workers` threads otherwise"""
+    return ProcessPoolExecutor(max_workers=processes) if processes else ThreadPoolExecutor(max_workers=workers)
+
+
+def poll(urls, session, cache=None, workers=1, known_guids=None, scheduler=None, commit_policy=None, processes=0,
+         metrics=None, error_policy=None, pool=None):
+    """Fetch and parse `urls` concurrently by `workers` threads and store them into DB
+
+    Feeds are fetched and turned into records by `fetch_records` in worker threads, or in `processes`
+    worker processes if it's > 0, so parsing isn't limited by one core. Records are stored one by one
+    by the calling thread, which is the only DB writer, as soon as they are ready. At most two tasks
+    per worker are in flight, so memory held by not stored records is bounded. Cycle time is bounded
+    by the slowest feed instead of the sum of all feeds latencies.
+
+    Feeds not modified since the last stored version (by HTTP validators or content hash)
+    are skipped. Entries with `known_guids` are skipped as well. Errors of one feed are logged
+    and don't affect others. If `scheduler` is given, every polled feed is rescheduled by
+    whether it's changed, interval of failed feeds is kept. `commit_policy` and `error_policy` are passed
+    to `store_records`. Per feed timings, counters and errors are recorded to `metrics` (`RssMetrics`)
+    if it's given. Returns number of stored feeds.
+
+    `pool` is executor made by `make_pool` with the same `workers` and `processes`. Starting worker processes
+    takes time, so long running loops should make the pool once and pass it to every poll, otherwise
+    the pool is made and shut down by each call.
+    """
+    start = time.time()
+    feeds = load_feeds(urls, session)
+    stored = 0
+    tasks = [(url, feeds[url].etag, feeds[url].modified, feeds[url].content_hash) for url in urls]
+    own_pool = pool is None
+    if own_pool:
+        pool = make_pool(workers, processes)
+    try:
+        for task, future in _completed(pool, fetch_records, tasks, 2 * (processes or workers)):
+            url = task[0]
+            try:
+                changed = store_feed(url, future.result(), feeds[url], session, cache, known_guids, commit_policy,
+                                     metrics, error_policy)
+            except Exception:
+                logger.exception("Failed to poll '{}'".format(url))
+                changed = None
+                if metrics is not None:
+                    metrics.errors.inc(stage='feed')
+                    metrics.polls.inc(feed=url, status='error')
+            stored += bool(changed)
+            if scheduler is not None:
+                scheduler.reschedule(url, changed)
+                if metrics is not None:
+                    metrics.interval.set(scheduler.intervals[url], feed=url)
+    finally:
+        if own_pool:
+            pool.shutdown()
+    cycle_time = time.time() - start
+    if metrics is not None:
+        metrics.cycle_seconds.set(cycle_time)
+        if cache is not None:
+            metrics.observe_cache(cache)
+    logger.info('Polled {} feeds in {:.2f}s, {} changed'.format(len(urls), cycle_time, stored))
+    return stored
+
+
+def _completed(pool, func, tasks, limit):
+    """Yield (task, future) pairs as `func(*task)` calls are done, at most `limit` calls are submitted at once"""
+    tasks = iter(tasks)
+    pending = {pool.submit(func, *task): task for task in itertools.islice(tasks, limit)}
+    while pending:
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            yield pending.pop(future), future
+            task = next(tasks, None)
+            if task is not None:
+                pending[pool.submit(func, *task)] = task
+
+
+def store_feed(url, result, feed, session, cache=None, known_guids=None, commit_policy=None, metrics=None,
+               error_policy=None):
+    """Store `fetch_records` result unless it's the same as the last stored version of `feed`.
+    Returns True if it's stored, None if fetch failed. Validators of failed fetch aren't stored"""
+    if metrics is not None:
+        metrics.fetch_seconds.observe(result['fetch_time'], feed=url)
+        metrics.parse_seconds.observe(result['parse_time'], feed=url)
+        metrics.polls.inc(feed=url, status=result['status'])
+    if result['status'] == 'error':
+        logger.warning("Failed to fetch '{}': {}".format(url, result['error']))
+        if metrics is not None:
+            metrics.errors.inc(stage='fetch')
+        return None
+    if result['status'] != 'changed':
+        logger.info("Skip '{}': {}, fetch {:.2f}s".format(url, result['status'], result['fetch_time']))
+        return False
+    feed.etag = result['etag']
+    feed.modified = result['modified']
+    feed.content_hash = result['content_hash']
+    store_start = time.time()
+    stats = store_records(result['records'], session, cache, feed, known_guids, commit_policy, error_policy)
+    if metrics is not None:
+        metrics.extract_seconds.observe(result['extract_time'], feed=url)
+        metrics.store_seconds.observe(time.time() - store_start, feed=url)
+        metrics.entries.inc(len(result['records']), feed=url)
+        # posts are written by bulk upsert, which counts inserted rows
+        metrics.new_posts.inc(stats['inserted'], feed=url)
+        metrics.commits.inc(stats['commits'])
+        metrics.commit_seconds.inc(stats['commit_time'])
+        metrics.commit_max_seconds.set(stats['max_commit_time'])
+    logger.info("Parsed '{}': {} entries, fetch {:.2f}s, parse {:.2f}s, extract {:.2f}s, store {:.2f}s".format(
+        url, len(result['records']), result['fetch_time'], result['parse_time'], result['extract_time'],
+        time.time() - store_start))
+    return True
@@ -0,0 +1,89 @@
+import hashlib
+import math
+
+
+class BloomFilter:
+    """Probabilistic set of strings with bounded memory
+
+    `in` check has no false negatives, false positives probability is about `error_rate`
+    while number of added elements doesn't exceed `capacity`.
+    """
+    def __init__(self, capacity, error_rate=0.001):
+        """
+        Parameters
+        ----------
+        capacity : int - expected number of elements
+        error_rate : float - desired probability of false positives
+        """
+        if capacity < 1:
+            raise ValueError('capacity should be > 0 (got: {})'.format(capacity))
+        if not 0 < error_rate < 1:
+            raise ValueError('error_rate should be in (0, 1) (got: {})'.format(error_rate))
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, int(round(self.size / capacity * math.log(2))))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def add(self, value):
+        for index in self._indexes(value):
+            self.bits[index >> 3] |= 1 << (index & 7)
+
+    def __contains__(self, value):
+        return all(self.bits[index >> 3] & (1 << (index & 7)) for index in self._indexes(value))
+
+    def _indexes(self, value):
+        # double hashing: i-th hash is h1 + i * h2
+        digest = hashlib.blake2b(value.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+
+class KnownGuids:
+    """KnownGuids holds guids of already stored posts to drop known feed entries before any processing
+
+    By default guids are kept in a set. With `bloom_capacity` they are kept in `BloomFilter`, then
+    possibly known guids are confirmed by `confirm` callable (usually DB query), so new entries are never dropped.
+    """
+    def __init__(self, bloom_capacity=None, error_rate=0.001):
+        """
+        Parameters
+        ----------
+        bloom_capacity : int - expected number of guids, if not None then Bloom filter is used instead of set
+        error_rate : float - false positives probability of Bloom filter
+        """
+        self.guids = BloomFilter(bloom_capacity, error_rate) if bloom_capacity else set()
+        self.exact = not bloom_capacity
+
+    def update(self, guids):
+        """Add `guids` to known ones"""
+        for guid in guids:
+            if guid is not None:
+                self.guids.add(guid)
+
+    def warm(self, session, model, field='guid', batch_size=10000):
+        """Load all values of `model.field` from DB by SQLAlchemy `session`"""
+        column = getattr(model, field)
+        self.update(guid for guid, in session.query(column).yield_per(batch_size))
+
+    def __contains__(self, guid):
+        return guid in self.guids
+
+    def filter_new(self, entries, confirm=None, key='id'):
+        """
+        Return entries with unknown guids keeping their order
+
+        Parameters
+        ----------
+        entries : list of dicts - feed entries
+        confirm : callable - takes list of possibly known guids and returns set of really known ones.
+            Used only with Bloom filter, if None then possibly known entries are treated as new ones
+        key : str - entry field with guid
+        """
+        maybe_known = [entry.get(key) for entry in entries if entry.get(key) is not None and entry.get(key) in self]
+        if self.exact:
+            known = set(maybe_known)
+        elif maybe_known and confirm is not None:
+            known = confirm(maybe_known)
+        else:
+            known = set()
+        return [entry for entry in entries if entry.get(key) not in known]
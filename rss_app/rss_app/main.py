@@ -1,14 +1,12 @@
 import argparse
-import feedparser
+from concurrent.futures import BrokenExecutor
+import contextlib
+import importlib
 import logging
-from flow import ORMSessionSQLAlchemy
-from flow.plot import ActionsPlotter
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
 import sys
 import time
-from .model import Base
-from .workflow import feed_extractor
+from .known import KnownGuids
+from .scheduler import FeedScheduler
 
 
 logging.basicConfig(stream=sys.stdout, level=logging.INFO,
@@ -24,10 +22,42 @@ def parse_args():
     ]
     parser = argparse.ArgumentParser(description='periodically parse rss feeds to database',
                                      formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('command', nargs='?', default='run', choices=['run', 'upgrade'],
+                        help="'run' polls feeds, 'upgrade' migrates database of previous version in place")
     parser.add_argument('--db', type=str, default='sqlite:///db.sqlite', help='db url')
-    parser.add_argument('-p', '--period', type=int, default=1, help='fequency of fetching new feeds, in munutes')
+    parser.add_argument('-p', '--period', type=int, default=1, help='initial period of fetching every feed, in munutes')
+    parser.add_argument('--min-period', type=int, default=1,
+                        help='min period of fetching feed, period shrinks for feeds with new content, in munutes')
+    parser.add_argument('--max-period', type=int, default=60,
+                        help='max period of fetching feed, period grows for feeds without new content, in munutes')
+    parser.add_argument('--jitter', type=float, default=0.1, help='max relative random shift of feed fetching time')
     parser.add_argument('--rss', type=str, default=default_rss, action='append', help='rss urls to parse')
     parser.add_argument('-g', '--graph', type=str, default='', help='path where to save flow graph')
+    parser.add_argument('--cache-size', type=int, default=10000,
+                        help='max number of users and tags cached between polls, 0 disables cache')
+    parser.add_argument('--profile', action='store_true', help='log per action timings of the workflow every poll')
+    parser.add_argument('-w', '--workers', type=int, default=8, help='number of feeds fetched concurrently')
+    parser.add_argument('--processes', type=int, default=0,
+                        help='number of worker processes fetching and parsing feeds, 0 means use worker threads')
+    parser.add_argument('--commit-every', type=int, default=0,
+                        help='commit every given number of stored objects, 0 means commit once per feed')
+    parser.add_argument('--commit-interval', type=float, default=0,
+                        help='commit every given number of seconds, 0 means commit once per feed')
+    parser.add_argument('--expunge', action='store_true',
+                        help='remove committed objects from the session to keep memory flat')
+    parser.add_argument('--skip-known', action='store_true',
+                        help="drop entries of already stored posts before processing, updates of stored posts are lost")
+    parser.add_argument('--bloom-capacity', type=int, default=0,
+                        help='keep known guids in Bloom filter of given capacity instead of set, 0 means set')
+    parser.add_argument('--errors', type=str, default='skip', choices=['raise', 'skip', 'retry'],
+                        help="how entries failed to be stored are handled: 'raise' fails the whole feed, "
+                        "'skip' and 'retry' save them to dead_letters table and store the rest")
+    parser.add_argument('--retries', type=int, default=3, help="max number of retries of failed entry in 'retry' mode")
+    parser.add_argument('--replay-dead-letters', action='store_true',
+                        help='try to store entries from dead_letters table on start')
+    parser.add_argument('--metrics-port', type=int, default=0,
+                        help='serve metrics in Prometheus text format on given port, 0 disables metrics')
+    parser.add_argument('--metrics-host', type=str, default='127.0.0.1', help='address to serve metrics on')
     return parser.parse_args()
 
 
@@ -39,35 +69,103 @@ def complete_args(settings):
 def validate_args(settings):
     if settings.period < 1:
         raise ValueError('period should be > 0 (got: {})'.format(settings.period))
+    if not 0 < settings.min_period <= settings.period <= settings.max_period:
+        raise ValueError('expected 0 < min period <= period <= max period (got: {}, {}, {})'.format(
+            settings.min_period, settings.period, settings.max_period))
+    if not 0 <= settings.jitter < 1:
+        raise ValueError('jitter should be in [0, 1) (got: {})'.format(settings.jitter))
     if not settings.rss:
         raise ValueError('rss list is empty')
     if not settings.db:
         raise ValueError('db url is empty')
+    if settings.workers < 1:
+        raise ValueError('workers should be > 0 (got: {})'.format(settings.workers))
+    if settings.cache_size < 0:
+        raise ValueError('cache size should be >= 0 (got: {})'.format(settings.cache_size))
+    if settings.processes < 0:
+        raise ValueError('processes should be >= 0 (got: {})'.format(settings.processes))
+    if settings.commit_every < 0:
+        raise ValueError('commit every should be >= 0 (got: {})'.format(settings.commit_every))
+    if settings.commit_interval < 0:
+        raise ValueError('commit interval should be >= 0 (got: {})'.format(settings.commit_interval))
+    if settings.bloom_capacity < 0:
+        raise ValueError('bloom capacity should be >= 0 (got: {})'.format(settings.bloom_capacity))
+    if settings.retries < 0:
+        raise ValueError('retries should be >= 0 (got: {})'.format(settings.retries))
+    if not 0 <= settings.metrics_port < 65536:
+        raise ValueError('metrics port should be in [0, 65536) (got: {})'.format(settings.metrics_port))
 
 
 def print_args(settings):
     logger.info('Parameters:')
     logger.info('\tdb: {}'.format(settings.db))
-    logger.info('\tperiod: {} minutes'.format(settings.period))
+    logger.info('\tperiod: {} minutes ({} - {})'.format(settings.period, settings.min_period, settings.max_period))
+    logger.info('\tjitter: {}'.format(settings.jitter))
     logger.info('\trss:')
     for url in settings.rss:
         logger.info('\t - {}'.format(url))
     logger.info('\tgraph: {}'.format(settings.graph if settings.graph else 'no set'))
+    logger.info('\tcache size: {}'.format(settings.cache_size))
+    logger.info('\tprofile: {}'.format(settings.profile))
+    logger.info('\tworkers: {}'.format(settings.workers))
+    logger.info('\tprocesses: {}'.format(settings.processes if settings.processes else 'no set'))
+    logger.info('\tcommit every: {}'.format(settings.commit_every if settings.commit_every else 'no set'))
+    logger.info('\tcommit interval: {}'.format(settings.commit_interval if settings.commit_interval else 'no set'))
+    logger.info('\texpunge: {}'.format(settings.expunge))
+    logger.info('\tskip known: {}'.format(settings.skip_known))
+    if settings.skip_known:
+        logger.info('\tbloom capacity: {}'.format(settings.bloom_capacity if settings.bloom_capacity else 'no set'))
+    logger.info('\terrors: {}'.format(settings.errors if settings.errors != 'retry' else
+                                      'retry {} times'.format(settings.retries)))
+    logger.info('\tmetrics: {}'.format('{}:{}'.format(settings.metrics_host, settings.metrics_port)
+                                       if settings.metrics_port else 'no set'))
 
 
-def parse_rss(url, session):
-    logger.info("Parse '{}'".format(url))
-    rss_document = feedparser.parse(url)
-    with ORMSessionSQLAlchemy(session):
-        feed_extractor(rss_document)
+# feeds fetching and storing functions, they are imported on first use, since their dependencies
+# (sqlalchemy, feedparser, workflows) make startup slow for commands like `rss_app -h`
+_feeds_names = ['download', 'parse_content', 'fetch_rss', 'content_hash', 'store_rss', 'store_stream', 'parse_rss',
+                'load_feeds', 'fetch_records', 'store_records', 'replay_dead_letters', 'make_pool', 'poll',
+                'store_feed']
+
+
+def __getattr__(name):
+    if name not in _feeds_names:
+        raise AttributeError("module '{}' has no attribute '{}'".format(__name__, name))
+    return getattr(importlib.import_module('.feeds', __package__), name)
+
+
+def upgrade_db(settings):
+    from sqlalchemy import create_engine
+    from .upgrade import upgrade
+
+    logger.info("Upgrade database '{}'".format(settings.db))
+    stats = upgrade(create_engine(settings.db))
+    logger.info('Merged {} duplicate users and {} duplicate tags'.format(stats['merged_users'], stats['merged_tags']))
+    logger.info('Created indexes: {}'.format(', '.join(stats['created_indexes']) or 'none'))
 
 
 def main():
     settings = parse_args()
+    if settings.command == 'upgrade':
+        if not settings.db:
+            raise ValueError('db url is empty')
+        upgrade_db(settings)
+        return
     complete_args(settings)
     print_args(settings)
     validate_args(settings)
 
+    # heavy dependencies are imported once arguments are parsed, so `rss_app -h` starts fast
+    from flow import LRUCache, Profiler
+    from flow.plot import ActionsPlotter
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from .feeds import make_pool, poll, replay_dead_letters
+    from .metrics import RssMetrics, serve
+    from .model import Base, Post
+    from .upgrade import missing_indexes
+    from .workflow import feed_extractor
+
     if settings.graph:
         logger.info("Dumping graph to '{}.pdf'".format(settings.graph))
         ActionsPlotter().plot(feed_extractor, settings.graph)
@@ -76,23 +174,78 @@ def main():
     engine = create_engine(settings.db)
     Session = sessionmaker(bind=engine)
     Base.metadata.create_all(engine)
-
+    if missing_indexes(engine):
+        logger.warning("Database is created by previous version, run 'rss_app upgrade --db {}' "
+                       "to create indexes".format(settings.db))
+
+    cache = LRUCache(maxsize=settings.cache_size) if settings.cache_size else None
+
+    known_guids = None
+    if settings.skip_known:
+        known_guids = KnownGuids(bloom_capacity=settings.bloom_capacity)
+        start = time.time()
+        session = Session()
+        known_guids.warm(session, Post)
+        session.close()
+        logger.info('Known guids are loaded in {:.2f}s'.format(time.time() - start))
+
+    commit_policy = {
+        'commit_every': settings.commit_every or None,
+        'commit_interval': settings.commit_interval or None,
+        'expunge': settings.expunge,
+    }
+
+    error_policy = {'errors': settings.errors, 'retries': settings.retries} if settings.errors != 'raise' else None
+    if settings.replay_dead_letters:
+        session = Session()
+        count = replay_dead_letters(session, cache, error_policy)
+        session.close()
+        logger.info('Replayed {} dead letters'.format(count))
+
+    metrics = None
+    if settings.metrics_port:
+        metrics = RssMetrics()
+        metrics.period_seconds.set(settings.period * 60)
+        serve(metrics, settings.metrics_port, settings.metrics_host)
+        logger.info('Serve metrics on http://{}:{}/metrics'.format(settings.metrics_host, settings.metrics_port))
+
+    scheduler = FeedScheduler(settings.rss, settings.period * 60, settings.min_period * 60,
+                              settings.max_period * 60, settings.jitter)
+    # worker threads or processes are started once and reused by every poll
+    pool = make_pool(settings.workers, settings.processes)
     logger.info('Start loop')
-    last_parse_timestamp = 0
     while True:
+        urls = []
         try:
-            current_time = int(time.time())
-            if last_parse_timestamp + settings.period * 60 < current_time:
+            urls = scheduler.pop_due()
+            if urls:
                 session = Session()
-                for url in settings.rss:
-                    parse_rss(url, session)
-                last_parse_timestamp = current_time
-            time.sleep(1)
+                profiler = Profiler() if settings.profile else None
+                with profiler if profiler is not None else contextlib.nullcontext():
+                    poll(urls, session, cache, settings.workers, known_guids, scheduler, commit_policy,
+                         settings.processes, metrics, error_policy, pool)
+                session.close()
+                if profiler is not None:
+                    logger.info('Workflow profile:\n{}'.format(profiler.table()))
+                if cache is not None:
+                    logger.info('Cache stats: {}'.format(cache.stats()))
+            # sleep until the next due feed
+            time.sleep(scheduler.sleep_time())
         except (SystemExit, KeyboardInterrupt):
             break
-        except Exception:
+        except Exception as exception:
             logger.exception('error:')
+            if isinstance(exception, BrokenExecutor):
+                # worker process died, pool doesn't accept tasks anymore
+                pool = make_pool(settings.workers, settings.processes)
+            if metrics is not None:
+                metrics.errors.inc(stage='loop')
+            # feeds not polled because of error are retried later with the same interval
+            for url in urls:
+                if url not in scheduler:
+                    scheduler.reschedule(url, changed=None)
             time.sleep(10)
+    pool.shutdown(cancel_futures=True)
     logger.info('Stop loop')
 
 
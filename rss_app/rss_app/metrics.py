@@ -0,0 +1,211 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+
+
+class Metric:
+    """Base of metrics with values per labels set, they are rendered in Prometheus text format"""
+    type = 'untyped'
+
+    def __init__(self, name, help, lock):
+        """
+        Parameters
+        ----------
+        name : str - metric name
+        help : str - metric description
+        lock : threading.Lock - lock of `Metrics` registry, values are changed and rendered under it
+        """
+        self.name = name
+        self.help = help
+        self._lock = lock
+        # tuple of sorted (label, value) pairs -> value
+        self._values = {}
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.help), '# TYPE {} {}'.format(self.name, self.type)]
+        for labels, value in sorted(self._values.items()):
+            lines.extend(self._render_value(labels, value))
+        return lines
+
+    def _render_value(self, labels, value):
+        return ['{}{} {}'.format(self.name, _format_labels(labels), _format_value(value))]
+
+
+class Counter(Metric):
+    """Counter only grows, it's increased by `inc` or set to total maintained elsewhere by `set`"""
+    type = 'counter'
+
+    def inc(self, value=1, **labels):
+        key = _labels_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[_labels_key(labels)] = value
+
+    def value(self, **labels):
+        return self._values.get(_labels_key(labels), 0)
+
+
+class Gauge(Counter):
+    """Gauge is value which can go up and down"""
+    type = 'gauge'
+
+
+class Histogram(Metric):
+    """Histogram counts observed values in cumulative buckets, their sum and count"""
+    type = 'histogram'
+    default_buckets = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self, name, help, lock, buckets=None):
+        super(Histogram, self).__init__(name, help, lock)
+        self.buckets = sorted(buckets if buckets is not None else self.default_buckets)
+
+    def observe(self, value, **labels):
+        key = _labels_key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # counts per bucket (the last one is +Inf), sum of values
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            counts = state[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[-1] += 1
+            state[1] += value
+
+    def count(self, **labels):
+        state = self._values.get(_labels_key(labels))
+        return sum(state[0]) if state is not None else 0
+
+    def _render_value(self, labels, state):
+        counts, total = state
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + ['+Inf'], counts):
+            cumulative += count
+            bucket_labels = labels + (('le', _format_value(bound)),)
+            lines.append('{}_bucket{} {}'.format(self.name, _format_labels(bucket_labels), cumulative))
+        lines.append('{}_sum{} {}'.format(self.name, _format_labels(labels), _format_value(total)))
+        lines.append('{}_count{} {}'.format(self.name, _format_labels(labels), cumulative))
+        return lines
+
+
+class Metrics:
+    """Registry of metrics rendered in Prometheus text exposition format
+
+    Example
+    -------
+    > metrics = Metrics()
+    > polls = metrics.counter('polls_total', 'Number of polls')
+    > polls.inc(feed='https://habr.com/rss/hubs/all/')
+    > server = serve(metrics, port=9100)
+    """
+    def __init__(self):
+        self.metrics = []
+        self._lock = threading.Lock()
+
+    def counter(self, name, help):
+        return self._add(Counter(name, help, self._lock))
+
+    def gauge(self, name, help):
+        return self._add(Gauge(name, help, self._lock))
+
+    def histogram(self, name, help, buckets=None):
+        return self._add(Histogram(name, help, self._lock, buckets))
+
+    def render(self):
+        """Return all metrics in Prometheus text format"""
+        with self._lock:
+            lines = [line for metric in self.metrics for line in metric.render()]
+        return '\n'.join(lines) + '\n'
+
+    def _add(self, metric):
+        if any(m.name == metric.name for m in self.metrics):
+            raise ValueError("metric '{}' is already registered".format(metric.name))
+        self.metrics.append(metric)
+        return metric
+
+
+class RssMetrics(Metrics):
+    """Metrics of rss_app polling loop"""
+    def __init__(self):
+        super(RssMetrics, self).__init__()
+        self.fetch_seconds = self.histogram('rss_feed_fetch_seconds', 'Time of feed download')
+        self.parse_seconds = self.histogram('rss_feed_parse_seconds', 'Time of feed parsing by feedparser')
+        self.extract_seconds = self.histogram('rss_feed_extract_seconds', 'Time of turning feed entries into records')
+        self.store_seconds = self.histogram('rss_feed_store_seconds', 'Time of storing feed records into DB')
+        self.entries = self.counter('rss_feed_entries_total', 'Number of entries of changed feeds')
+        self.new_posts = self.counter('rss_feed_new_posts_total', 'Number of inserted posts')
+        self.polls = self.counter('rss_feed_polls_total', 'Number of feed polls by result')
+        self.interval = self.gauge('rss_feed_interval_seconds', 'Current poll interval of feed')
+        self.cache_hits = self.counter('rss_cache_hits_total', 'Number of get_or_create lookups found in cache')
+        self.cache_misses = self.counter('rss_cache_misses_total', 'Number of get_or_create lookups missed cache')
+        # ORM session keeps total and max commit latency only, so there is no histogram of commits
+        self.commits = self.counter('rss_commits_total', 'Number of DB commits')
+        self.commit_seconds = self.counter('rss_commit_seconds_total', 'Total latency of DB commits')
+        self.commit_max_seconds = self.gauge('rss_commit_max_seconds', 'Max commit latency of the last stored feed')
+        self.cycle_seconds = self.gauge('rss_poll_cycle_seconds', 'Duration of the last poll cycle')
+        self.period_seconds = self.gauge('rss_poll_period_seconds', 'Configured poll period')
+        self.errors = self.counter('rss_errors_total', 'Number of errors by stage: fetch, feed or loop')
+
+    def observe_cache(self, cache):
+        """Mirror hits and misses counters of `LRUCache`"""
+        self.cache_hits.set(cache.hits)
+        self.cache_misses.set(cache.misses)
+
+
+def serve(metrics, port, host='127.0.0.1'):
+    """Serve `metrics` by HTTP in a daemon thread. Returns server, call its `shutdown` to stop it
+
+    Parameters
+    ----------
+    metrics : Metrics - served metrics
+    port : int - port to listen, 0 means any free port (see `server.server_port`)
+    host : str - address to listen, metrics are served locally by default
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] not in ('/', '/metrics'):
+                self.send_error(404)
+                return
+            body = metrics.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # scrapes aren't logged
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name='metrics', daemon=True)
+    thread.start()
+    return server
+
+
+def _labels_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, _escape(value)) for name, value in labels) + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value):
+    if isinstance(value, float) and value.is_integer():
+        return '{:.1f}'.format(value)
+    return repr(value) if isinstance(value, float) else str(value)
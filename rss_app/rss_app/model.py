@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Table, ForeignKey
+from sqlalchemy import Column, Integer, String, DateTime, Table, ForeignKey, Index, PickleType, Text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 
@@ -9,7 +9,8 @@ class User(Base):
     __tablename__ = 'users'
 
     id = Column(Integer, primary_key=True)
-    name = Column(String, nullable=False)
+    # natural key looked up by `ModelObjectCreate(unique=['name'])`
+    name = Column(String, nullable=False, unique=True, index=True)
 
     posts = relationship("Post", back_populates="user")
 
@@ -24,7 +25,7 @@ class Tag(Base):
     __tablename__ = 'tags'
 
     id = Column(Integer, primary_key=True)
-    name = Column(String, nullable=False)
+    name = Column(String, nullable=False, unique=True, index=True)
 
     post = relationship("Post", secondary=lambda: post_tags_table, back_populates="tags")
 
@@ -40,7 +41,7 @@ class Post(Base):
     guid = Column(String, unique=True)
     title = Column(String)
     link = Column(String)
-    date = Column(DateTime)
+    date = Column(DateTime, index=True)
     user_id = Column(Integer, ForeignKey('users.id'))
 
     tags = relationship("Tag", secondary=lambda: post_tags_table, back_populates="post")
@@ -50,7 +51,39 @@ class Post(Base):
         return "<Tag(id={}, name='{}'".format(self.id, self.name)
 
 
+class Feed(Base):
+    """Feed holds HTTP validators and content hash of the last stored version of rss feed"""
+    __tablename__ = 'feeds'
+
+    id = Column(Integer, primary_key=True)
+    url = Column(String, nullable=False, unique=True)
+    etag = Column(String)
+    modified = Column(String)
+    content_hash = Column(String)
+
+    def __repr__(self):
+        return "<Feed(id={}, url='{}')>".format(self.id, self.url)
+
+
+class DeadLetter(Base):
+    """DeadLetter holds element failed by workflow, so it could be replayed later"""
+    __tablename__ = 'dead_letters'
+
+    id = Column(Integer, primary_key=True)
+    stage = Column(String, nullable=False)
+    node = Column(String)
+    error = Column(Text)
+    traceback = Column(Text)
+    item = Column(PickleType)
+    created = Column(DateTime)
+
+    def __repr__(self):
+        return "<DeadLetter(id={}, stage='{}', error='{}')>".format(self.id, self.stage, self.error)
+
+
 post_tags_table = Table('post_tags',
                         Base.metadata,
                         Column('post_id', Integer, ForeignKey("posts.id"), primary_key=True),
-                        Column('tag_id', Integer, ForeignKey("tags.id"), primary_key=True))
+                        Column('tag_id', Integer, ForeignKey("tags.id"), primary_key=True),
+                        # primary key serves lookups by post, posts of tag are found by this one
+                        Index('ix_post_tags_tag_id', 'tag_id', 'post_id'))
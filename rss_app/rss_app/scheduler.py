@@ -0,0 +1,117 @@
+import heapq
+import random
+import time
+
+
+class FeedScheduler:
+    """FeedScheduler keeps next poll time of every feed in a heap
+
+    Poll interval of each feed adapts to how often the feed changes: it's shrunk when a poll finds
+    new content and grown when it doesn't, staying within [`min_period`, `max_period`].
+    First polls are spread uniformly over `period` and every next one is jittered, so feeds
+    don't hit DB in one burst.
+
+    Example
+    -------
+    > scheduler = FeedScheduler(urls, period=60, min_period=60, max_period=3600)
+    > while True:
+    >     for url in scheduler.pop_due():
+    >         scheduler.reschedule(url, changed=poll_feed(url))
+    >     time.sleep(scheduler.sleep_time())
+    """
+    # interval multipliers applied after poll with and without new content
+    speedup = 0.5
+    slowdown = 1.5
+
+    def __init__(self, urls, period, min_period=None, max_period=None, jitter=0.1, clock=time.time, rand=None):
+        """
+        Parameters
+        ----------
+        urls : list - feeds to schedule
+        period : float - initial poll interval, in seconds
+        min_period : float - lower bound of poll interval, `period` if None
+        max_period : float - upper bound of poll interval, `period` if None
+        jitter : float - max relative random shift of poll time
+        clock : callable - returns current time in seconds
+        rand : random.Random - source of jitter
+        """
+        min_period = period if min_period is None else min_period
+        max_period = period if max_period is None else max_period
+        if not 0 < min_period <= period <= max_period:
+            raise ValueError('expected 0 < min_period <= period <= max_period (got: {}, {}, {})'.format(
+                min_period, period, max_period))
+        if not 0 <= jitter < 1:
+            raise ValueError('jitter should be in [0, 1) (got: {})'.format(jitter))
+        self.min_period = min_period
+        self.max_period = max_period
+        self.jitter = jitter
+        self.clock = clock
+        self.rand = rand if rand is not None else random.Random()
+        self.intervals = {}
+        # url -> next poll time of scheduled urls
+        self.next_times = {}
+        self._heap = []
+        # breaks ties of equal poll times, so urls are never compared
+        self._counter = 0
+        now = self.clock()
+        for url in urls:
+            if url in self.intervals:
+                continue
+            self.intervals[url] = period
+            self._push(url, now + self.rand.uniform(0, period))
+
+    def pop_due(self, now=None):
+        """Remove from schedule and return urls which poll time has come, the earliest first.
+
+        Every returned url should be put back by `reschedule`
+        """
+        now = self.clock() if now is None else now
+        urls = []
+        while self._heap and self._heap[0][0] <= now:
+            url = heapq.heappop(self._heap)[2]
+            del self.next_times[url]
+            urls.append(url)
+        return urls
+
+    def reschedule(self, url, changed, now=None):
+        """Adapt poll interval of `url` by poll result and schedule next poll
+
+        Parameters
+        ----------
+        url : str - polled feed
+        changed : bool - whether the poll found new content, None means the poll failed and interval is kept
+        now : float - poll time, `clock()` if None
+        """
+        if url in self.next_times:
+            raise ValueError("'{}' is already scheduled".format(url))
+        now = self.clock() if now is None else now
+        interval = self.intervals[url]
+        if changed is not None:
+            interval = interval * (self.speedup if changed else self.slowdown)
+            interval = min(self.max_period, max(self.min_period, interval))
+            self.intervals[url] = interval
+        self._push(url, now + interval * (1 + self.rand.uniform(-self.jitter, self.jitter)))
+
+    def next_time(self):
+        """Return the earliest poll time, None if there is nothing scheduled"""
+        return self._heap[0][0] if self._heap else None
+
+    def sleep_time(self, now=None):
+        """Return seconds to wait until the next due feed"""
+        next_time = self.next_time()
+        if next_time is None:
+            return self.min_period
+        now = self.clock() if now is None else now
+        return max(0.0, next_time - now)
+
+    def __contains__(self, url):
+        """Whether `url` is scheduled, i.e. it isn't popped by `pop_due`"""
+        return url in self.next_times
+
+    def __len__(self):
+        return len(self._heap)
+
+    def _push(self, url, due):
+        self.next_times[url] = due
+        self._counter += 1
+        heapq.heappush(self._heap, (due, self._counter, url))
@@ -0,0 +1,143 @@
+from datetime import datetime, timezone
+import email.utils
+import itertools
+import urllib.request
+import xml.etree.ElementTree as ET
+
+# seconds to wait for connection and every read of feed downloaded by url
+TIMEOUT = 30
+
+
+def iter_entries(source, chunk_size=1 << 16, timeout=TIMEOUT):
+    """Parse RSS or Atom feed incrementally and yield its entries as soon as they are read
+
+    Entries are dicts with the same keys as `feedparser` entries used by `feed_extractor`: 'id', 'title',
+    'link', 'author', 'tags' (list of {'term': ...} dicts) and 'published_parsed' / 'updated_parsed'
+    (`time.struct_time` in UTC). Only `chunk_size` bytes of the document and the current entry are held
+    in memory, elements of yielded entries are dropped.
+
+    Parameters
+    ----------
+    source : str or file object - url, path or binary file object of the feed
+    chunk_size : int - number of bytes read from `source` at once
+    timeout : float - seconds to wait for connection and every read if `source` is url
+    """
+    with _open(source, timeout) as f:
+        parser = ET.XMLPullParser(events=('start', 'end'))
+        # path of opened elements, used to detach parsed entries from their parents
+        path = []
+        while True:
+            chunk = f.read(chunk_size)
+            if chunk:
+                parser.feed(chunk)
+            else:
+                parser.close()
+            for event, element in parser.read_events():
+                if event == 'start':
+                    path.append(element)
+                    continue
+                path.pop()
+                if _local_name(element.tag) in ('item', 'entry') and path:
+                    yield _entry(element)
+                    path[-1].remove(element)
+            if not chunk:
+                break
+
+
+def iter_batches(entries, batch_size):
+    """Split `entries` into lists of at most `batch_size` elements"""
+    entries = iter(entries)
+    while True:
+        batch = list(itertools.islice(entries, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def iter_documents(source, batch_size=100, chunk_size=1 << 16, timeout=TIMEOUT):
+    """Yield feed documents with at most `batch_size` entries each, which could be passed to `feed_extractor`
+
+    See `iter_entries` for `source`, `chunk_size` and `timeout` arguments
+    """
+    for batch in iter_batches(iter_entries(source, chunk_size, timeout), batch_size):
+        yield {'entries': batch}
+
+
+def _open(source, timeout):
+    if not isinstance(source, str):
+        return _NotClosing(source)
+    if source.startswith(('http://', 'https://')):
+        return urllib.request.urlopen(source, timeout=timeout)
+    return open(source, 'rb')
+
+
+class _NotClosing:
+    """Context manager of file object passed by user, which is closed by user as well"""
+    def __init__(self, f):
+        self.f = f
+
+    def __enter__(self):
+        return self.f
+
+    def __exit__(self, *args):
+        pass
+
+
+def _local_name(tag):
+    # '{namespace}name' -> 'name'
+    return tag.rsplit('}', 1)[-1]
+
+
+def _text(element):
+    return (element.text or '').strip()
+
+
+def _entry(element):
+    """Turn RSS <item> or Atom <entry> element into feedparser-like dict"""
+    entry = {'tags': []}
+    for child in element:
+        name = _local_name(child.tag)
+        if name == 'title':
+            entry['title'] = _text(child)
+        elif name in ('guid', 'id'):
+            entry['id'] = _text(child)
+        elif name == 'link':
+            # Atom links are attributes, the alternate one is the link of entry
+            if 'href' in child.attrib:
+                if child.get('rel', 'alternate') == 'alternate':
+                    entry['link'] = child.get('href')
+            else:
+                entry['link'] = _text(child)
+        elif name == 'author':
+            names = [_text(el) for el in child if _local_name(el.tag) == 'name']
+            entry['author'] = names[0] if names else _text(child)
+        elif name == 'creator':
+            entry['author'] = _text(child)
+        elif name == 'category':
+            term = child.get('term') or _text(child)
+            # like feedparser, repeated categories are listed once
+            if term and {'term': term} not in entry['tags']:
+                entry['tags'].append({'term': term})
+        elif name in ('pubDate', 'published', 'date', 'updated'):
+            # like feedparser, malformed dates are omitted
+            date = _parse_date(_text(child))
+            if date is not None:
+                entry['updated_parsed' if name == 'updated' else 'published_parsed'] = date
+    # like feedparser, entries without guid are identified by link
+    if 'id' not in entry and 'link' in entry:
+        entry['id'] = entry['link']
+    return entry
+
+
+def _parse_date(value):
+    """Parse RFC 822 (RSS) or ISO 8601 (Atom) date to UTC `time.struct_time`, None if it's malformed"""
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        try:
+            date = datetime.fromisoformat(value)
+        except ValueError:
+            return None
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return date.utctimetuple()
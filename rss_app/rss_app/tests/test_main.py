@@ -0,0 +1,19 @@
+import os
+import subprocess
+import sys
+import unittest
+from .. import feeds, main
+
+
+class LazyImportTest(unittest.TestCase):
+    def test_lazy(self):
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join([p for p in sys.path if p]))
+        code = 'import sys\nimport rss_app.main\nprint(" ".join(sys.modules))'
+        modules = set(subprocess.check_output([sys.executable, '-c', code], env=env).decode('utf-8').split())
+        for name in ['sqlalchemy', 'feedparser', 'graphviz', 'flow.action', 'rss_app.workflow']:
+            self.assertNotIn(name, modules)
+
+    def test_feeds_names(self):
+        self.assertIs(feeds.poll, main.poll)
+        with self.assertRaises(AttributeError):
+            main.no_such_function
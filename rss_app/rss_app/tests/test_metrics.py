@@ -0,0 +1,92 @@
+import os
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+import unittest
+import urllib.error
+import urllib.request
+from flow import LRUCache
+from .. import feeds
+from ..main import poll
+from ..metrics import Metrics, RssMetrics, serve
+from ..model import Base
+
+
+class MetricsTest(unittest.TestCase):
+    def test_render(self):
+        metrics = Metrics()
+        polls = metrics.counter('polls_total', 'Number of polls')
+        latency = metrics.histogram('latency_seconds', 'Latency', buckets=[0.5, 1])
+        metrics.gauge('period_seconds', 'Period').set(60)
+        polls.inc(feed='a"b')
+        polls.inc(2, feed='a"b')
+        for value in [0.1, 0.7, 5]:
+            latency.observe(value)
+        self.assertEqual(
+            '# HELP polls_total Number of polls\n'
+            '# TYPE polls_total counter\n'
+            'polls_total{feed="a\\"b"} 3\n'
+            '# HELP latency_seconds Latency\n'
+            '# TYPE latency_seconds histogram\n'
+            'latency_seconds_bucket{le="0.5"} 1\n'
+            'latency_seconds_bucket{le="1"} 2\n'
+            'latency_seconds_bucket{le="+Inf"} 3\n'
+            'latency_seconds_sum 5.8\n'
+            'latency_seconds_count 3\n'
+            '# HELP period_seconds Period\n'
+            '# TYPE period_seconds gauge\n'
+            'period_seconds 60\n', metrics.render())
+        with self.assertRaises(ValueError):
+            metrics.counter('polls_total', 'Number of polls')
+
+    def test_serve(self):
+        metrics = Metrics()
+        metrics.counter('polls_total', 'Number of polls').inc()
+        server = serve(metrics, port=0)
+        try:
+            url = 'http://127.0.0.1:{}'.format(server.server_port)
+            with urllib.request.urlopen(url + '/metrics') as response:
+                self.assertEqual(metrics.render(), response.read().decode('utf-8'))
+            with self.assertRaises(urllib.error.HTTPError):
+                urllib.request.urlopen(url + '/other')
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_poll(self):
+        engine = create_engine('sqlite:///:memory:')
+        Session = sessionmaker(bind=engine)
+        Base.metadata.create_all(engine)
+
+        urls = [os.path.join(os.path.dirname(__file__), 'data', filename)
+                for filename in ['habr_part1.xml', 'habr_part2.xml']]
+        broken = 'http://example.com/rss'
+        metrics = RssMetrics()
+        cache = LRUCache()
+        poll(urls[:1], Session(), cache, metrics=metrics)
+
+        original_download = feeds.download
+
+        def download(url, etag=None, modified=None):
+            if url == broken:
+                raise IOError('connection refused')
+            return original_download(url, etag, modified)
+
+        feeds.download = download
+        try:
+            poll(urls + [broken], Session(), cache, metrics=metrics)
+        finally:
+            feeds.download = original_download
+        # the first feed has a repeated entry
+        self.assertEqual(5, metrics.entries.value(feed=urls[0]))
+        self.assertEqual(4, metrics.new_posts.value(feed=urls[0]))
+        # the second feed has one new post
+        self.assertEqual(3, metrics.entries.value(feed=urls[1]))
+        self.assertEqual(1, metrics.new_posts.value(feed=urls[1]))
+        self.assertEqual(2, metrics.fetch_seconds.count(feed=urls[0]))
+        self.assertEqual(2, metrics.parse_seconds.count(feed=urls[0]))
+        self.assertEqual(1, metrics.polls.value(feed=urls[0], status='same content'))
+        self.assertEqual(1, metrics.errors.value(stage='feed'))
+        self.assertEqual(2, metrics.commits.value())
+        self.assertEqual(cache.hits, metrics.cache_hits.value())
+        self.assertGreater(metrics.cycle_seconds.value(), 0)
+        self.assertIn('rss_feed_entries_total{feed="' + urls[0] + '"} 5\n', metrics.render())
@@ -1,13 +1,21 @@
 import feedparser
-from flow import ORMSessionSQLAlchemy
+import io
+from flow import LRUCache, ORMSessionSQLAlchemy, current_session
 import os
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
 import sys
 import time
 import unittest
-from ..model import Base, Tag, Post, User
-from ..workflow import feed_extractor
+from unittest import mock
+from .. import feeds
+from ..model import Base, DeadLetter, Feed, Tag, Post, User
+from ..known import BloomFilter, KnownGuids
+from ..main import make_pool, poll, replay_dead_letters, store_records, store_stream
+from ..metrics import RssMetrics
+from ..scheduler import FeedScheduler
+from ..stream import iter_entries
+from ..workflow import build_feed_extractor, feed_extractor
 
 
 class RssFeedTest(unittest.TestCase):
@@ -100,3 +108,499 @@ class RssFeedTest(unittest.TestCase):
             ['Математика', 'Python'],
         ]
         self.assertEqual(post_tag_names, true_post_tag_names)
+
+    def test_authors_and_tags_batch(self):
+        document = self.read_xml(os.path.join(os.path.dirname(__file__), 'data', 'habr_part1.xml'))
+        engine = create_engine('sqlite:///:memory:')
+        Session = sessionmaker(bind=engine)
+        Base.metadata.create_all(engine)
+        statements = []
+        event.listen(engine, 'before_cursor_execute', lambda *args: statements.append(args[2]))
+        with ORMSessionSQLAlchemy(Session()):
+            feed_extractor(document)
+        # authors of all entries are searched by one query, so are tags of all entries
+        self.assertEqual(1, len([statement for statement in statements if 'FROM users' in statement]))
+        self.assertEqual(1, len([statement for statement in statements if 'FROM tags ' in statement]))
+
+
+class GetOrCreateManyTest(unittest.TestCase):
+    def test_get_or_create_many(self):
+        engine = create_engine('sqlite:///:memory:')
+        Session = sessionmaker(bind=engine)
+        Base.metadata.create_all(engine)
+        session = Session()
+        session.add(Tag(name='Python'))
+        session.commit()
+
+        statements = []
+        event.listen(engine, 'before_cursor_execute', lambda *args: statements.append(args[2]))
+        orm_session = ORMSessionSQLAlchemy(session)
+        ret = orm_session.get_or_create_many(Tag, [{'name': 'Python'}, {'name': 'SQL'}, {'name': 'SQL'}])
+        # one select for all the keys
+        self.assertEqual(1, len(statements))
+
+        (python, python_created), (sql, sql_created), (sql2, sql2_created) = ret
+        self.assertEqual(('Python', False), (python.name, python_created))
+        self.assertEqual(('SQL', True), (sql.name, sql_created))
+        self.assertIs(sql, sql2)
+        self.assertFalse(sql2_created)
+
+        orm_session.commit()
+        self.assertEqual(['Python', 'SQL'], [tag.name for tag in session.query(Tag).order_by(Tag.id)])
+
+
+class IdentityCacheTest(unittest.TestCase):
+    def ingest(self, cache):
+        engine = create_engine('sqlite:///:memory:')
+        Session = sessionmaker(bind=engine)
+        Base.metadata.create_all(engine)
+        for filename in ['habr_part1.xml', 'habr_part2.xml']:
+            with open(os.path.join(os.path.dirname(__file__), 'data', filename)) as f:
+                document = feedparser.parse(f.read())
+            # every document is parsed within new session like rss_app does
+            with ORMSessionSQLAlchemy(Session(), cache=cache):
+                feed_extractor(document)
+
+        session = Session()
+        return ([user.name for user in session.query(User).order_by(User.id)],
+                [tag.name for tag in session.query(Tag).order_by(Tag.id)],
+                [(post.title, post.user.name, [tag.name for tag in post.tags])
+                 for post in session.query(Post).order_by(Post.id)])
+
+    def test_identity_cache(self):
+        cache = LRUCache(maxsize=100)
+        self.assertEqual(self.ingest(None), self.ingest(cache))
+        self.assertGreater(cache.hits, 0)
+
+    def statements(self, cache):
+        """Return SQL statements of the second poll"""
+        engine = create_engine('sqlite:///:memory:')
+        Session = sessionmaker(bind=engine)
+        Base.metadata.create_all(engine)
+        statements = []
+        event.listen(engine, 'before_cursor_execute', lambda *args: statements.append(args[2]))
+        for filename in ['habr_part1.xml', 'habr_part2.xml']:
+            with open(os.path.join(os.path.dirname(__file__), 'data', filename)) as f:
+                document = feedparser.parse(f.read())
+            del statements[:]
+            with ORMSessionSQLAlchemy(Session(), cache=cache):
+                feed_extractor(document)
+        return statements
+
+    def test_warm_cache(self):
+        cache = LRUCache(maxsize=100)
+        cached = self.statements(cache)
+        self.assertGreater(cache.hits, 0)
+        # cached keys aren't searched, committed instances aren't refreshed from DB
+        not_cached = self.statements(None)
+        self.assertLessEqual(len(cached), len(not_cached))
+        self.assertLess(*[sum(statement.count('?') for statement in statements if statement.startswith('SELECT'))
+                          for statements in (cached, not_cached)])
+        self.assertEqual([], [statement for statement in cached if 'WHERE users.id = ?' in statement or
+                              'WHERE tags.id = ?' in statement])
+
+    def test_bulk_rows_not_cached(self):
+        cache = LRUCache(maxsize=100)
+        self.ingest(cache)
+        # posts are written by bulk upsert, only users and tags are cached
+        self.assertGreater(len(cache), 0)
+        self.assertEqual(set(), {model for model, _ in cache._data} - {User, Tag})
+
+
+class BulkUpsertTest(unittest.TestCase):
+    def ingest(self, session_class):
+        engine = create_engine('sqlite:///:memory:')
+        Session = sessionmaker(bind=engine)
+        Base.metadata.create_all(engine)
+        inserted = []
+        for filename in ['habr_part1.xml', 'habr_part2.xml']:
+            with open(os.path.join(os.path.dirname(__file__), 'data', filename)) as f:
+                document = feedparser.parse(f.read())
+            orm_session = session_class(Session())
+            with orm_session:
+                feed_extractor(document)
+            inserted.append(orm_session.stats()['inserted'])
+
+        session = Session()
+        return inserted, [(post.guid, post.title, post.user.name, [tag.name for tag in post.tags])
+                          for post in session.query(Post).order_by(Post.id)]
+
+    def test_executemany_fallback(self):
+
+        class ExecutemanySession(ORMSessionSQLAlchemy):
+            def _dialect_insert(self):
+                return None
+
+        # posts are written by ON CONFLICT upsert on SQLite
+        inserted, posts = self.ingest(ORMSessionSQLAlchemy)
+        self.assertEqual((inserted, posts), self.ingest(ExecutemanySession))
+        # the first feed has a repeated entry, the second one has one new post
+        self.assertEqual([4, 1], inserted)
+
+
+class StreamTest(unittest.TestCase):
+    def test_entries(self):
+        for filename in ['habr_part1.xml', 'habr_part2.xml']:
+            path = os.path.join(os.path.dirname(__file__), 'data', filename)
+            with open(path) as f:
+                true_entries = feedparser.parse(f.read())['entries']
+            # small chunks split elements and texts
+            entries = list(iter_entries(path, chunk_size=100))
+            self.assertEqual(len(true_entries), len(entries))
+            for true_entry, entry in zip(true_entries, entries):
+                for key in ['id', 'title', 'link', 'author', 'published_parsed']:
+                    self.assertEqual(true_entry[key], entry[key])
+                self.assertEqual([tag['term'] for tag in true_entry['tags']], [tag['term'] for tag in entry['tags']])
+
+    def test_atom(self):
+        atom = b"""<?xml version="1.0" encoding="utf-8"?>
+            <feed xmlns="http://www.w3.org/2005/Atom">
+              <title>Example</title>
+              <entry>
+                <title>First</title>
+                <link rel="edit" href="http://example.org/edit/1"/>
+                <link href="http://example.org/1"/>
+                <id>urn:uuid:1</id>
+                <updated>2018-10-13T12:30:00+03:00</updated>
+                <author><name>alice</name></author>
+                <category term="python"/><category term="sql"/>
+              </entry>
+              <entry>
+                <title>Second</title>
+                <link rel="alternate" href="http://example.org/2"/>
+                <updated>bad date</updated>
+              </entry>
+            </feed>"""
+        first, second = iter_entries(io.BytesIO(atom))
+        self.assertEqual({'id': 'urn:uuid:1', 'title': 'First', 'link': 'http://example.org/1', 'author': 'alice',
+                          'tags': [{'term': 'python'}, {'term': 'sql'}],
+                          'updated_parsed': time.struct_time((2018, 10, 13, 9, 30, 0, 5, 286, 0))}, first)
+        self.assertEqual({'id': 'http://example.org/2', 'title': 'Second', 'link': 'http://example.org/2', 'tags': []},
+                         second)
+
+    def test_url_timeout(self):
+        document = b'<rss><channel><item><guid>1</guid></item></channel></rss>'
+        with mock.patch('urllib.request.urlopen', return_value=io.BytesIO(document)) as urlopen:
+            self.assertEqual([{'id': '1', 'tags': []}], list(iter_entries('http://example.org/rss', timeout=5)))
+        urlopen.assert_called_once_with('http://example.org/rss', timeout=5)
+
+    def test_entries_are_dropped(self):
+        items = ''.join('<item><guid>{}</guid><title>post</title></item>'.format(i) for i in range(1000))
+        document = '<rss><channel><title>big</title>{}</channel></rss>'.format(items).encode('utf-8')
+        entries = iter_entries(io.BytesIO(document), chunk_size=1000)
+        next(entries)
+        frame = entries.gi_frame
+        channel = frame.f_locals['path'][-1]
+        self.assertEqual(1000, 1 + sum(1 for _ in entries))
+        # channel keeps its own elements only
+        self.assertEqual(['title'], [el.tag for el in channel])
+
+    def test_store_stream(self):
+        engine = create_engine('sqlite:///:memory:')
+        Session = sessionmaker(bind=engine)
+        Base.metadata.create_all(engine)
+        session = Session()
+        known_guids = KnownGuids()
+        for filename in ['habr_part1.xml', 'habr_part2.xml']:
+            path = os.path.join(os.path.dirname(__file__), 'data', filename)
+            with open(path, 'rb') as f:
+                self.assertEqual(len(list(iter_entries(path))), store_stream(f, session, batch_size=2))
+        store_stream(path, Session(), known_guids=known_guids)
+
+        posts = [(post.guid, post.title, post.user.name, [tag.name for tag in post.tags])
+                 for post in Session().query(Post).order_by(Post.id)]
+        self.assertEqual(BulkUpsertTest().ingest(ORMSessionSQLAlchemy)[1], posts)
+        self.assertEqual({entry['id'] for entry in iter_entries(path)}, set(known_guids.guids))
+
+    def test_store_stream_pipeline(self):
+        engine = create_engine('sqlite:///:memory:')
+        Session = sessionmaker(bind=engine)
+        Base.metadata.create_all(engine)
+        known_guids = KnownGuids()
+        for filename in ['habr_part1.xml', 'habr_part2.xml']:
+            path = os.path.join(os.path.dirname(__file__), 'data', filename)
+            count = store_stream(path, Session(), batch_size=2, pipeline=True)
+            self.assertEqual(len(list(iter_entries(path))), count)
+        store_stream(path, Session(), known_guids=known_guids, pipeline=True)
+
+        posts = [(post.guid, post.title, post.user.name, [tag.name for tag in post.tags])
+                 for post in Session().query(Post).order_by(Post.id)]
+        self.assertEqual(BulkUpsertTest().ingest(ORMSessionSQLAlchemy)[1], posts)
+        self.assertEqual({entry['id'] for entry in iter_entries(path)}, set(known_guids.guids))
+
+
+class ChunkedCommitTest(unittest.TestCase):
+    def ingest(self, **kwargs):
+        engine = create_engine('sqlite:///:memory:')
+        Session = sessionmaker(bind=engine)
+        Base.metadata.create_all(engine)
+        session = Session()
+        stats = []
+        for filename in ['habr_part1.xml', 'habr_part2.xml']:
+            with open(os.path.join(os.path.dirname(__file__), 'data', filename)) as f:
+                document = feedparser.parse(f.read())
+            orm_session = ORMSessionSQLAlchemy(session, **kwargs)
+            with orm_session:
+                feed_extractor(document)
+            stats.append(orm_session.stats())
+
+        session = Session()
+        return stats, [(post.guid, post.title, post.user.name, [tag.name for tag in post.tags])
+                       for post in session.query(Post).order_by(Post.id)]
+
+    def test_chunked_commit(self):
+        _, true_posts = self.ingest()
+        for kwargs in [{'commit_every': 3}, {'commit_every': 3, 'expunge': True},
+                       {'commit_every': 3, 'savepoints': True, 'expunge': True}]:
+            stats, posts = self.ingest(**kwargs)
+            self.assertEqual(true_posts, posts)
+            self.assertGreater(stats[0]['chunks'], 1)
+            self.assertGreater(stats[0]['flushes'], 0)
+            self.assertEqual(0, stats[0]['rolled_back_chunks'])
+
+    def test_bad_chunk(self):
+        engine = create_engine('sqlite:///:memory:')
+        Session = sessionmaker(bind=engine)
+        Base.metadata.create_all(engine)
+        session = Session()
+        with self.assertRaises(ValueError):
+            with ORMSessionSQLAlchemy(session, commit_every=1, savepoints=True):
+                for name in ['Python', 'SQL', None]:
+                    if name is None:
+                        raise ValueError('bad tag')
+                    session.add(Tag(name=name))
+                    current_session().track()
+        # finished chunks are kept
+        self.assertEqual(['Python', 'SQL'], [tag.name for tag in Session().query(Tag).order_by(Tag.id)])
+
+
+class DeadLettersTest(unittest.TestCase):
+    def test_dead_letters(self):
+        engine = create_engine('sqlite:///:memory:')
+        Session = sessionmaker(bind=engine)
+        Base.metadata.create_all(engine)
+        # user name can't be NULL, so the third record fails
+        records = [{'id': str(i), 'title': 'Post {}'.format(i), 'link': 'https://habr.com/{}'.format(i),
+                    'published_parsed': None, 'author': 'user' if i != 2 else None, 'tags': ['Python', 'SQL']}
+                   for i in range(4)]
+        with self.assertRaises(Exception):
+            # records are changed in place by the loader
+            store_records([dict(record) for record in records], Session())
+
+        known_guids = KnownGuids()
+        store_records(records, Session(), known_guids=known_guids, error_policy={'errors': 'skip'})
+        session = Session()
+        self.assertEqual(['0', '1', '3'], [post.guid for post in session.query(Post).order_by(Post.id)])
+        self.assertEqual(['Python', 'SQL'], [tag.name for tag in session.query(Tag).order_by(Tag.id)])
+        self.assertEqual(['user'], [user.name for user in session.query(User)])
+        # failed record isn't known, so it isn't skipped later
+        self.assertEqual({'0', '1', '3'}, set(known_guids.guids))
+        letters = session.query(DeadLetter).all()
+        self.assertEqual(1, len(letters))
+        self.assertEqual('records', letters[0].stage)
+        self.assertIn('IntegrityError', letters[0].error)
+        self.assertEqual(records[2], letters[0].item)
+        session.close()
+
+        # failing again record is kept
+        self.assertEqual(1, replay_dead_letters(Session()))
+        session = Session()
+        self.assertEqual(1, session.query(DeadLetter).count())
+        letter = session.query(DeadLetter).one()
+        letter.item = dict(letter.item, author='admin')
+        session.commit()
+
+        self.assertEqual(1, replay_dead_letters(Session(), error_policy={'errors': 'retry', 'retries': 1}))
+        session = Session()
+        self.assertEqual(0, session.query(DeadLetter).count())
+        self.assertEqual(['0', '1', '3', '2'], [post.guid for post in session.query(Post).order_by(Post.id)])
+        self.assertEqual('admin', session.query(Post).filter(Post.guid == '2').one().user.name)
+
+
+class PollTest(unittest.TestCase):
+    def test_poll(self):
+        engine = create_engine('sqlite:///:memory:')
+        Session = sessionmaker(bind=engine)
+        Base.metadata.create_all(engine)
+        session = Session()
+
+        # feedparser accepts file paths as well as urls
+        urls = [os.path.join(os.path.dirname(__file__), 'data', filename)
+                for filename in ['habr_part1.xml', 'habr_part2.xml']]
+        self.assertEqual(2, poll(urls, session, workers=2))
+
+        self.assertEqual(5, session.query(Post).count())
+        self.assertEqual(5, session.query(User).count())
+        self.assertEqual(18, session.query(Tag).count())
+
+        # feeds aren't changed, so they are skipped by content hash
+        self.assertEqual(0, poll(urls, Session(), workers=2))
+        self.assertEqual(2, session.query(Feed).filter(Feed.content_hash.isnot(None)).count())
+
+    def test_poll_processes(self):
+        engine = create_engine('sqlite:///:memory:')
+        Session = sessionmaker(bind=engine)
+        Base.metadata.create_all(engine)
+        session = Session()
+
+        urls = [os.path.join(os.path.dirname(__file__), 'data', filename)
+                for filename in ['habr_part1.xml', 'habr_part2.xml']]
+        # feeds are parsed by worker processes, records are stored by this one
+        self.assertEqual(2, poll(urls, session, processes=2))
+        self.assertEqual(5, session.query(Post).count())
+        self.assertEqual(5, session.query(User).count())
+        self.assertEqual(18, session.query(Tag).count())
+        self.assertEqual(0, poll(urls, Session(), processes=2))
+
+    def test_poll_pool(self):
+        engine = create_engine('sqlite:///:memory:')
+        Session = sessionmaker(bind=engine)
+        Base.metadata.create_all(engine)
+
+        urls = [os.path.join(os.path.dirname(__file__), 'data', filename)
+                for filename in ['habr_part1.xml', 'habr_part2.xml']]
+        # worker processes are started once and used by every poll
+        with make_pool(processes=2) as pool:
+            self.assertEqual(2, poll(urls, Session(), processes=2, pool=pool))
+            self.assertEqual(0, poll(urls, Session(), processes=2, pool=pool))
+            # pool isn't shut down by poll
+            self.assertNotEqual(os.getpid(), pool.submit(os.getpid).result())
+
+    def test_poll_scheduled(self):
+        engine = create_engine('sqlite:///:memory:')
+        Session = sessionmaker(bind=engine)
+        Base.metadata.create_all(engine)
+
+        path = os.path.join(os.path.dirname(__file__), 'data', 'habr_part1.xml')
+        broken = 'http://example.com/rss'
+        scheduler = FeedScheduler([path, broken], period=60, min_period=10, max_period=600, jitter=0)
+        urls = scheduler.pop_due(time.time() + 60)
+
+        original_download = feeds.download
+
+        def download(url, etag=None, modified=None):
+            if url == broken:
+                raise IOError('connection refused')
+            return original_download(url, etag, modified)
+
+        feeds.download = download
+        try:
+            self.assertEqual(1, poll(urls, Session(), scheduler=scheduler))
+        finally:
+            feeds.download = original_download
+        # changed feed is polled more often, interval of the broken one is kept
+        self.assertEqual(30, scheduler.intervals[path])
+        self.assertEqual(60, scheduler.intervals[broken])
+
+        poll(scheduler.pop_due(time.time() + 600), Session(), scheduler=scheduler)
+        self.assertEqual(45, scheduler.intervals[path])
+
+    def test_not_modified(self):
+        engine = create_engine('sqlite:///:memory:')
+        Session = sessionmaker(bind=engine)
+        Base.metadata.create_all(engine)
+        session = Session()
+        session.add(Feed(url='http://example.com/rss', etag='"abc"', content_hash='0'))
+        session.commit()
+
+        requests = []
+
+        def download(url, etag=None, modified=None):
+            requests.append((url, etag, modified))
+            return b'', feedparser.FeedParserDict(status=304, entries=[])
+
+        original_download = feeds.download
+        feeds.download = download
+        try:
+            self.assertEqual(0, poll(['http://example.com/rss'], session))
+        finally:
+            feeds.download = original_download
+        # validators of stored version are sent
+        self.assertEqual([('http://example.com/rss', '"abc"', None)], requests)
+
+    def test_download_timeout(self):
+        with mock.patch('http.client.HTTPConnection.connect', autospec=True,
+                        side_effect=TimeoutError('timed out')) as connect:
+            content, response = feeds.download('http://example.com/rss', timeout=5)
+        self.assertEqual(5, connect.call_args[0][0].timeout)
+        self.assertEqual(b'', content)
+        self.assertTrue(response['bozo'])
+
+    def test_fetch_error(self):
+        engine = create_engine('sqlite:///:memory:')
+        Session = sessionmaker(bind=engine)
+        Base.metadata.create_all(engine)
+        session = Session()
+        urls = ['http://example.com/500', 'http://example.com/down']
+        session.add_all([Feed(url=url, etag='"abc"', modified='Mon, 15 Oct 2018', content_hash='0') for url in urls])
+        session.commit()
+
+        def download(url, etag=None, modified=None):
+            if url == urls[0]:
+                return b'', feedparser.FeedParserDict(status=500, etag='"new"', entries=[], bozo=0)
+            return b'', feedparser.FeedParserDict(entries=[], bozo=1, bozo_exception=IOError('connection refused'))
+
+        scheduler = FeedScheduler(urls, period=60, min_period=10, max_period=600, jitter=0)
+        metrics = RssMetrics()
+        original_download = feeds.download
+        feeds.download = download
+        try:
+            self.assertEqual(0, poll(scheduler.pop_due(time.time() + 60), session, scheduler=scheduler,
+                                     metrics=metrics))
+        finally:
+            feeds.download = original_download
+        # the last stored version and poll interval are kept
+        for feed in Session().query(Feed):
+            self.assertEqual(('"abc"', 'Mon, 15 Oct 2018', '0'), (feed.etag, feed.modified, feed.content_hash))
+            self.assertEqual(60, scheduler.intervals[feed.url])
+        self.assertEqual(2, metrics.errors.value(stage='fetch'))
+        self.assertEqual(1, metrics.polls.value(feed=urls[0], status='error'))
+
+
+class KnownGuidsTest(unittest.TestCase):
+    def test_bloom_filter(self):
+        bloom = BloomFilter(capacity=1000, error_rate=0.01)
+        for i in range(1000):
+            bloom.add('guid{}'.format(i))
+        self.assertTrue(all('guid{}'.format(i) in bloom for i in range(1000)))
+        false_positives = sum('other{}'.format(i) in bloom for i in range(10000))
+        self.assertLess(false_positives, 300)
+
+    def ingest(self, known_guids):
+        engine = create_engine('sqlite:///:memory:')
+        Session = sessionmaker(bind=engine)
+        Base.metadata.create_all(engine)
+        session = Session()
+        workflow = build_feed_extractor(known_guids)
+        for filename in ['habr_part1.xml', 'habr_part2.xml']:
+            with open(os.path.join(os.path.dirname(__file__), 'data', filename)) as f:
+                document = feedparser.parse(f.read())
+            with ORMSessionSQLAlchemy(session):
+                workflow(document)
+            known_guids.update(entry.id for entry in document.entries)
+        return session
+
+    def check(self, known_guids):
+        session = self.ingest(known_guids)
+        self.assertEqual(5, session.query(Post).count())
+        # updates of already stored posts are skipped
+        post_user_names = [post.user.name for post in session.query(Post).order_by(Post.id)]
+        self.assertEqual(['altrus', 'SLY_G', 'SLY_G', 'Batin', 'helenblack'], post_user_names)
+
+        # guids of stored posts are loaded on start
+        warmed = KnownGuids()
+        warmed.warm(session, Post)
+        self.assertEqual(5, len(warmed.guids))
+        self.assertTrue(all(post.guid in warmed for post in session.query(Post)))
+
+    def test_set(self):
+        self.check(KnownGuids())
+
+    def test_bloom(self):
+        self.check(KnownGuids(bloom_capacity=100))
+
+    def test_bloom_false_positives(self):
+        # every guid is possibly known, so all of them are confirmed by DB
+        known_guids = KnownGuids(bloom_capacity=1)
+        known_guids.guids.bits = bytearray(b'\xff' * len(known_guids.guids.bits))
+        self.assertEqual(5, self.ingest(known_guids).query(Post).count())
@@ -0,0 +1,57 @@
+import random
+import unittest
+from ..scheduler import FeedScheduler
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class FeedSchedulerTest(unittest.TestCase):
+    def test_start_is_spread(self):
+        clock = FakeClock()
+        urls = ['feed{}'.format(i) for i in range(100)]
+        scheduler = FeedScheduler(urls, period=60, clock=clock, rand=random.Random(0))
+        self.assertEqual(100, len(scheduler))
+        first_half = scheduler.pop_due(clock.now + 30)
+        # about a half of feeds are due in the first half of period
+        self.assertTrue(30 < len(first_half) < 70)
+        self.assertEqual(urls, sorted(first_half + scheduler.pop_due(clock.now + 60), key=urls.index))
+        self.assertEqual(0, len(scheduler))
+
+    def test_adaptive_interval(self):
+        clock = FakeClock()
+        scheduler = FeedScheduler(['fast', 'slow'], period=60, min_period=10, max_period=600, jitter=0,
+                                  clock=clock, rand=random.Random(0))
+        while clock.now < 10000:
+            clock.now += scheduler.sleep_time()
+            for url in scheduler.pop_due():
+                scheduler.reschedule(url, changed=url == 'fast')
+        self.assertEqual(10, scheduler.intervals['fast'])
+        self.assertEqual(600, scheduler.intervals['slow'])
+        # loop sleeps exactly until the next due feed
+        clock.now += scheduler.sleep_time()
+        self.assertTrue(scheduler.pop_due())
+
+    def test_jitter(self):
+        clock = FakeClock()
+        scheduler = FeedScheduler(['feed'], period=100, jitter=0.2, clock=clock, rand=random.Random(0))
+        times = []
+        for _ in range(50):
+            url, = scheduler.pop_due(clock.now + 1000)
+            scheduler.reschedule(url, changed=False)
+            times.append(scheduler.next_time() - clock.now)
+        self.assertTrue(all(80 <= t <= 120 for t in times))
+        self.assertGreater(len(set(times)), 1)
+
+    def test_errors(self):
+        with self.assertRaises(ValueError):
+            FeedScheduler(['feed'], period=60, min_period=120)
+        scheduler = FeedScheduler(['feed'], period=60)
+        self.assertIn('feed', scheduler)
+        with self.assertRaises(ValueError):
+            scheduler.reschedule('feed', changed=True)
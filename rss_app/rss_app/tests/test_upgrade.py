@@ -0,0 +1,69 @@
+from datetime import datetime
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import sessionmaker
+import unittest
+from ..model import Base, Post, Tag, User
+from ..upgrade import missing_indexes, upgrade
+
+
+class UpgradeTest(unittest.TestCase):
+    def old_db(self):
+        """Return engine of DB created by previous version: without indexes of natural keys"""
+        engine = create_engine('sqlite:///:memory:')
+        Base.metadata.create_all(engine)
+        with engine.begin() as connection:
+            for index in [index for table in Base.metadata.sorted_tables for index in table.indexes]:
+                connection.execute(text('DROP INDEX {}'.format(index.name)))
+        return engine
+
+    def test_upgrade(self):
+        engine = self.old_db()
+        self.assertEqual(['ix_post_tags_tag_id', 'ix_posts_date', 'ix_tags_name', 'ix_users_name'],
+                         sorted(index.name for index in missing_indexes(engine)))
+        Session = sessionmaker(bind=engine)
+        session = Session()
+        users = [User('alice'), User('bob'), User('alice'), User('alice')]
+        tags = [Tag(name='Python'), Tag(name='SQL'), Tag(name='Python')]
+        session.add_all(users + tags)
+        session.flush()
+        session.add_all([
+            Post(guid='1', title='first', date=datetime(2018, 10, 16), user=users[0], tags=[tags[0], tags[2]]),
+            Post(guid='2', title='second', date=datetime(2018, 10, 17), user=users[2], tags=[tags[2], tags[1]]),
+            Post(guid='3', title='third', date=datetime(2018, 10, 18), user=users[3], tags=[]),
+            Post(guid='4', title='fourth', date=datetime(2018, 10, 19), user=users[1], tags=[tags[0]]),
+        ])
+        session.commit()
+
+        stats = upgrade(engine)
+        self.assertEqual(2, stats['merged_users'])
+        self.assertEqual(1, stats['merged_tags'])
+        self.assertEqual(['ix_post_tags_tag_id', 'ix_posts_date', 'ix_tags_name', 'ix_users_name'],
+                         sorted(stats['created_indexes']))
+        self.assertEqual([], missing_indexes(engine))
+
+        session = Session()
+        self.assertEqual([('alice', 3), ('bob', 1)],
+                         [(user.name, len(user.posts)) for user in session.query(User).order_by(User.id)])
+        self.assertEqual([('Python', ['1', '2', '4']), ('SQL', ['2'])],
+                         [(tag.name, sorted(post.guid for post in tag.post))
+                          for tag in session.query(Tag).order_by(Tag.id)])
+        self.assertEqual([['Python'], ['Python', 'SQL'], [], ['Python']],
+                         [sorted(tag.name for tag in post.tags) for post in session.query(Post).order_by(Post.id)])
+        session.close()
+
+        indexes = {index['name']: index for index in inspect(engine).get_indexes('users')}
+        self.assertTrue(indexes['ix_users_name']['unique'])
+        session = Session()
+        session.add(User('bob'))
+        with self.assertRaises(IntegrityError):
+            session.commit()
+        session.rollback()
+
+        # upgraded DB isn't changed
+        self.assertEqual({'merged_users': 0, 'merged_tags': 0, 'created_indexes': []}, upgrade(engine))
+
+    def test_new_db(self):
+        engine = create_engine('sqlite:///:memory:')
+        self.assertEqual({'merged_users': 0, 'merged_tags': 0, 'created_indexes': []}, upgrade(engine))
+        self.assertEqual([], missing_indexes(engine))
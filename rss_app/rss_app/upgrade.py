@@ -0,0 +1,83 @@
+from sqlalchemy import func, inspect, select
+from .model import Base, Post, Tag, User, post_tags_table
+
+
+def missing_indexes(engine):
+    """Return list of indexes of the model which aren't created in DB of `engine` yet"""
+    inspector = inspect(engine)
+    tables = set(inspector.get_table_names())
+    missing = []
+    for table in Base.metadata.sorted_tables:
+        if table.name not in tables:
+            continue
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        missing.extend(index for index in sorted(table.indexes, key=lambda index: index.name)
+                       if index.name not in existing)
+    return missing
+
+
+def upgrade(engine):
+    """Upgrade DB of `engine` created by previous versions of rss_app to the current model in place
+
+    `Base.metadata.create_all` creates missing tables only, so indexes added to existing tables are created
+    here. Names of users and tags weren't unique before, so duplicates are merged into the first created
+    row before unique indexes are built: posts of duplicate users and tags are moved to it. All changes are
+    done in one transaction. Returns dict with numbers of `merged_users`, `merged_tags` and names
+    of `created_indexes`
+    """
+    Base.metadata.create_all(engine)
+    indexes = missing_indexes(engine)
+    with engine.begin() as connection:
+        stats = {
+            'merged_users': _merge_users(connection),
+            'merged_tags': _merge_tags(connection),
+            'created_indexes': [],
+        }
+        for index in indexes:
+            index.create(connection)
+            stats['created_indexes'].append(index.name)
+    return stats
+
+
+def _duplicates(connection, table):
+    """Return dict id of the first row -> ids of the other rows with the same name"""
+    names = select(table.c.name).group_by(table.c.name).having(func.count() > 1)
+    rows = connection.execute(select(table.c.id, table.c.name).where(table.c.name.in_(names)).order_by(table.c.id))
+    first = {}
+    duplicates = {}
+    for row_id, name in rows:
+        if name in first:
+            duplicates.setdefault(first[name], []).append(row_id)
+        else:
+            first[name] = row_id
+    return duplicates
+
+
+def _merge_users(connection):
+    users = User.__table__
+    posts = Post.__table__
+    merged = 0
+    for user_id, duplicate_ids in _duplicates(connection, users).items():
+        connection.execute(posts.update().where(posts.c.user_id.in_(duplicate_ids)).values(user_id=user_id))
+        connection.execute(users.delete().where(users.c.id.in_(duplicate_ids)))
+        merged += len(duplicate_ids)
+    return merged
+
+
+def _merge_tags(connection):
+    tags = Tag.__table__
+    merged = 0
+    for tag_id, duplicate_ids in _duplicates(connection, tags).items():
+        linked = _post_ids(connection, post_tags_table.c.tag_id == tag_id)
+        moved = _post_ids(connection, post_tags_table.c.tag_id.in_(duplicate_ids))
+        connection.execute(post_tags_table.delete().where(post_tags_table.c.tag_id.in_(duplicate_ids)))
+        if moved - linked:
+            connection.execute(post_tags_table.insert(),
+                               [{'post_id': post_id, 'tag_id': tag_id} for post_id in sorted(moved - linked)])
+        connection.execute(tags.delete().where(tags.c.id.in_(duplicate_ids)))
+        merged += len(duplicate_ids)
+    return merged
+
+
+def _post_ids(connection, condition):
+    return {row[0] for row in connection.execute(select(post_tags_table.c.post_id).where(condition))}
@@ -1,5 +1,8 @@
 from datetime import datetime
-from flow import GetField, FieldsTransform, ModelObjectCreate, Lambda, Action
+from flow import GetField, FieldsTransform, ModelObjectCreate, Action, Project, Root, current_session
+from flow.analysis import custom_fields_functions, prune_fields
+from flow.errors import ErrorPolicy
+from .deadletters import DeadLetterTable
 from .model import User, Post, Tag
 
 
@@ -23,20 +26,156 @@ class RenameFields(Action):
                 data[new] = data.pop(old)
         return data
 
+    def do_batch(self, items):
+        for old, new in self.fields_map.items():
+            for data in items:
+                if old in data:
+                    data[new] = data.pop(old)
+        return items
+
+
+def _fields_RenameFields(action, next_fields):
+    """Fields read by `RenameFields`, see `flow.analysis`"""
+    fields = next_fields()
+    if fields is None or action.for_each_action is not None:
+        return None
+    # new name is kept as well, since data could have it instead of the old one
+    return fields | {old for old, new in action.fields_map.items() if new in fields}
+
+
+custom_fields_functions['RenameFields'] = _fields_RenameFields
+
 
-_transform = FieldsTransform(
+class SkipKnownEntries(Action):
+    """SkipKnownEntries drops feed entries of already stored posts
+
+    It is supposed to be the first stage of workflow, so known entries don't cost any transform or DB work.
+    Note that changes of already stored posts aren't applied in this case.
+    """
+    def __init__(self, known_guids):
+        """
+        Parameters
+        ----------
+        known_guids : KnownGuids - guids of stored posts
+        """
+        super(SkipKnownEntries, self).__init__()
+        self.known_guids = known_guids
+
+    def do(self, data):
+        return self.known_guids.filter_new(data, confirm=_stored_guids)
+
+
+def _stored_guids(guids, chunk_size=500):
+    """Return set of `guids` stored in DB, used to confirm Bloom filter positives"""
+    session = current_session()
+    if session is None:
+        return set()
+    stored = set()
+    for start in range(0, len(guids), chunk_size):
+        query = session.session.query(Post.guid).filter(Post.guid.in_(guids[start:start + chunk_size]))
+        stored.update(guid for guid, in query)
+    return stored
+
+
+# transformations not touching DB, they could be run in worker processes
+_parse = FieldsTransform(
     {'published_parsed': lambda struct_time: datetime(*struct_time[:6]),
-     'author': ModelObjectCreate(orm_model=User, fields=['name'], unique=['name']),
-     'tags': Lambda(lambda ll: [el['term'] for el in ll]).for_each(ModelObjectCreate(orm_model=Tag,
-                                                                                     fields=['name'],
-                                                                                     unique=['name'])).root})
+     'tags': lambda ll: [el['term'] for el in ll]})
+
+# entry fields used by `_load` and `_store`, records are compact and picklable
+_record_fields = ['id', 'title', 'link', 'published_parsed', 'author', 'tags']
+
+
+_load = FieldsTransform(
+    {'author': ModelObjectCreate(orm_model=User, fields=['name'], unique=['name'], batch=True),
+     'tags': Root().for_each(ModelObjectCreate(orm_model=Tag,
+                                               fields=['name'],
+                                               unique=['name'],
+                                               batch=True)).root})
 
 _store = ModelObjectCreate(orm_model=Post,
                            fields=['title', 'guid', 'link', 'date', 'user', 'tags'],
                            fields_map={'guid': 'id', 'date': 'published_parsed', 'user': 'author'},
-                           unique=['guid'])
+                           unique=['guid'], bulk=True)
+
+
+def _extract(known_guids):
+    """Return action after which the entries are turned into records"""
+    entries = GetField('entries')
+    if known_guids is not None:
+        entries = entries.then(SkipKnownEntries(known_guids))
+    entries.for_each(RenameFields({'updated_parsed': 'published_parsed'})).then(_parse).then(Project(_record_fields))
+    return entries
+
+
+def build_record_extractor(known_guids=None):
+    """
+    Build workflow turning feed document into list of records. It doesn't use DB, so it could be run
+    out of ORMSessionBase context, records are picklable and could be passed to another process
+
+    Parameters
+    ----------
+    known_guids : KnownGuids - if not None, entries with known guids are dropped before processing
+    """
+    return prune_fields(_extract(known_guids).root)
+
+
+def _unload(record):
+    """Inverse of `_load`: replace ORM objects of loaded record by their names"""
+    record = dict(record)
+    if isinstance(record.get('author'), User):
+        record['author'] = record['author'].name
+    if record.get('tags'):
+        record['tags'] = [tag.name if isinstance(tag, Tag) else tag for tag in record['tags']]
+    return record
+
+
+def build_record_loader(known_guids=None, errors=None, retries=None):
+    """
+    Build workflow storing records made by `build_record_extractor` workflow
+
+    Parameters
+    ----------
+    known_guids : KnownGuids - if not None, records with known guids are dropped before processing
+    errors : str - how failed records are handled: 'raise' (default) fails the whole list, 'skip' and 'retry'
+        store failed records to `dead_letters` table (stage 'records') and the rest are stored as usual,
+        see `flow.errors.ErrorPolicy`
+    retries : int - max number of retries of failed record in 'retry' mode
+    """
+    records = Root()
+    if known_guids is not None:
+        records = records.then(SkipKnownEntries(known_guids))
+    load_errors = store_errors = None
+    if errors is not None:
+        retries = retries if errors == 'retry' else None
+        # records are changed by `_load` in place, so copies are loaded
+        load_errors = ErrorPolicy(errors, retries, dead_letters=DeadLetterTable('records'), savepoints=True,
+                                  copy=dict)
+        # loaded records are stored as raw ones, so both stages are replayed by this workflow.
+        # Records are copied, so posts are written by one bulk upsert unless some record fails
+        store_errors = ErrorPolicy(errors, retries, dead_letters=DeadLetterTable('records', encode=_unload),
+                                   savepoints=True, copy=dict)
+    records.for_each(_load, errors=load_errors)
+    # posts of all entries are written at once by bulk upsert
+    records.then(Root().for_each(_store, errors=store_errors).root)
+    return records.root
+
+
+def build_feed_extractor(known_guids=None, errors=None, retries=None):
+    """
+    Build workflow storing feed entries
+
+    Parameters
+    ----------
+    known_guids : KnownGuids - if not None, entries with known guids are dropped before processing
+    errors : str - how records failed to be stored are handled, see `build_record_loader`
+    retries : int - max number of retries of failed record in 'retry' mode
+    """
+    entries = _extract(known_guids)
+    entries.then(build_record_loader(errors=errors, retries=retries))
+    return prune_fields(entries.root)
+
 
-feed_extractor = GetField('entries')\
-                    .for_each(RenameFields({'updated_parsed': 'published_parsed'}))\
-                    .then(_transform)\
-                    .then(_store).root
+feed_extractor = build_feed_extractor()
+record_extractor = build_record_extractor()
+record_loader = build_record_loader()
@@ -3,13 +3,15 @@ import rss_app
 from setuptools import setup, find_packages
 import sys
 
-if sys.version_info < (3, 5):
-    sys.exit('Sorry, Python < 3.5 is not supported')
+# executors are shut down by `Executor.shutdown(cancel_futures=True)`, added in Python 3.9
+if sys.version_info < (3, 9):
+    sys.exit('Sorry, Python < 3.9 is not supported')
 
 setup(
     name='rss_app',
     version=rss_app.__version__,
     packages=find_packages(),
+    python_requires='>=3.9',
     long_description=open(join(dirname(__file__), 'README.md'), encoding='utf-8').read(),
     entry_points={
         'console_scripts': [
@@ -18,8 +20,8 @@ setup(
     },
     install_requires=[
         'flow==0.1.0',
-        'feedparser==5.2.1',
-        'sqlalchemy==1.1.18',
+        'feedparser>=6.0,<7',
+        'sqlalchemy>=1.4',
     ],
     test_suite='rss_app.tests',
     tests_require=[